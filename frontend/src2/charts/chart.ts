@@ -88,6 +88,7 @@ function makeChart(name: string) {
 
 		dataQuery.value.setOperations(copy(query.doc.operations))
 		dataQuery.value.doc.use_live_connection = query.doc.use_live_connection
+		dataQuery.value.doc.materialize_on_read = query.doc.materialize_on_read
 		return dataQuery.value.execute(force, chart.doc.config.limit)
 	}
 
@@ -205,16 +205,72 @@ function makeDashboard(name: string) {
 		})
 	}
 
-	function refresh(force = false) {
-		dashboard.doc.items
+	async function refresh(force = false) {
+		await waitUntil(() => dashboard.isloaded)
+		const chartNames = dashboard.doc.items
 			.filter((item) => item.type === 'chart')
-			.forEach((item) => refreshChart(item.chart, force))
+			.map((item) => item.chart)
+		return refreshCharts(chartNames, force)
 	}
 
-	function refreshChart(chart_name: string, force = false) {
+	// charts whose results are being fetched in one request with the other charts
+	const pendingChartResults = new Map<string, Promise<boolean>>()
+
+	function refreshCharts(chartNames: string[], force = false) {
+		const adhocFilters = Object.fromEntries(
+			chartNames.map((chart_name) => [chart_name, getAdhocFilters(chart_name)])
+		)
+		const request = fetchChartResults(chartNames, adhocFilters, force)
+		return Promise.all(
+			chartNames.map((chart_name) => {
+				const served = request.then((results) =>
+					setChartResults(chart_name, results[chart_name], adhocFilters[chart_name])
+				)
+				pendingChartResults.set(chart_name, served)
+				return served.then((wasServed) => {
+					if (pendingChartResults.get(chart_name) === served) {
+						pendingChartResults.delete(chart_name)
+					}
+					// executes on its own if it was not served, or has changed since it was saved
+					return refreshChart(chart_name, force && !wasServed)
+				})
+			})
+		)
+	}
+
+	function fetchChartResults(
+		chartNames: string[],
+		adhocFilters: Record<string, AdhocFilters | undefined>,
+		force = false
+	): Promise<Record<string, any>> {
+		if (!chartNames.length || dashboard.islocal) return Promise.resolve({})
+		return dashboard
+			.call('get_chart_results', {
+				charts: chartNames,
+				adhoc_filters: adhocFilters,
+				force: Boolean(force),
+			})
+			.catch(() => ({}))
+	}
+
+	async function setChartResults(chart_name: string, result: any, adhocFilters?: AdhocFilters) {
+		if (!result || result.error) return false
+
+		const chart = useChart(chart_name)
+		await waitUntil(() => chart.isloaded && chart.dataQuery.isloaded)
+		chart.dataQuery.adhocFilters = adhocFilters
+		chart.dataQuery.setResults(result, chart.doc.config.limit || 100)
+		return true
+	}
+
+	async function refreshChart(chart_name: string, force = false) {
+		const pending = pendingChartResults.get(chart_name)
+		if (pending) {
+			await pending
+		}
 		const chart = useChart(chart_name)
 		chart.dataQuery.adhocFilters = getAdhocFilters(chart_name)
-		chart.refresh(force)
+		return chart.refresh(force)
 	}
 
 	function getAdhocFilters(chart_name: string, exclude_filter_name?: string) {
@@ -288,7 +344,7 @@ function makeDashboard(name: string) {
 		const filteredCharts = Object.keys(filterItem.links).filter(
 			(chart_name) => filterItem.links[chart_name]
 		)
-		filteredCharts.forEach((chart_name) => refreshChart(chart_name))
+		refreshCharts(filteredCharts)
 	}
 
 	function getColumnFromFilterLink(linkedColumn: string) {
@@ -387,6 +443,7 @@ function makeDashboard(name: string) {
 		normalizeLayout,
 
 		refresh,
+		refreshCharts,
 		refreshChart,
 
 		getAdhocFilters,
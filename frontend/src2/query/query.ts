@@ -8,6 +8,7 @@ import {
 	copyToClipboard,
 	getUniqueId,
 	safeJSONParse,
+	showErrorToast,
 	waitUntil,
 	watchToggle,
 	wheneverChanges,
@@ -19,6 +20,7 @@ import { createToast } from '../helpers/toasts'
 import { __ } from '../translation'
 import router from '../router'
 import session from '../session'
+import { getSocket } from '../socket'
 import {
 	AdhocFilters,
 	CodeArgs,
@@ -75,6 +77,8 @@ import {
 } from './helpers'
 
 const queries = new Map<string, Query>()
+const JOB_FINAL_STATUSES = ['finished', 'failed', 'cancelled']
+const JOB_POLL_INTERVAL = 5000
 
 export default function useQuery(name: string) {
 	const key = String(name)
@@ -161,6 +165,9 @@ export function makeQuery(name: string) {
 		page_size?: number
 	}
 	let currentExecutionToken = 0
+	// cursors to the pages of ordered results, valid as long as the query and page size are unchanged
+	let pageCursors: Record<number, any> = {}
+	let pageCursorsKey = ''
 
 	const adhocFilters = ref<AdhocFilters>()
 	async function execute(force: boolean = false, page_size?: number) {
@@ -193,49 +200,39 @@ export function makeQuery(name: string) {
 			return Promise.resolve()
 		}
 
+		const cursorsKey = JSON.stringify([currentOperations.value, adhocFilters.value, pageSize.value])
+		if (force || cursorsKey !== pageCursorsKey) {
+			pageCursors = {}
+			pageCursorsKey = cursorsKey
+		}
+		const executedPage = currentPage.value
+
 		executing.value = true
 		const token = ++currentExecutionToken
-		return query
-			.call('execute', {
-				active_operation_idx: activeOperationIdx.value,
-				adhoc_filters: adhocFilters.value,
-				force: Boolean(force),
-				page: currentPage.value,
-				page_size: pageSize.value,
-			})
-		.then((response: any) => {
-			// Discard stale responses — a newer execution has superseded this one
-			if (token !== currentExecutionToken) return
-			if (!response) return
-
-			result.value.executedSQL = response.sql
-			result.value.columns = response.columns
-			result.value.rows = response.rows
-			result.value.totalRowCount = 0
-			result.value.formattedRows = getFormattedRows(result.value, query.doc.operations)
-
-			const aggregationPrefixes = aggregations.map((a) => `${a}_`)
-			const isAggregatedSql = Boolean(response.is_aggregated_sql)
-			const isMeasureColumn = (column: QueryResultColumn) =>
-				measureColumns.value.includes(column.name) ||
-				aggregationPrefixes.some((prefix) => column.name.startsWith(prefix)) ||
-				(isAggregatedSql && FIELDTYPES.NUMBER.includes(column.type))
+		return runExecution({
+			active_operation_idx: activeOperationIdx.value,
+			adhoc_filters: adhocFilters.value,
+			force: Boolean(force),
+			page: executedPage,
+			page_size: pageSize.value,
+			cursor: pageCursors[executedPage],
+		})
+			.then((response: any) => {
+				// Discard stale responses — a newer execution has superseded this one
+				if (token !== currentExecutionToken) return
+				if (!response) return
 
-			result.value.columnOptions = result.value.columns.map((column) => {
-				return {
-					label: column.name,
-					value: column.name,
-					description: column.type,
-					query: query.doc.name,
-					data_type: column.type,
-					is_measure: isMeasureColumn(column),
+				if (response.next_cursor && pageCursorsKey === cursorsKey) {
+					pageCursors[executedPage + 1] = response.next_cursor
 				}
+				applyResponse(response)
 			})
-			result.value.timeTaken = response.time_taken
-			result.value.lastExecutedAt = new Date()
-		})
 			.catch((err) => {
-				if (err.status === 503 && err.message && err.message.includes('ServiceUnavailableError')) {
+				if (
+					err.status === 503 &&
+					err.message &&
+					(err.message.includes('ServiceUnavailableError') || err.message.includes('DataSourceBusyError'))
+				) {
 					isServerBusy.value = true
 				}
 				if (token !== currentExecutionToken) return
@@ -253,6 +250,119 @@ export function makeQuery(name: string) {
 			})
 	}
 
+	// executions of saved queries run in a background job, so that they can be cancelled
+	const runningJobId = ref<string | null>(null)
+	const jobWaiters = new Map<string, (state: any) => void>()
+	getSocket().on('insights_query_job', (state: any) => {
+		if (!state?.job_id || !JOB_FINAL_STATUSES.includes(state.status)) return
+		jobWaiters.get(state.job_id)?.(state)
+	})
+
+	async function runExecution(args: Record<string, any>) {
+		// guests cannot submit jobs
+		if (!session.isLoggedIn || query.islocal) {
+			return query.call('execute', args)
+		}
+
+		// superseded by this execution
+		if (runningJobId.value) {
+			cancelExecution()
+		}
+
+		const job = await query.call('submit_execution', args)
+		if (!job?.job_id) return
+		runningJobId.value = job.job_id
+
+		const state = await waitForJob(job.job_id).finally(() => {
+			if (runningJobId.value === job.job_id) runningJobId.value = null
+		})
+		if (state.status === 'cancelled') {
+			throw new Error(__('Query execution was cancelled'))
+		}
+		if (state.status === 'failed') {
+			showErrorToast(new Error(state.error || __('Query execution failed')))
+		}
+		return call('insights.api.queries.get_query_job_results', { job_id: job.job_id })
+	}
+
+	function waitForJob(job_id: string): Promise<any> {
+		return new Promise((resolve) => {
+			let interval: ReturnType<typeof setInterval>
+			const done = (state: any) => {
+				clearInterval(interval)
+				jobWaiters.delete(job_id)
+				resolve(state)
+			}
+			jobWaiters.set(job_id, done)
+
+			// the job may have finished before the listener was set, or its event may be missed
+			const poll = () =>
+				call('insights.api.queries.get_query_job', { job_id })
+					.then((state: any) => {
+						if (JOB_FINAL_STATUSES.includes(state?.status)) done(state)
+					})
+					.catch(() => done({ status: 'failed', error: __('Query job expired') }))
+			interval = setInterval(poll, JOB_POLL_INTERVAL)
+			poll()
+		})
+	}
+
+	function cancelExecution() {
+		const job_id = runningJobId.value
+		if (!job_id) return
+		runningJobId.value = null
+		return call('insights.api.queries.cancel_query_job', { job_id }).then((state: any) => {
+			if (JOB_FINAL_STATUSES.includes(state?.status)) jobWaiters.get(job_id)?.(state)
+		})
+	}
+
+	function applyResponse(response: any) {
+		result.value.executedSQL = response.sql
+		result.value.columns = response.columns
+		result.value.rows = response.rows
+		result.value.totalRowCount = 0
+		result.value.isCountApproximate = false
+		result.value.formattedRows = getFormattedRows(result.value, query.doc.operations)
+
+		const aggregationPrefixes = aggregations.map((a) => `${a}_`)
+		const isAggregatedSql = Boolean(response.is_aggregated_sql)
+		const isMeasureColumn = (column: QueryResultColumn) =>
+			measureColumns.value.includes(column.name) ||
+			aggregationPrefixes.some((prefix) => column.name.startsWith(prefix)) ||
+			(isAggregatedSql && FIELDTYPES.NUMBER.includes(column.type))
+
+		result.value.columnOptions = result.value.columns.map((column) => {
+			return {
+				label: column.name,
+				value: column.name,
+				description: column.type,
+				query: query.doc.name,
+				data_type: column.type,
+				is_measure: isMeasureColumn(column),
+			}
+		})
+		result.value.timeTaken = response.time_taken
+		result.value.lastExecutedAt = new Date()
+	}
+
+	// results of the query executed along with others, e.g. by the dashboard it is on
+	function setResults(response: any, page_size: number) {
+		// a running execution must not overwrite them
+		currentExecutionToken++
+		executing.value = false
+		pageSize.value = page_size
+		currentPage.value = 1
+		pageCursors = {}
+		pageCursorsKey = JSON.stringify([currentOperations.value, adhocFilters.value, pageSize.value])
+		applyResponse(response)
+		lastExecutionArgs = {
+			operations: currentOperations.value,
+			adhoc_filters: adhocFilters.value,
+			page: currentPage.value,
+			page_size: pageSize.value,
+		}
+	}
+
 	function goToPage(page: number) {
 		if (page < 1) return
 		currentPage.value = page
@@ -260,6 +370,21 @@ export function makeQuery(name: string) {
 	}
 
 	const fetchingCount = ref(false)
+	let countArgs: { active_operation_idx: number; adhoc_filters?: AdhocFilters } | undefined
+	// the exact count of an estimated one is computed in the background
+	getSocket().on('insights_query_count', (data: any) => {
+		if (data?.query !== query.doc.name || !result.value.isCountApproximate) return
+		if (
+			!isEqual(countArgs, {
+				active_operation_idx: data.active_operation_idx,
+				adhoc_filters: data.adhoc_filters || undefined,
+			})
+		) {
+			return
+		}
+		result.value.totalRowCount = data.count || 0
+		result.value.isCountApproximate = false
+	})
 	async function fetchResultCount() {
 		if (!query.islocal) {
 			await waitUntil(() => query.isloaded)
@@ -275,9 +400,15 @@ export function makeQuery(name: string) {
 			.call('get_count', {
 				active_operation_idx: activeOperationIdx.value,
 				adhoc_filters: adhocFilters.value,
+				approximate: true,
 			})
-			.then((count: number) => {
-				result.value.totalRowCount = count || 0
+			.then((response: { count: number; approximate: boolean }) => {
+				result.value.totalRowCount = response?.count || 0
+				result.value.isCountApproximate = Boolean(response?.approximate)
+				countArgs = {
+					active_operation_idx: activeOperationIdx.value,
+					adhoc_filters: adhocFilters.value,
+				}
 			})
 			.finally(() => {
 				fetchingCount.value = false
@@ -654,8 +785,55 @@ export function makeQuery(name: string) {
 		downloading.value = false
 	}
 
+	// exports run in a background job, their file is downloaded once it is ready
+	const pendingExports = new Map<string, string>()
+	getSocket().on('insights_export_ready', (data: any) => {
+		const filename = pendingExports.get(data?.export_id)
+		if (!filename) return
+		const extension = String(data.file_name).split('.').pop()
+		downloadFile(data.file_url, `${filename}.${extension}`)
+		pendingExports.delete(data.export_id)
+	})
+	getSocket().on('insights_export_failed', (data: any) => {
+		// the job shows why it failed in a toast of its own
+		pendingExports.delete(data?.export_id)
+	})
+
 	function exportResults(format: string, filename: string) {
-		downloadResults(format, filename)
+		// the exported file is private to the user, guests and unsaved queries download the first rows
+		if (!session.isLoggedIn || query.islocal) {
+			return downloadResults(format, filename)
+		}
+
+		downloading.value = true
+		return query
+			.call('export_results', {
+				format,
+				active_operation_idx: activeOperationIdx.value,
+				adhoc_filters: adhocFilters.value,
+			})
+			.then((export_id: string) => {
+				if (!export_id) return
+				pendingExports.set(export_id, filename || query.doc.title || 'data')
+				createToast({
+					title: __('Export Started'),
+					message: __('The file will be downloaded once all the results are exported.'),
+					variant: 'info',
+				})
+			})
+			.finally(() => {
+				downloading.value = false
+			})
+	}
+
+	function downloadFile(url: string, filename: string) {
+		const a = document.createElement('a')
+		a.setAttribute('hidden', '')
+		a.setAttribute('href', url)
+		a.setAttribute('download', filename)
+		document.body.appendChild(a)
+		a.click()
+		document.body.removeChild(a)
 	}
 
 	function getDistinctColumnValues(column: string, search_term: string = '', limit: number = 20) {
@@ -799,6 +977,7 @@ export function makeQuery(name: string) {
 		const drill_down_query = useQuery('new-query-' + getUniqueId())
 		drill_down_query.doc.title = 'Drill Down'
 		drill_down_query.doc.use_live_connection = query.doc.use_live_connection
+		drill_down_query.doc.materialize_on_read = query.doc.materialize_on_read
 		drill_down_query.autoExecute = true
 
 		drill_down_query.setOperations(ops.slice(0, sliceIdx))
@@ -1131,6 +1310,7 @@ export function makeQuery(name: string) {
 	watch(currentOperations, () => {
 		currentPage.value = 1
 		result.value.totalRowCount = 0
+		result.value.isCountApproximate = false
 	})
 
 	waitUntil(() => query.isloaded).then(() => {
@@ -1162,6 +1342,7 @@ export function makeQuery(name: string) {
 
 		autoExecute,
 		executing,
+		runningJobId,
 		fetchingCount,
 		isServerBusy,
 		result,
@@ -1171,6 +1352,8 @@ export function makeQuery(name: string) {
 		goToPage,
 
 		execute,
+		cancelExecution,
+		setResults,
 		fetchResultCount,
 		refreshStoredTables,
 		importingTables,
@@ -1233,6 +1416,7 @@ export function makeQuery(name: string) {
 export const EMPTY_RESULT: QueryResult = {
 	executedSQL: '',
 	totalRowCount: 0,
+	isCountApproximate: false,
 	rows: [],
 	formattedRows: [],
 	columns: [],
@@ -218,6 +218,8 @@ export type GroupedColumnOption = {
 export type QueryResult = {
 	executedSQL: string
 	totalRowCount: number
+	// estimated from the query plan until the exact count is computed
+	isCountApproximate?: boolean
 	rows: QueryResultRow[]
 	formattedRows: QueryResultRow[]
 	columns: QueryResultColumn[]
@@ -72,6 +72,12 @@ export type InsightsQueryv3 = {
 	operations: Operation[]
 	variables?: QueryVariable[]
 	use_live_connection?: boolean
+	materialize_on_read?: boolean
+	is_materialized?: boolean
+	refresh_interval?: 'Hourly' | 'Daily' | 'Weekly'
+	refresh_on_source_change?: boolean
+	materialized_at?: string
+	materialized_rows?: number
 	sort_order: number
 	folder?: string | null
 	is_native_query?: boolean
@@ -255,7 +255,7 @@ def run_doc_method(method: str, docs: dict | str, args: dict | None = None):
 def is_public_method(doctype: str, method: str):
     public_methods = {
         "Insights Query v3": ["execute", "download_results"],
-        "Insights Dashboard v3": ["get_distinct_column_values", "track_view"],
+        "Insights Dashboard v3": ["get_distinct_column_values", "get_chart_results", "track_view"],
     }
 
     if doctype in public_methods and method in public_methods[doctype]:
@@ -17,7 +17,7 @@ from insights.insights.doctype.insights_team.insights_team import (
     check_table_permission,
     get_permission_filter,
 )
-from insights.utils import InsightsTable, detect_encoding
+from insights.utils import InsightsDataSourcev3, InsightsTable, detect_encoding
 
 
 @insights_whitelist()
@@ -473,3 +473,29 @@ def get_schema(data_source: str):
             )
 
     return schema
+
+
+@insights_whitelist(role="Insights Admin")
+@validate_type
+def get_query_admission_stats(data_source: str):
+    """Concurrency and queue wait metrics of the queries on a data source."""
+    from insights.insights.doctype.insights_data_source_v3.admission import get_admission_stats
+
+    return get_admission_stats(data_source)
+
+
+@insights_whitelist(role="Insights Admin")
+def get_live_connection_pool_stats():
+    """Hit and eviction counts of the live connection pools of the worker serving the request."""
+    from insights.insights.doctype.insights_data_source_v3.connection_pool import get_live_pool_stats
+
+    return get_live_pool_stats()
+
+
+@insights_whitelist(role="Insights Admin")
+@validate_type
+def get_read_replica_stats(data_source: str):
+    """Connections in use, lag and availability of each read replica of a data source."""
+    from insights.insights.doctype.insights_data_source_v3.replicas import get_replica_stats
+
+    return get_replica_stats(InsightsDataSourcev3.get_doc(data_source))
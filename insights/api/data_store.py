@@ -59,6 +59,14 @@ def import_table(data_source: str, table_name: str):
     table_doc.import_to_warehouse()
 
 
+@insights_whitelist(role="Insights Admin")
+def get_warehouse_pool_stats():
+    """Connection pool stats of the worker process that serves this request."""
+    import insights
+
+    return insights.warehouse.pool.get_stats()
+
+
 def sync_tables():
     # called daily via hooks
     tables = frappe.get_all(
@@ -71,6 +79,17 @@ def sync_tables():
         import_table(table.data_source, table.table)
 
 
+def compact_warehouse():
+    # called weekly via hooks
+    frappe.enqueue(
+        "insights.insights.doctype.insights_data_source_v3.data_warehouse.compact_warehouse",
+        queue="long",
+        timeout=60 * 60,
+        job_id="insights_compact_warehouse",
+        deduplicate=True,
+    )
+
+
 def update_failed_sync_status():
     from frappe.query_builder import Interval
     from frappe.query_builder.functions import Now
@@ -73,6 +73,27 @@ def create_chart():
     return chart.name
 
 
+@insights_whitelist()
+def get_query_job(job_id: str):
+    from insights.insights.doctype.insights_query_v3.query_jobs import get_job_state
+
+    return get_job_state(job_id)
+
+
+@insights_whitelist()
+def get_query_job_results(job_id: str):
+    from insights.insights.doctype.insights_query_v3.query_jobs import get_job_results
+
+    return get_job_results(job_id)
+
+
+@insights_whitelist()
+def cancel_query_job(job_id: str):
+    from insights.insights.doctype.insights_query_v3.query_jobs import cancel_job
+
+    return cancel_job(job_id)
+
+
 @frappe.whitelist(allow_guest=True)
 def pivot(
     data: list[dict],
@@ -157,13 +157,20 @@ doc_events = {
 scheduler_events = {
     "all": [
         "insights.insights.doctype.insights_alert.insights_alert.send_alerts",
+        "insights.insights.doctype.insights_query_v3.materialized_query.refresh_materialized_queries",
     ],
     "daily": [
         "insights.api.data_store.sync_tables",
+        "insights.insights.doctype.insights_query_v3.result_export.delete_old_exports",
     ],
     "hourly": [
         "insights.api.data_store.update_failed_sync_status",
         "insights.insights.doctype.insights_table_import_job.insights_table_import_job.run_scheduled_imports",
+        "insights.insights.doctype.insights_data_source_v3.result_cache.clear_spilled_results",
+        "insights.insights.doctype.insights_data_source_v3.materialization.delete_expired_materializations",
+    ],
+    "weekly": [
+        "insights.api.data_store.compact_warehouse",
     ],
 }
 
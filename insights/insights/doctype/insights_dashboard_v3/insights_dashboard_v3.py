@@ -10,7 +10,13 @@ from frappe.model.document import Document
 from frappe.query_builder import Interval
 from frappe.query_builder.functions import Now
 
+from insights.api.shared import is_public
 from insights.api.telemetry import capture_event
+from insights.insights.doctype.insights_data_source_v3.ibis_utils import (
+    execute_ibis_queries,
+    paginate_query,
+)
+from insights.insights.doctype.insights_query_v3.insights_query_v3 import set_adhoc_filters
 from insights.utils import DocShare, File
 
 
@@ -96,6 +102,75 @@ class InsightsDashboardv3(Document):
             column_name, search_term=search_term, adhoc_filters=adhoc_filters
         )
 
+    @frappe.whitelist()
+    def get_chart_results(
+        self, charts: list | None = None, adhoc_filters: dict | None = None, force: bool = False
+    ):
+        """Execute the data queries of the charts on the dashboard in one request.
+
+        `charts` limits them to some of the charts, all of them by default.
+        `adhoc_filters` maps a chart to the adhoc filters of its data query. Returns the
+        results of each chart keyed by chart name, as `InsightsQueryv3.execute` returns
+        them, or an `error` if the chart's query could not be built or executed.
+        """
+        is_guest = frappe.session.user == "Guest"
+        if is_guest and not self.is_public:
+            raise frappe.PermissionError
+
+        adhoc_filters = frappe.parse_json(adhoc_filters) or {}
+        chart_names = [row.chart for row in self.linked_charts]
+        if charts:
+            chart_names = [chart for chart in frappe.parse_json(charts) if chart in chart_names]
+        charts = frappe.get_all(
+            "Insights Chart v3",
+            filters={"name": ["in", chart_names]},
+            fields=["name", "data_query", "config"],
+        )
+
+        response = {}
+        built = []
+        for chart in charts:
+            if not chart.data_query:
+                continue
+            try:
+                query, ibis_query = self.build_chart_query(chart, adhoc_filters.get(chart.name))
+            except Exception as e:
+                response[chart.name] = {"error": str(e)}
+                continue
+            page_size = (frappe.parse_json(chart.config) or {}).get("limit") or 100
+            built.append((chart.name, query, ibis_query, paginate_query(ibis_query, 1, page_size)))
+
+        results = execute_ibis_queries(
+            [(paginated, query.name) for _chart, query, _ibis_query, paginated in built],
+            force=frappe.parse_json(force),
+            cache_expiry=60 * 10,
+        )
+        for (chart_name, query, ibis_query, _paginated), (result, time_taken) in zip(
+            built, results, strict=True
+        ):
+            if isinstance(result, Exception):
+                response[chart_name] = {"error": str(result)}
+            else:
+                response[chart_name] = query.get_results_response(ibis_query, result, time_taken)
+
+        return response
+
+    def build_chart_query(self, chart, adhoc_filters=None):
+        query = frappe.get_cached_doc("Insights Query v3", chart.data_query)
+
+        public_access = frappe.flags.insights_for_public_access
+        if not public_access and not query.has_permission("read"):
+            if not is_public("Insights Query v3", query.name):
+                raise frappe.PermissionError(f"You don't have permission to access {chart.name}")
+            # as if the query was executed on its own, see `run_doc_method`
+            frappe.flags.insights_for_public_access = True
+
+        try:
+            with set_adhoc_filters(adhoc_filters):
+                return query, query.build()
+        finally:
+            frappe.flags.insights_for_public_access = public_access
+
     def check_linked_filters(self, query, column_name):
         items = frappe.parse_json(self.items)
         filters = [item for item in items if item["type"] == "filter"]
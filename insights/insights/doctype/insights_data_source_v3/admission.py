@@ -0,0 +1,284 @@
+"""Admission control for queries on live data sources.
+
+Each data source admits at most `max_concurrent_queries` queries at once, across
+all workers. Queries beyond that wait in a queue kept in Redis, ordered so that
+users take turns: a user's n-th waiting query is queued `FAIR_SHARE_SPACING`
+seconds behind their (n-1)-th, so one user opening many queries does not hold
+back the others. A query that would wait longer than `max_queue_wait`, judging by
+its position and the average query duration, is rejected right away.
+
+Slots are leased, so a worker that dies while holding one only holds it until the
+lease runs out.
+"""
+
+import math
+import time
+from contextlib import contextmanager
+
+import frappe
+
+ADMISSION_KEY_PREFIX = "insights:admission:"
+ADMISSION_POLL_INTERVAL = 0.1
+FAIR_SHARE_SPACING = 1000
+# weight of the latest query in the average query duration
+DURATION_SMOOTHING = 0.2
+
+# KEYS: slots, waiting, deadlines, users
+# ARGV: token, limit, now, lease
+ACQUIRE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[3])
+for _, token in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], token)
+    redis.call('ZREM', KEYS[3], token)
+    redis.call('HINCRBY', KEYS[4], string.match(token, '^(.*)|'), -1)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+
+local free = tonumber(ARGV[2]) - redis.call('ZCARD', KEYS[1])
+local rank = redis.call('ZRANK', KEYS[2], ARGV[1])
+if not rank then
+    return -1
+end
+if rank >= free then
+    return rank - math.max(free, 0) + 1
+end
+
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('HINCRBY', KEYS[4], string.match(ARGV[1], '^(.*)|'), -1)
+redis.call('ZADD', KEYS[1], tonumber(ARGV[3]) + tonumber(ARGV[4]), ARGV[1])
+return 0
+"""
+
+# KEYS: waiting, deadlines, users
+# ARGV: token, user, now, deadline, spacing
+ENQUEUE_SCRIPT = """
+local waiting = redis.call('HINCRBY', KEYS[3], ARGV[2], 1)
+redis.call('ZADD', KEYS[1], tonumber(ARGV[3]) + (waiting - 1) * tonumber(ARGV[5]), ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[1])
+"""
+
+# KEYS: waiting, deadlines, users
+# ARGV: token, user
+LEAVE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[3], ARGV[2], -1)
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+"""
+
+# KEYS: stats
+READ_STATS_SCRIPT = """
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# KEYS: stats
+# ARGV: wait
+RECORD_WAIT_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], 'admitted', 1)
+redis.call('HINCRBYFLOAT', KEYS[1], 'total_wait', ARGV[1])
+if tonumber(ARGV[1]) > tonumber(redis.call('HGET', KEYS[1], 'max_wait') or '0') then
+    redis.call('HSET', KEYS[1], 'max_wait', ARGV[1])
+end
+"""
+
+# KEYS: stats
+# ARGV: duration, smoothing
+RECORD_DURATION_SCRIPT = """
+local duration = tonumber(ARGV[1])
+local average = redis.call('HGET', KEYS[1], 'average_duration')
+if average then
+    duration = (1 - tonumber(ARGV[2])) * tonumber(average) + tonumber(ARGV[2]) * duration
+end
+redis.call('HSET', KEYS[1], 'average_duration', tostring(duration))
+"""
+
+
+class DataSourceBusyError(frappe.ValidationError):
+    http_status_code = 503
+
+
+@contextmanager
+def admit_query(data_source: str):
+    """Wait for a slot on the data source, holding it until the block exits."""
+    token = acquire_slot(data_source)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        release_slot(data_source, token)
+        if token:
+            record_duration(data_source, time.monotonic() - start)
+
+
+def try_acquire_slot(data_source: str) -> str | None:
+    """Take a slot if one is free and nobody is waiting for it, without waiting."""
+    limits = get_limits(data_source)
+    if not limits.max_concurrent_queries:
+        return ""
+
+    token = make_token()
+    keys = get_keys(data_source)
+    enqueue(keys, token, limits.max_queue_wait)
+    queue_keys = get_queue_keys(keys, "slots")
+    admitted = run_script(ACQUIRE_SCRIPT, queue_keys, token, limits.max_concurrent_queries, *lease())
+    if admitted != 0:
+        leave_queue(keys, token)
+        return None
+    return token
+
+
+def acquire_slot(data_source: str) -> str:
+    """Wait for a slot on the data source and return its token, empty if there is no limit.
+
+    Raises DataSourceBusyError if the query would wait longer than `max_queue_wait`.
+    """
+    limits = get_limits(data_source)
+    if not limits.max_concurrent_queries:
+        return ""
+
+    token = make_token()
+    keys = get_keys(data_source)
+    enqueue(keys, token, limits.max_queue_wait)
+
+    queue_keys = get_queue_keys(keys, "slots")
+    start = time.monotonic()
+    admitted = False
+    try:
+        while True:
+            ahead = run_script(ACQUIRE_SCRIPT, queue_keys, token, limits.max_concurrent_queries, *lease())
+            if ahead == 0:
+                admitted = True
+                break
+
+            waited = time.monotonic() - start
+            expected_wait = waited + get_expected_wait(data_source, ahead, limits.max_concurrent_queries)
+            if ahead < 0 or waited > limits.max_queue_wait or expected_wait > limits.max_queue_wait:
+                record_rejection(data_source)
+                title = frappe.db.get_value("Insights Data Source v3", data_source, "title", cache=True)
+                frappe.throw(
+                    title="Data Source Busy",
+                    msg=f"Too many queries are running on '{title or data_source}'. "
+                    "Please try again in a while.",
+                    exc=DataSourceBusyError,
+                )
+
+            time.sleep(ADMISSION_POLL_INTERVAL)
+    finally:
+        if not admitted:
+            leave_queue(keys, token)
+
+    record_wait(data_source, time.monotonic() - start)
+    return token
+
+
+def release_slot(data_source: str, token: str):
+    if token:
+        frappe.cache().zrem(get_keys(data_source)["slots"], token)
+
+
+def get_expected_wait(data_source: str, ahead: int, limit: int) -> float:
+    # every round of `limit` queries ahead takes about as long as an average query
+    average_duration = float(get_stats(data_source).get("average_duration") or 0)
+    return math.ceil(ahead / limit) * average_duration
+
+
+def enqueue(keys: dict, token: str, max_queue_wait: int):
+    now = time.time()
+    run_script(
+        ENQUEUE_SCRIPT,
+        get_queue_keys(keys),
+        token,
+        get_token_user(token),
+        now,
+        # a waiter that died is dropped from the queue once it would have given up
+        now + max_queue_wait + 1,
+        FAIR_SHARE_SPACING,
+    )
+
+
+def leave_queue(keys: dict, token: str):
+    run_script(LEAVE_SCRIPT, get_queue_keys(keys), token, get_token_user(token))
+
+
+def lease() -> tuple[float, int]:
+    # held for as long as a query can run
+    max_execution_time = (
+        frappe.db.get_single_value("Insights Settings", "max_execution_time", cache=True) or 180
+    )
+    return time.time(), max_execution_time + 60
+
+
+def make_token() -> str:
+    return f"{frappe.session.user}|{frappe.generate_hash(length=12)}"
+
+
+def get_token_user(token: str) -> str:
+    return token.rsplit("|", 1)[0]
+
+
+def get_limits(data_source: str) -> frappe._dict:
+    return (
+        frappe.db.get_value(
+            "Insights Data Source v3",
+            data_source,
+            ["max_concurrent_queries", "max_queue_wait"],
+            as_dict=True,
+            cache=True,
+        )
+        or frappe._dict()
+    )
+
+
+def get_keys(data_source: str) -> dict:
+    # made once and only used with scripts and commands RedisWrapper does not wrap,
+    # since the wrapped ones make the key again and pickle the values
+    cache = frappe.cache()
+    prefix = f"{ADMISSION_KEY_PREFIX}{data_source}:"
+    return {
+        name: cache.make_key(prefix + name).decode()
+        for name in ("slots", "waiting", "deadlines", "users", "stats")
+    }
+
+
+def get_queue_keys(keys: dict, *extra) -> list[str]:
+    return [keys[name] for name in (*extra, "waiting", "deadlines", "users")]
+
+
+def run_script(script: str, keys, *args):
+    return frappe.cache().register_script(script)(keys=list(keys), args=list(args))
+
+
+def get_stats(data_source: str) -> dict:
+    stats = run_script(READ_STATS_SCRIPT, (get_keys(data_source)["stats"],))
+    stats = [frappe.safe_decode(value) for value in stats]
+    return dict(zip(stats[::2], stats[1::2], strict=True))
+
+
+def get_admission_stats(data_source: str) -> dict:
+    """Queue wait metrics of the data source."""
+    keys = get_keys(data_source)
+    stats = get_stats(data_source)
+    admitted = int(stats.get("admitted") or 0)
+    total_wait = float(stats.get("total_wait") or 0)
+    return {
+        "running": frappe.cache().zcard(keys["slots"]),
+        "waiting": frappe.cache().zcard(keys["waiting"]),
+        "admitted": admitted,
+        "rejected": int(stats.get("rejected") or 0),
+        "average_wait": round(total_wait / admitted, 3) if admitted else 0,
+        "max_wait": round(float(stats.get("max_wait") or 0), 3),
+        "average_duration": round(float(stats.get("average_duration") or 0), 3),
+    }
+
+
+def record_wait(data_source: str, wait: float):
+    run_script(RECORD_WAIT_SCRIPT, (get_keys(data_source)["stats"],), wait)
+
+
+def record_rejection(data_source: str):
+    frappe.cache().hincrby(get_keys(data_source)["stats"], "rejected", 1)
+
+
+def record_duration(data_source: str, duration: float):
+    run_script(RECORD_DURATION_SCRIPT, (get_keys(data_source)["stats"],), duration, DURATION_SMOOTHING)
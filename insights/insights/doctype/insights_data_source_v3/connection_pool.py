@@ -0,0 +1,228 @@
+"""Per-process pools of connections to live MariaDB and PostgreSQL data sources.
+
+Opening a connection to a remote database costs a TCP, TLS and auth handshake,
+plus the session settings `open_connection` applies. Pooled connections are handed
+to one request at a time and returned to the pool at the end of it, so those
+costs are paid once per physical connection instead of once per request.
+"""
+
+import os
+import threading
+import time
+from contextlib import closing, suppress
+
+import frappe
+from frappe.utils.data import flt
+from ibis.backends import BaseBackend
+
+from insights.cache_utils import make_digest
+
+from .replicas import release_replica
+
+POOLED_DATABASE_TYPES = ("MariaDB", "PostgreSQL")
+
+
+class LiveConnectionPool:
+    """Idle connections to one data source, opened with one set of credentials.
+
+    A connection is checked for health before it is handed out if it sat idle for
+    more than `HEALTH_CHECK_AFTER`. Connections idle for more than `IDLE_TIMEOUT`
+    are closed, and at most `MAX_IDLE` are kept.
+    """
+
+    MAX_IDLE = 4
+    IDLE_TIMEOUT = 5 * 60
+    HEALTH_CHECK_AFTER = 30
+
+    def __init__(self, data_source: str, host: str, key: str):
+        self.data_source = data_source
+        self.host = host
+        self.key = key
+        self.stats = frappe._dict(hits=0, misses=0, failed_health_checks=0, evictions=0)
+
+        self._lock = threading.Lock()
+        # (connection, returned at), most recently returned last
+        self._idle: list[tuple[BaseBackend, float]] = []
+        self._idle_timer: threading.Timer | None = None
+        self._closed = False
+
+    def checkout(self, open_connection) -> BaseBackend:
+        """Return an idle connection, or one opened with `open_connection` if none is healthy.
+
+        The connection belongs to the caller until it is checked back in.
+        """
+        while True:
+            with self._lock:
+                self._evict_idle()
+                if not self._idle:
+                    self.stats.misses += 1
+                    break
+                db, returned_at = self._idle.pop()
+
+            if time.monotonic() - returned_at < self.HEALTH_CHECK_AFTER or is_healthy(db):
+                with self._lock:
+                    self.stats.hits += 1
+                return db
+
+            with self._lock:
+                self.stats.failed_health_checks += 1
+            disconnect(db)
+
+        db = open_connection()
+        db._insights_pool = self
+        return db
+
+    def checkin(self, db: BaseBackend) -> None:
+        # end whatever transaction the request left open
+        with suppress(Exception):
+            db.con.rollback()
+
+        # session settings the request changed, like the statement timeout an import lifts
+        restore_session = getattr(db, "_insights_restore_session", None)
+        if restore_session is not None:
+            try:
+                restore_session(db)
+                db._insights_restore_session = None
+            except Exception:
+                with self._lock:
+                    self.stats.evictions += 1
+                disconnect(db)
+                return
+
+        with self._lock:
+            if self._closed or len(self._idle) >= self.MAX_IDLE:
+                self.stats.evictions += 1
+                disconnect(db)
+                return
+            self._idle.append((db, time.monotonic()))
+            self._schedule_idle_timer()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._cancel_idle_timer()
+            idle, self._idle = self._idle, []
+        for db, _returned_at in idle:
+            disconnect(db)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "data_source": self.data_source,
+                "host": self.host,
+                "idle": len(self._idle),
+                "oldest_idle_for": flt(time.monotonic() - self._idle[0][1], 3) if self._idle else 0,
+                "pid": os.getpid(),
+            }
+
+    def _evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.IDLE_TIMEOUT
+        while self._idle and self._idle[0][1] < cutoff:
+            db, _returned_at = self._idle.pop(0)
+            self.stats.evictions += 1
+            disconnect(db)
+
+    def _sweep(self) -> None:
+        with self._lock:
+            self._idle_timer = None
+            self._evict_idle()
+            if self._idle:
+                self._schedule_idle_timer()
+
+    def _schedule_idle_timer(self) -> None:
+        if self._idle_timer is not None:
+            return
+        self._idle_timer = threading.Timer(self.IDLE_TIMEOUT, self._sweep)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _cancel_idle_timer(self) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+
+# keyed by data source and host
+_live_pools: dict[tuple[str, str], LiveConnectionPool] = {}
+_live_pools_lock = threading.Lock()
+
+
+def get_live_pool(doc) -> LiveConnectionPool | None:
+    """Return this process's pool for the data source, None if its connections are not pooled.
+
+    Each host of the data source, the primary and every read replica, has a pool of
+    its own. A pool opened with other credentials or session settings is closed and
+    replaced.
+    """
+    if doc.is_site_db or doc.type == "REST API" or doc.database_type not in POOLED_DATABASE_TYPES:
+        return None
+
+    host = f"{doc.host}:{doc.port}"
+    key = get_pool_key(doc)
+    with _live_pools_lock:
+        pool = _live_pools.get((doc.name, host))
+        if pool is not None and pool.key == key:
+            return pool
+        new_pool = _live_pools[(doc.name, host)] = LiveConnectionPool(doc.name, host, key)
+
+    if pool is not None:
+        pool.close()
+    return new_pool
+
+
+def get_pool_key(doc) -> str:
+    # the password is not on the document, a change to it changes `modified`
+    return make_digest(
+        doc.modified,
+        doc.host,
+        doc.port,
+        doc.username,
+        doc.database_name,
+        doc.schema,
+        doc.use_ssl,
+        doc.connection_string,
+        frappe.db.get_single_value("Insights Settings", "max_execution_time", cache=True),
+    )
+
+
+def close_live_pool(data_source: str) -> None:
+    with _live_pools_lock:
+        pools = [_live_pools.pop(key) for key in list(_live_pools) if key[0] == data_source]
+    for pool in pools:
+        pool.close()
+
+
+def get_live_pool_stats() -> list[dict]:
+    with _live_pools_lock:
+        pools = list(_live_pools.values())
+    return [pool.get_stats() for pool in pools]
+
+
+def release_connection(db: BaseBackend) -> None:
+    """Check a pooled connection back in, or disconnect one that is not pooled."""
+    replica = getattr(db, "_insights_replica", None)
+    db._insights_replica = None
+
+    pool = getattr(db, "_insights_pool", None)
+    if pool is not None:
+        pool.checkin(db)
+    else:
+        db.disconnect()
+
+    if replica is not None:
+        release_replica(replica)
+
+
+def is_healthy(db: BaseBackend) -> bool:
+    try:
+        with closing(db.raw_sql("SELECT 1")) as cursor:
+            cursor.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def disconnect(db: BaseBackend) -> None:
+    with suppress(Exception):
+        db.disconnect()
@@ -1,22 +1,30 @@
 import os
 import shutil
 import tempfile
+import threading
 import time
-from collections.abc import Generator
+from collections.abc import Callable, Generator
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from contextlib import contextmanager, suppress
+from functools import partial
 from pathlib import Path
 
 import frappe
 import frappe.utils
 import ibis
+import ibis.expr.operations as ops
 import pandas as pd
-from duckdb import CatalogException
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import sqlglot as sg
 from frappe.query_builder.functions import IfNull
-from frappe.utils import get_files_path, now
+from frappe.utils import flt, get_files_path, now
 from frappe.utils.background_jobs import is_job_enqueued
 from ibis import _
 from ibis.backends.duckdb import Backend as DuckDBBackend
 from ibis.common.exceptions import TableNotFound
+from ibis.expr.operations.relations import DatabaseTable
 from ibis.expr.types import Expr, Table
 
 import insights
@@ -24,71 +32,221 @@ from insights.insights.doctype.insights_data_source_v3.connectors.duckdb import
 from insights.utils import InsightsDataSourcev3, InsightsTablev3
 
 WAREHOUSE_DB_NAME = "insights"
+STREAM_CHUNK_SIZE = 10_000
+MAX_IMPORT_PARALLELISM = 8
+LOW_CARDINALITY_LIMIT = 100
+# share of free blocks in a schema file above which it is rewritten
+COMPACTION_FREE_RATIO = 0.2
+TABLE_VERSIONS_KEY = "insights:warehouse_table_versions"
+# folder of the materialized results of queries, next to the schemas
+MATERIALIZATIONS_FOLDER = "materializations"
+# catalogs the files of materialized results are attached as
+MATERIALIZED_CATALOG_PREFIX = "materialized/"
 
 
 class Warehouse:
+    """The local DuckDB data store.
+
+    Every table lives in its own DuckDB file under `schemas/<schema>/`, so imports
+    of different tables never contend for the same file or lock, and a write only
+    ever copies the file of the table it writes. Read connections attach all table
+    files and expose each one as a view `schema.table`, which keeps references
+    working as they did with the single-file warehouse.
+    """
+
     def __init__(self):
         pass
 
-    def get_db_path(self) -> str:
+    def get_folder_path(self) -> str:
         folder_path = os.path.realpath(get_files_path(is_private=1))
         folder_path = os.path.join(folder_path, "insights_data_warehouse")
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
-        return os.path.join(os.path.realpath(folder_path), f"{WAREHOUSE_DB_NAME}.duckdb")
-
-    def get_connection(self, database: str | None = None, read_only: bool = True) -> DuckDBBackend:
-        path = self.get_db_path()
+        return os.path.realpath(folder_path)
+
+    def get_schemas_path(self) -> str:
+        schemas_path = os.path.join(self.get_folder_path(), "schemas")
+        if not os.path.exists(schemas_path):
+            os.makedirs(schemas_path)
+        return schemas_path
+
+    def get_materializations_path(self) -> str:
+        """Return the folder of materialized results, which are attached when they are read."""
+        materializations_path = os.path.join(self.get_folder_path(), MATERIALIZATIONS_FOLDER)
+        if not os.path.exists(materializations_path):
+            os.makedirs(materializations_path)
+        return materializations_path
+
+    def get_schema_path(self, schema: str) -> str:
+        """Return the folder of the table files of a schema."""
+        if not schema or schema == "main" or os.sep in schema:
+            frappe.throw(f"Invalid data warehouse schema: {schema}")
+        return os.path.join(self.get_schemas_path(), schema)
+
+    def get_table_path(self, schema: str, table: str) -> str:
+        if not table or os.sep in table:
+            frappe.throw(f"Invalid data warehouse table: {table}")
+        return os.path.join(self.get_schema_path(schema), f"{table}.duckdb")
+
+    def get_legacy_db_path(self) -> str:
+        """Path of the single-file warehouse used before schemas were split into files."""
+        return os.path.join(self.get_folder_path(), f"{WAREHOUSE_DB_NAME}.duckdb")
 
-        db = get_local_duckdb_connection(
-            path,
-            read_only=read_only,
-            allowed_dir=str(Path(tempfile.gettempdir())) if not read_only else None,
-        )
+    @property
+    def pool(self) -> "WarehouseConnectionPool":
+        return get_warehouse_pool(self.get_schemas_path())
 
+    def get_connection(self, database: str | None = None) -> DuckDBBackend:
+        db = self.pool.checkout()
         if database:
-            db.raw_sql(f"USE '{database}'")
-
+            db.raw_sql(f'USE "{database}"')
         return db
 
     def create_database(self, database: str):
-        with self.get_write_connection() as db:
-            with suppress(CatalogException):
-                db.create_database(database)
+        os.makedirs(self.get_schema_path(database), exist_ok=True)
 
     @property
     def db(self) -> DuckDBBackend:
         if WAREHOUSE_DB_NAME not in insights.db_connections:
-            ddb = self.get_connection(read_only=True)
+            ddb = self.get_connection()
             insights.db_connections[WAREHOUSE_DB_NAME] = ddb
 
         return insights.db_connections[WAREHOUSE_DB_NAME]
 
     @contextmanager
     def get_write_connection(
-        self, database: str | None = None, timeout: int = 30
+        self, database: str, table: str, timeout: int = 30, copy_live_file: bool = True
     ) -> Generator[DuckDBBackend, None, None]:
+        """Open a write connection on a staging copy of the file of one table.
+
+        The table is written to the `main` schema of the file, under its own name.
+        Writes never touch the live file. On success the staging copy is checkpointed
+        and atomically renamed over the live file, so readers keep querying the
+        previous snapshot while a commit runs and pick up the new one on their next
+        checkout. On failure the staging copy is discarded and the live file is left
+        untouched.
+
+        With `copy_live_file=False` the staging file starts out empty and replaces
+        the live file entirely.
+        """
         from frappe.utils.synchronization import filelock
 
-        with filelock("insights_warehouse_write", timeout=timeout):
-            # DuckDB disallows a second connection to the same file with a different
-            # config (read_only vs read-write). Close the cached read-only connection
-            # before opening the write connection; it will be re-opened on next access.
-            with suppress(Exception):
-                cached = insights.db_connections.pop(WAREHOUSE_DB_NAME, None)
-                cached.disconnect()
+        path = self.get_table_path(database, table)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with filelock(get_write_lock_name(database, table), timeout=timeout):
+            staging_path = self._prepare_staging_file(path, copy_live_file)
 
-            db = self.get_connection(database, read_only=False)
             try:
-                yield db
-            finally:
-                db.disconnect()
+                db = get_local_duckdb_connection(
+                    staging_path,
+                    read_only=False,
+                    allowed_dir=str(Path(tempfile.gettempdir())),
+                )
+                try:
+                    yield db
+                    db.raw_sql("CHECKPOINT")
+                finally:
+                    db.disconnect()
+            except BaseException:
+                remove_duckdb_file(staging_path)
+                raise
+
+            self._publish_staging_file(staging_path, path)
+
+    def drop_table(self, database: str, table: str, timeout: int = 30) -> None:
+        from frappe.utils.synchronization import filelock
+
+        with filelock(get_write_lock_name(database, table), timeout=timeout):
+            remove_duckdb_file(self.get_table_path(database, table))
+        self._release_replaced_files()
+
+    def _prepare_staging_file(self, path: str, copy_live_file: bool = True) -> str:
+        # holding the write lock, so leftovers from a crashed writer are safe to remove
+        for stale in Path(path).parent.glob(f"{Path(path).name}.*.staging"):
+            remove_duckdb_file(str(stale))
+
+        staging_path = f"{path}.{os.getpid()}.staging"
+        if copy_live_file and os.path.exists(path):
+            # copyfile uses copy_file_range (and reflinks where the filesystem supports it)
+            shutil.copyfile(path, staging_path)
+            if os.path.exists(f"{path}.wal"):
+                shutil.copyfile(f"{path}.wal", f"{staging_path}.wal")
+
+        return staging_path
+
+    def _publish_staging_file(self, staging_path: str, path: str) -> None:
+        # the staging copy was checkpointed, so any WAL of the live file is already merged
+        with suppress(FileNotFoundError):
+            os.remove(f"{path}.wal")
+        os.replace(staging_path, path)
+        self._release_replaced_files()
+
+    def _release_replaced_files(self) -> None:
+        # release this request's cursor on the replaced file right away, the handle it
+        # is on is closed once the cursors other threads have out on it are checked in
+        cached = insights.db_connections.pop(WAREHOUSE_DB_NAME, None)
+        if cached is not None:
+            self.pool.checkin(cached)
+        self.pool.refresh()
+
+    def compact(
+        self,
+        database: str,
+        table: str,
+        min_free_ratio: float = COMPACTION_FREE_RATIO,
+        timeout: int = 300,
+    ):
+        """Rewrite a table's file into a new one if enough of it is free space.
+
+        DuckDB reuses the blocks freed by deleted and overwritten rows, but never
+        returns them to the filesystem, and appends leave partly filled row groups
+        behind. Copying the table into a new file drops both. The copy runs under the
+        table's write lock, so it never overlaps an import's commit.
+
+        Returns the file sizes before and after, or None if the file was left alone.
+        """
+        path = self.get_table_path(database, table)
+        if not os.path.exists(path):
+            return None
+
+        total_blocks, free_blocks = self.db.raw_sql(
+            "SELECT total_blocks, free_blocks FROM pragma_database_size() "
+            f"WHERE database_name = '{escape_sql_path(get_attached_name(database, table))}'"
+        ).fetchone() or (0, 0)
+        free_ratio = free_blocks / total_blocks if total_blocks else 0
+        if free_ratio < min_free_ratio:
+            return None
+
+        size_before = get_duckdb_file_size(path)
+        with self.get_write_connection(database, table, timeout=timeout, copy_live_file=False) as db:
+            db.raw_sql(f"ATTACH '{escape_sql_path(path)}' AS live_table (READ_ONLY)")
+            # a plain scan keeps the insertion order, so clustered tables stay sorted
+            db.raw_sql(
+                f"CREATE TABLE {quote_identifier(table)} AS "
+                f"SELECT * FROM live_table.main.{quote_identifier(table)}"
+            )
+            db.raw_sql("DETACH live_table")
+
+        return {
+            "schema": database,
+            "table": table,
+            "free_ratio": flt(free_ratio, 2),
+            "size_before": size_before,
+            "size_after": get_duckdb_file_size(path),
+        }
 
     def get_table(self, data_source: str, table_name: str) -> "WarehouseTable":
         return WarehouseTable(data_source, table_name)
 
     def get_table_writer(
-        self, table_name: str, schema: ibis.Schema, database: str = "main", mode: str = "replace", log_fn=None
+        self,
+        table_name: str,
+        schema: ibis.Schema,
+        database: str = "main",
+        mode: str = "replace",
+        key: str = "",
+        sort_key: str = "",
+        log_fn=None,
     ) -> "WarehouseTableWriter":
         """Create a table writer for batch inserts with automatic cleanup.
 
@@ -100,9 +258,315 @@ class Warehouse:
             # On exception, temp files are cleaned up automatically
         """
         return WarehouseTableWriter(
-            table_name, table_schema=schema, database=database, mode=mode, log_fn=log_fn
+            table_name,
+            table_schema=schema,
+            database=database,
+            mode=mode,
+            key=key,
+            sort_key=sort_key,
+            log_fn=log_fn,
+        )
+
+
+class WarehouseConnectionPool:
+    """Per-process pool of read-only cursors on one long-lived warehouse database handle.
+
+    Opening and attaching the schema files costs more than most small warehouse
+    queries, so the handle is kept open across requests and every request gets a
+    cheap cursor on it. A write commit that replaces a schema file (or adds a new
+    one) supersedes the handle: later checkouts get cursors on a new one, and the
+    old handle is closed when its last cursor is checked in. The current handle is
+    closed once no cursor has been out for `idle_timeout`.
+
+    Closing a DuckDB database closes every cursor on it, so a handle is never closed
+    while cursors on it are checked out.
+
+    Table files are attached when the handle is opened: once external access is
+    disabled, DuckDB only allows new attachments from whitelisted directories,
+    which would also expose the raw files to `read_blob` in native queries. Only
+    the folder of materialized results is whitelisted, they are attached when read
+    and a new file is written for every refresh, so they never supersede the handle.
+    `read_blob` on them only exposes results the warehouse serves anyway.
+    """
+
+    IDLE_TIMEOUT = 5 * 60
+
+    def __init__(self, path: str, idle_timeout: int | None = None):
+        self.path = path
+        self.idle_timeout = idle_timeout or self.IDLE_TIMEOUT
+        self.stats = frappe._dict(hits=0, misses=0, reopens=0, evictions=0)
+
+        self._lock = threading.RLock()
+        # db, file_ids, opened_at, cursors (checked out), idle_since (when the last one was checked in)
+        self._handle: frappe._dict | None = None
+        # superseded handles, closed when their last cursor is checked in
+        self._superseded: list[frappe._dict] = []
+        self._idle_timer: threading.Timer | None = None
+
+    def checkout(self) -> DuckDBBackend:
+        """Return an ibis backend wrapping a new cursor on the shared handle.
+
+        The caller owns the cursor and must hand it back to `checkin`, directly or
+        through `release_connection`.
+        """
+        with self._lock:
+            if self._handle is not None and self._handle.file_ids != get_schema_file_ids(self.path):
+                self.stats.reopens += 1
+                self._supersede()
+
+            if self._handle is None:
+                self.stats.misses += 1
+                self._open()
+            else:
+                self.stats.hits += 1
+
+            handle = self._handle
+            cursor = handle.db.con.cursor()
+            handle.cursors += 1
+
+        db = ibis.duckdb.from_connection(cursor)
+        # keep `is_warehouse` and `db_identity` working for pooled cursors
+        db._con_args = (self.path,)
+        db._insights_pool = self
+        db._insights_handle = handle
+        try:
+            # home_directory is a per-connection setting, external access is database wide
+            db.raw_sql(f"SET home_directory='{get_private_files_path()}'")
+        except Exception:
+            self.checkin(db)
+            raise
+        return db
+
+    def checkin(self, db: DuckDBBackend) -> None:
+        """Close a cursor from `checkout`.
+
+        The handle the cursor is on is closed with it if the handle was superseded and
+        this was its last cursor.
+        """
+        handle = getattr(db, "_insights_handle", None)
+        db._insights_handle = None
+        with suppress(Exception):
+            db.disconnect()
+        if handle is None:
+            return
+
+        with self._lock:
+            handle.cursors -= 1
+            if handle.cursors:
+                return
+            if handle is self._handle:
+                handle.idle_since = time.monotonic()
+                self._schedule_idle_timer()
+            elif handle in self._superseded:
+                self._superseded.remove(handle)
+                close_handle(handle)
+
+    def refresh(self) -> None:
+        """Called at the end of every request. Supersedes the handle if a file was replaced.
+
+        A replaced file stays on disk for as long as a handle on it is open, so the
+        handle is let go of eagerly instead of waiting for the next checkout.
+        """
+        with self._lock:
+            if self._handle is not None and self._handle.file_ids != get_schema_file_ids(self.path):
+                self.stats.reopens += 1
+                self._supersede()
+
+    def close(self) -> None:
+        """Let go of the handle, it is closed once its cursors are checked in."""
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._handle is not None:
+                self.stats.evictions += 1
+                self._supersede()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            handle = self._handle
+            return {
+                **self.stats,
+                "path": self.path,
+                "is_open": handle is not None,
+                "attached_schemas": sorted({schema for schema, _table in handle.file_ids}) if handle else [],
+                "attached_tables": len(handle.file_ids) if handle else 0,
+                "open_for": flt(time.monotonic() - handle.opened_at, 3) if handle else 0,
+                "cursors": handle.cursors if handle else 0,
+                "superseded": len(self._superseded),
+                "superseded_cursors": sum(superseded.cursors for superseded in self._superseded),
+                "pid": os.getpid(),
+            }
+
+    def _open(self) -> None:
+        db = ibis.duckdb.connect()
+        file_ids = get_schema_file_ids(self.path)
+        schemas = set()
+        for schema, table in file_ids:
+            path = os.path.join(self.path, schema, f"{table}.duckdb")
+            alias = quote_identifier(get_attached_name(schema, table))
+            try:
+                db.raw_sql(f"ATTACH '{escape_sql_path(path)}' AS {alias} (READ_ONLY)")
+                if schema not in schemas:
+                    db.raw_sql(f"CREATE SCHEMA {quote_identifier(schema)}")
+                    schemas.add(schema)
+                db.raw_sql(
+                    f"CREATE VIEW {quote_identifier(schema)}.{quote_identifier(table)} AS "
+                    f"SELECT * FROM {alias}.main.{quote_identifier(table)}"
+                )
+            except Exception:
+                # a broken table file must not take the rest of the warehouse down
+                frappe.log_error(title=f"Failed to attach data warehouse table {schema}.{table}")
+
+        materializations_path = os.path.join(os.path.dirname(self.path), MATERIALIZATIONS_FOLDER)
+        os.makedirs(materializations_path, exist_ok=True)
+        db.raw_sql(f"SET allowed_directories = ['{escape_sql_path(materializations_path)}']")
+        db.raw_sql(f"SET home_directory='{get_private_files_path()}'")
+        db.raw_sql("SET enable_external_access = false")
+
+        self._handle = frappe._dict(
+            db=db,
+            file_ids=file_ids,
+            opened_at=time.monotonic(),
+            cursors=0,
+            idle_since=None,
         )
 
+    def _supersede(self) -> None:
+        handle, self._handle = self._handle, None
+        if handle.cursors:
+            self._superseded.append(handle)
+        else:
+            close_handle(handle)
+
+    def _sweep(self) -> None:
+        with self._lock:
+            self._idle_timer = None
+            handle = self._handle
+            if handle is None or handle.cursors:
+                # checked out again, the timer is armed when the last cursor is checked in
+                return
+
+            idle_for = time.monotonic() - handle.idle_since
+            if idle_for >= self.idle_timeout:
+                self.stats.evictions += 1
+                self._supersede()
+            else:
+                self._schedule_idle_timer(self.idle_timeout - idle_for)
+
+    def _schedule_idle_timer(self, interval: float | None = None) -> None:
+        if self._idle_timer is not None:
+            return
+        self._idle_timer = threading.Timer(interval or self.idle_timeout, self._sweep)
+        self._idle_timer.daemon = True
+        self._idle_timer.start()
+
+    def _cancel_idle_timer(self) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+
+def close_handle(handle: frappe._dict) -> None:
+    with suppress(Exception):
+        handle.db.disconnect()
+
+
+_warehouse_pools: dict[str, WarehouseConnectionPool] = {}
+_warehouse_pools_lock = threading.Lock()
+
+
+def get_warehouse_pool(path: str) -> WarehouseConnectionPool:
+    """Return the connection pool of this process for the warehouse schemas at `path`."""
+    with _warehouse_pools_lock:
+        if path not in _warehouse_pools:
+            _warehouse_pools[path] = WarehouseConnectionPool(path)
+        return _warehouse_pools[path]
+
+
+def get_schema_file_ids(path: str) -> dict[tuple[str, str], tuple]:
+    """Map every (schema, table) with a file in `path` to its (inode, mtime), used to detect replaced files."""
+    file_ids = {}
+    with suppress(FileNotFoundError), os.scandir(path) as schemas:
+        for schema in schemas:
+            if not schema.is_dir():
+                continue
+            with suppress(FileNotFoundError), os.scandir(schema.path) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(".duckdb"):
+                        stat = entry.stat()
+                        table = entry.name.removesuffix(".duckdb")
+                        file_ids[(schema.name, table)] = (stat.st_ino, stat.st_mtime_ns)
+    return file_ids
+
+
+def get_attached_name(schema: str, table: str) -> str:
+    """Name a table file is attached under, its table is read through the view `schema.table`."""
+    return f"{schema}/{table}"
+
+
+def get_write_lock_name(schema: str, table: str) -> str:
+    return f"insights_warehouse_write_{schema}.{table}"
+
+
+def write_record_batches(
+    reader: pa.RecordBatchReader, parquet_path: Path, row_group_size: int, memory_limit: int
+) -> tuple[int, int, int]:
+    """Write `reader` to `parquet_path` and return (rows, row groups, peak buffer bytes).
+
+    Safe to call from worker threads, it does not touch `frappe.local`.
+    """
+    buffer: list[pa.RecordBatch] = []
+    buffer_rows = buffer_bytes = peak_bytes = 0
+    total_rows = row_groups = 0
+
+    with pq.ParquetWriter(parquet_path, reader.schema) as parquet_writer:
+        for batch in reader:
+            if not batch.num_rows:
+                continue
+
+            buffer.append(batch)
+            buffer_rows += batch.num_rows
+            buffer_bytes += batch.get_total_buffer_size()
+            peak_bytes = max(peak_bytes, buffer_bytes)
+
+            if buffer_rows >= row_group_size or buffer_bytes >= memory_limit:
+                parquet_writer.write_table(pa.Table.from_batches(buffer), row_group_size=buffer_rows)
+                total_rows += buffer_rows
+                row_groups += 1
+                buffer, buffer_rows, buffer_bytes = [], 0, 0
+
+        if buffer:
+            parquet_writer.write_table(pa.Table.from_batches(buffer), row_group_size=buffer_rows)
+            total_rows += buffer_rows
+            row_groups += 1
+
+    return total_rows, row_groups, peak_bytes
+
+
+def get_duckdb_file_size(path: str) -> int:
+    size = 0
+    for file in (path, f"{path}.wal"):
+        with suppress(FileNotFoundError):
+            size += os.path.getsize(file)
+    return size
+
+
+def remove_duckdb_file(path: str) -> None:
+    for file in (path, f"{path}.wal"):
+        with suppress(FileNotFoundError):
+            os.remove(file)
+
+
+def quote_identifier(name: str) -> str:
+    return sg.to_identifier(name, quoted=True).sql("duckdb")
+
+
+def escape_sql_path(path: str) -> str:
+    return path.replace("'", "''")
+
+
+def get_private_files_path() -> str:
+    return escape_sql_path(os.path.realpath(get_files_path(is_private=1)))
+
 
 class WarehouseTableWriter:
     """Handles batch inserts to warehouse tables using temporary parquet files.
@@ -114,24 +578,44 @@ class WarehouseTableWriter:
 
     The writer only acquires a write connection during the final commit phase,
     minimizing lock contention for long-running imports.
+
+    In 'merge' mode, inserted rows replace existing rows with the same `key`, and
+    rows can be removed with `delete_keys` or `keep_only_keys`. A key inserted more
+    than once keeps only the copy inserted last.
+
+    With a `sort_key`, rows are written in its order, so the min/max kept for each
+    row group let DuckDB skip the row groups outside a filter on that column.
     """
 
+    # DuckDB's own row group size, so each parquet row group maps onto one
+    ROW_GROUP_SIZE = 122_880
+
     def __init__(
         self,
         table_name: str,
         table_schema: ibis.Schema,
         database: str = "main",
         mode: str = "replace",
+        key: str = "",
+        sort_key: str = "",
         log_fn=None,
     ):
+        if mode == "merge" and not key:
+            raise ValueError("WarehouseTableWriter needs a key column in merge mode")
+
         self.database = database
         self.table_name = table_name
         self.table_schema = table_schema
-        self.mode = mode  # 'replace' or 'append'
+        self.mode = mode  # 'replace', 'append' or 'merge'
+        self.key = key
+        self.sort_key = sort_key
         self._log = log_fn or (lambda *args, **kwargs: None)
 
         self._temp_dir: Path | None = None
         self._parquet_files: list[Path] = []
+        # key sets for merge mode, kept out of the batch files' glob
+        self._deleted_keys_file: Path | None = None
+        self._live_keys_file: Path | None = None
         self._committed = False
         self._batch_count = 0
 
@@ -150,62 +634,223 @@ class WarehouseTableWriter:
         self._cleanup_temp_dir()
         return False
 
-    def insert(self, data: pd.DataFrame | Expr) -> Expr:
+    def insert(self, data: pd.DataFrame | pa.Table | Expr) -> Expr:
         if self._temp_dir is None:
             raise RuntimeError("WarehouseTableWriter must be used as a context manager")
 
-        # switch to memory backend for writing to temp directory
-        data = ibis.memtable(data)
-
-        parquet_path = self._temp_dir / f"batch_{self._batch_count + 1}.parquet"
+        parquet_path = self._next_parquet_path()
         self._log(f"Writing batch {self._batch_count + 1}")
-        data.to_parquet(parquet_path)
+
+        if isinstance(data, pa.Table):
+            pq.write_table(data, parquet_path, row_group_size=self.ROW_GROUP_SIZE)
+        else:
+            # switch to memory backend for writing to temp directory
+            ibis.memtable(data).to_parquet(parquet_path)
 
         self._parquet_files.append(parquet_path)
         self._batch_count += 1
 
         return ibis.read_parquet(parquet_path)
 
+    def write_batches(self, reader: pa.RecordBatchReader, memory_limit: int) -> int:
+        """Stream record batches into a single parquet file and return the rows written.
+
+        Batches are buffered until they fill a row group of `ROW_GROUP_SIZE` rows or
+        their Arrow buffers reach `memory_limit` bytes, whichever comes first.
+        """
+        parquet_path = self._next_parquet_path()
+        self._log(f"Streaming batches to {parquet_path.name}")
+
+        total_rows, row_groups, peak_bytes = write_record_batches(
+            reader, parquet_path, self.ROW_GROUP_SIZE, memory_limit
+        )
+
+        self._add_parquet_file(parquet_path)
+        self._log(
+            f"Streamed {total_rows} rows in {row_groups} row groups, "
+            f"peak buffer {peak_bytes / 1024**2:.1f} MB"
+        )
+        return total_rows
+
+    def write_partitions(self, readers: list[Callable[[], pa.RecordBatchReader]], memory_limit: int) -> int:
+        """Stream several readers concurrently, each into its own parquet file, and return the rows written.
+
+        The readers are opened and consumed on worker threads, so they must not touch
+        `frappe.local`. Each one gets an equal share of `memory_limit`.
+        """
+        parquet_paths = [self._next_parquet_path(offset) for offset in range(len(readers))]
+        memory_share = max(memory_limit // len(readers), 1)
+        self._log(f"Streaming {len(readers)} partitions concurrently")
+
+        def write_partition(open_reader, parquet_path):
+            return write_record_batches(open_reader(), parquet_path, self.ROW_GROUP_SIZE, memory_share)
+
+        total_rows = 0
+        with ThreadPoolExecutor(
+            max_workers=len(readers), thread_name_prefix="insights_import_partition"
+        ) as executor:
+            futures = {
+                executor.submit(write_partition, open_reader, parquet_path): idx
+                for idx, (open_reader, parquet_path) in enumerate(zip(readers, parquet_paths, strict=True))
+            }
+            for future in as_completed(futures):
+                rows, row_groups, peak_bytes = future.result()
+                total_rows += rows
+                self._log(
+                    f"Partition {futures[future] + 1}: {rows} rows in {row_groups} row groups, "
+                    f"peak buffer {peak_bytes / 1024**2:.1f} MB"
+                )
+
+        for parquet_path in parquet_paths:
+            self._add_parquet_file(parquet_path)
+        return total_rows
+
+    def delete_keys(self, keys: pa.Table) -> None:
+        """Remove the rows with these keys on commit, before the inserted rows are merged in."""
+        self._deleted_keys_file = self._write_key_file("deleted_keys.parquet", keys.select([self.key]))
+        self._log(f"{keys.num_rows} deleted keys to remove")
+
+    def keep_only_keys(self, reader: pa.RecordBatchReader, memory_limit: int) -> None:
+        """Remove the rows whose keys are missing from `reader` on commit, after the merge."""
+        path = self._write_key_file("live_keys.parquet")
+        rows, _, _ = write_record_batches(reader, path, self.ROW_GROUP_SIZE, memory_limit)
+        self._live_keys_file = path
+        self._log(f"{rows} live keys to reconcile against")
+
+    def _write_key_file(self, file_name: str, keys: pa.Table | None = None) -> Path:
+        if self.mode != "merge":
+            raise RuntimeError("Keys can only be removed in merge mode")
+        if self._temp_dir is None:
+            raise RuntimeError("WarehouseTableWriter must be used as a context manager")
+
+        key_dir = self._temp_dir / "keys"
+        key_dir.mkdir(exist_ok=True)
+        path = key_dir / file_name
+        if keys is not None:
+            pq.write_table(keys, path)
+        return path
+
+    def _next_parquet_path(self, offset: int = 0) -> Path:
+        if self._temp_dir is None:
+            raise RuntimeError("WarehouseTableWriter must be used as a context manager")
+        # zero-padded, so the batch files sort in the order they were written
+        return self._temp_dir / f"batch_{self._batch_count + offset + 1:06d}.parquet"
+
+    def _add_parquet_file(self, parquet_path: Path) -> None:
+        self._parquet_files.append(parquet_path)
+        self._batch_count += 1
+
     def commit(self) -> int:
         if self._committed:
             return 0
 
-        if not self._parquet_files:
+        if not self._parquet_files and not self._has_key_files():
             self._committed = True
             self._cleanup_temp_dir()
             return 0
 
         total_rows = 0
         try:
-            with insights.warehouse.get_write_connection() as db:
-                self._log(f"Committing {len(self._parquet_files)} parquet files to '{self.table_name}'")
-
-                with suppress(CatalogException):
-                    db.create_database(self.database)
-
-                db.raw_sql(f"USE '{self.database}'")
-
-                self._log(f"Switched to '{self.database}' database")
-
-                parquet_glob = str(self._temp_dir / "*.parquet")
-                merged = db.read_parquet(parquet_glob)
+            # a replace rewrites the whole table, the live file is only copied to add to it
+            with insights.warehouse.get_write_connection(
+                self.database, self.table_name, copy_live_file=self.mode != "replace"
+            ) as db:
+                self._log(
+                    f"Committing {len(self._parquet_files)} parquet files to '{self.database}.{self.table_name}'"
+                )
 
-                if self.mode == "append" and self._table_exists(db):
-                    db.insert(self.table_name, merged)
-                else:
-                    db.create_table(self.table_name, merged, schema=self.table_schema, overwrite=True)
+                table_exists = self._table_exists(db)
+                if self.mode == "merge" and table_exists:
+                    self._delete_listed_keys(db)
+
+                if self._parquet_files:
+                    parquet_glob = str(self._temp_dir / "*.parquet")
+                    if self.mode == "merge":
+                        merged = self._keep_last_copies(db, parquet_glob)
+                    else:
+                        merged = db.read_parquet(parquet_glob)
+                    if self.sort_key:
+                        merged = merged.order_by(self.sort_key)
+
+                    if self.mode == "merge" and table_exists:
+                        self._delete_matching_keys(db, parquet_glob)
+                        db.insert(self.table_name, merged)
+                    elif self.mode == "append" and table_exists:
+                        db.insert(self.table_name, merged)
+                    else:
+                        db.create_table(self.table_name, merged, schema=self.table_schema, overwrite=True)
+
+                    total_rows = merged.count().execute()
+                    total_rows = int(total_rows)
+
+                if self.mode == "merge" and table_exists:
+                    self._delete_unlisted_keys(db)
 
                 self._log("Commit completed.")
 
-                total_rows = merged.count().execute()
-                total_rows = int(total_rows)
-
             self._committed = True
         finally:
             self._cleanup_temp_dir()
 
+        # only after the new file is live, so no result of the old data is cached under the new version
+        bump_table_version(self.database, self.table_name)
         return total_rows
 
+    def _has_key_files(self) -> bool:
+        return bool(self._deleted_keys_file or self._live_keys_file)
+
+    def _keep_last_copies(self, db: DuckDBBackend, parquet_glob: str) -> Expr:
+        """Read the batches with one row per key, the one inserted last.
+
+        A row changed while it is being pulled can be read twice, and the merge would
+        otherwise insert both copies.
+        """
+        rows = db.read_parquet(parquet_glob, filename="_insights_batch_file", file_row_number=True)
+        window = ibis.window(
+            group_by=self.key,
+            order_by=[ibis.desc(rows._insights_batch_file), ibis.desc(rows.file_row_number)],
+        )
+        return rows.filter(ibis.row_number().over(window) == 0).drop(
+            "_insights_batch_file", "file_row_number"
+        )
+
+    def _delete_matching_keys(self, db: DuckDBBackend, parquet_glob: str) -> None:
+        """Delete the existing copies of the rows about to be inserted."""
+        path = escape_sql_path(parquet_glob)
+        deleted = self._delete_rows(
+            db, f"{self._quoted_key} IN (SELECT {self._quoted_key} FROM read_parquet('{path}'))"
+        )
+        self._log(f"Replacing {deleted} updated rows")
+
+    def _delete_listed_keys(self, db: DuckDBBackend) -> None:
+        if not self._deleted_keys_file:
+            return
+        path = escape_sql_path(str(self._deleted_keys_file))
+        deleted = self._delete_rows(
+            db, f"{self._quoted_key} IN (SELECT {self._quoted_key} FROM read_parquet('{path}'))"
+        )
+        self._log(f"Removed {deleted} deleted rows")
+
+    def _delete_unlisted_keys(self, db: DuckDBBackend) -> None:
+        if not self._live_keys_file:
+            return
+        path = escape_sql_path(str(self._live_keys_file))
+        table = quote_identifier(self.table_name)
+        deleted = self._delete_rows(
+            db,
+            f"NOT EXISTS (SELECT 1 FROM read_parquet('{path}') AS live "
+            f"WHERE live.{self._quoted_key} = {table}.{self._quoted_key})",
+        )
+        self._log(f"Removed {deleted} rows missing from the source")
+
+    def _delete_rows(self, db: DuckDBBackend, condition: str) -> int:
+        result = db.raw_sql(f"DELETE FROM {quote_identifier(self.table_name)} WHERE {condition}").fetchone()
+        return result[0] if result else 0
+
+    @property
+    def _quoted_key(self) -> str:
+        return quote_identifier(self.key)
+
     def _table_exists(self, db: DuckDBBackend) -> bool:
         try:
             return db.list_tables(like=f"^{self.table_name}$")
@@ -224,6 +869,7 @@ class WarehouseTableWriter:
                 shutil.rmtree(self._temp_dir)
         self._temp_dir = None
         self._parquet_files = []
+        self._deleted_keys_file = self._live_keys_file = None
         self._log("Temporary files cleaned up.")
 
     @property
@@ -256,6 +902,8 @@ class WarehouseTable:
         except TableNotFound:
             if import_if_not_exists:
                 self.enqueue_import()
+                # an empty placeholder until the import completes, it only lives in this request
+                frappe.flags.insights_build_uses_temp_tables = True
                 remote_table = self.get_remote_table()
                 return insights.warehouse.db.create_table(
                     self.warehouse_table_name,
@@ -283,11 +931,61 @@ class WarehouseTable:
         importer = WarehouseTableImporter(self)
         importer.enqueue_import()
 
+    def compute_stats(self) -> dict:
+        """Compute the row count and per-column stats of the imported table in one scan.
+
+        Every column gets its null count and fraction and approximate distinct count, numeric
+        and temporal columns their min/max. Text and boolean columns with at most
+        `LOW_CARDINALITY_LIMIT` values also keep the values themselves.
+        """
+        t = insights.warehouse.db.table(self.warehouse_table_name, database=self.schema)
+
+        metrics = {"row_count": t.count()}
+        columns = {}
+        for idx, (name, dtype) in enumerate(t.schema().items()):
+            if dtype.is_nested() or dtype.is_json() or dtype.is_binary():
+                continue
+            columns[name] = (idx, dtype)
+            metrics[f"c{idx}_non_null"] = t[name].count()
+            metrics[f"c{idx}_distinct"] = t[name].approx_nunique()
+            if dtype.is_numeric() or dtype.is_temporal():
+                metrics[f"c{idx}_min"] = t[name].min()
+                metrics[f"c{idx}_max"] = t[name].max()
+
+        row = t.aggregate(**metrics).to_pyarrow().to_pylist()[0]
+        row_count = row["row_count"]
+
+        column_stats = {}
+        for name, (idx, dtype) in columns.items():
+            stats = {
+                "null_count": row_count - row[f"c{idx}_non_null"],
+                "null_fraction": flt(1 - row[f"c{idx}_non_null"] / row_count, 4) if row_count else 0,
+                "distinct_count": row[f"c{idx}_distinct"],
+            }
+            if f"c{idx}_min" in row:
+                stats["min"] = row[f"c{idx}_min"]
+                stats["max"] = row[f"c{idx}_max"]
+            if (dtype.is_string() or dtype.is_boolean()) and stats["distinct_count"] <= LOW_CARDINALITY_LIMIT:
+                values = (
+                    t.select(name)
+                    .filter(t[name].notnull())
+                    .distinct()
+                    .order_by(name)
+                    # approx_count_distinct can undercount, fetch one more to tell
+                    .limit(LOW_CARDINALITY_LIMIT + 1)
+                    .to_pyarrow()[name]
+                    .to_pylist()
+                )
+                if len(values) <= LOW_CARDINALITY_LIMIT:
+                    stats["values"] = values
+            column_stats[name] = stats
+
+        return {"row_count": row_count, "columns": column_stats}
+
     def drop(self) -> None:
         """Drop this table from the warehouse. No-op if it does not exist."""
-        with insights.warehouse.get_write_connection(self.schema) as db:
-            with suppress(Exception):
-                db.drop_table(self.warehouse_table_name, force=True)
+        insights.warehouse.drop_table(self.schema, self.warehouse_table_name)
+        bump_table_version(self.schema, self.warehouse_table_name)
 
 
 class WarehouseTableImporter:
@@ -297,7 +995,9 @@ class WarehouseTableImporter:
         self.remote_table_schema = None
         self.primary_key = ""
         self.warehouse_table_name = ""
-        self.writer_mode = "replace"  # overridden to "append" for incremental syncs
+        self.sync_key = ""
+        self.writer_mode = "replace"  # "append" or "merge" for incremental syncs
+        self.delete_bookmark = None
 
         self.log = None
         self.last_log_time = None
@@ -386,11 +1086,16 @@ class WarehouseTableImporter:
             self.table.table_doc_name,
             [
                 "row_limit",
+                "import_mode",
+                "cluster_key",
                 "before_import_script",
                 "sync_mode",
                 "sync_cursor_column",
                 "sync_from",
+                "sync_key_column",
+                "sync_deletes",
                 "last_sync_bookmark",
+                "last_delete_bookmark",
             ],
             as_dict=True,
         )
@@ -400,13 +1105,22 @@ class WarehouseTableImporter:
             or 10_00_000
         )
         self.settings.before_import_script = table_doc.before_import_script or ""
+        self.settings.import_mode = table_doc.import_mode or "Batched"
+        self.settings.cluster_key = table_doc.cluster_key or ""
+        self.settings.parallelism = min(
+            frappe.db.get_value("Insights Data Source v3", self.table.data_source, "import_parallelism") or 1,
+            MAX_IMPORT_PARALLELISM,
+        )
         self.settings.memory_limit = (
             frappe.db.get_single_value("Insights Settings", "max_memory_usage") or 512
         )
         self.settings.sync_mode = table_doc.sync_mode or "Full"
         self.settings.sync_cursor_column = table_doc.sync_cursor_column or ""
         self.settings.sync_from = table_doc.sync_from  # Datetime or None
+        self.settings.sync_key_column = table_doc.sync_key_column or ""
+        self.settings.sync_deletes = table_doc.sync_deletes
         self.settings.last_sync_bookmark = table_doc.last_sync_bookmark or ""
+        self.settings.last_delete_bookmark = table_doc.last_delete_bookmark or ""
         self.log.db_set(
             {
                 "row_limit": self.settings.row_limit,
@@ -419,20 +1133,28 @@ class WarehouseTableImporter:
             f", cursor={self.settings.sync_cursor_column or 'N/A'}"
             f", sync_from={self.settings.sync_from or 'N/A'}"
             f", bookmark={self.settings.last_sync_bookmark or 'N/A'}"
+            f", key={self.settings.sync_key_column or 'N/A'}"
+            f", sync_deletes={self.settings.sync_deletes}"
             f", row_limit={self.settings.row_limit}"
+            f", import_mode={self.settings.import_mode}"
+            f", parallelism={self.settings.parallelism}"
         )
 
-    def _disable_statement_timeout(self):
+    def _disable_statement_timeout(self, backend=None):
         """Disable statement timeout on the remote connection.
 
         Import jobs are long-running background tasks managed by the queue
         worker, so the user-facing max_execution_time limit should not apply.
+        A pooled connection gets the limit back before it is reused.
         """
-        backend = insights.db_connections.get(self.table.data_source)
+        from .insights_data_source_v3 import set_statement_timeout
+
+        backend = backend or insights.db_connections.get(self.table.data_source)
         if backend is None:
             return
         with suppress(Exception):
             backend.raw_sql("SET MAX_STATEMENT_TIME=0")
+            backend._insights_restore_session = set_statement_timeout
 
     def prepare_remote_table(self) -> Expr:
         self.remote_table = self.table.get_remote_table()
@@ -471,12 +1193,27 @@ class WarehouseTableImporter:
         self.primary_key = pk
 
         self._apply_before_import_script()
+        self.source_table = self.remote_table
 
         bookmark = self._resolve_incremental_bookmark()
         self._log(f"Incremental sync: {pk} > {bookmark}")
         self.remote_table = self.remote_table.filter(_[pk] > bookmark)
 
-        self.writer_mode = "append"
+        self.sync_key = self._resolve_sync_key()
+        self.writer_mode = "merge" if self.sync_key else "append"
+
+    def _resolve_sync_key(self) -> str:
+        """Return the column that identifies a row, which turns incremental syncs into merges."""
+        key = self.settings.sync_key_column
+        if not key and self._is_frappe_table() and "name" in self.source_table.columns:
+            key = "name"
+
+        if not key and self.settings.sync_deletes:
+            frappe.throw(
+                f"Syncing deletes for <b>{self.table.table_name}</b> needs a <b>Key Column</b> "
+                "to identify the deleted rows."
+            )
+        return key
 
     def _resolve_incremental_bookmark(self):
         """Return the cursor value to filter from for incremental sync, following this precedence:
@@ -532,15 +1269,25 @@ class WarehouseTableImporter:
         self.warehouse_table_name = self.table.warehouse_table_name
 
         try:
-            batch_size = self.calculate_batch_size()
             with insights.warehouse.get_table_writer(
                 self.warehouse_table_name,
                 self.remote_table_schema,
                 database=self.table.schema,
                 mode=self.writer_mode,
+                key=self.sync_key,
+                sort_key=self._resolve_cluster_key(),
                 log_fn=self._log,
             ) as writer:
-                total_rows = self.process_batches(batch_size, writer)
+                total_rows = None
+                if self.writer_mode == "replace":
+                    total_rows = self.process_partitions(writer)
+                if total_rows is None and self.settings.import_mode == "Streaming":
+                    total_rows = self.process_stream(writer)
+                elif total_rows is None:
+                    batch_size = self.calculate_batch_size()
+                    total_rows = self.process_batches(batch_size, writer)
+                if self.writer_mode == "merge" and self.settings.sync_deletes:
+                    self.reconcile_deletes(writer)
                 self.log.rows_imported = total_rows
             self.update_insights_table()
             self.log.status = "Completed"
@@ -550,12 +1297,24 @@ class WarehouseTableImporter:
             self._log(f"Error:\n{frappe.get_traceback()}")
             raise e
 
+    def _resolve_cluster_key(self) -> str:
+        """Return the column to sort the warehouse table by, the sync cursor unless set."""
+        cluster_key = self.settings.cluster_key or self.primary_key
+        if cluster_key and cluster_key not in self.remote_table_schema:
+            self._log(f"Warning: cluster key {cluster_key} is not a column of the table, rows are unsorted.")
+            return ""
+        if cluster_key:
+            self._log(f"Cluster key: {cluster_key}")
+        return cluster_key
+
     def calculate_batch_size(self) -> int:
         sample_size = 10
-        sample_rows = self.remote_table.head(sample_size).execute()
-        total_size = sum(sample_rows[column].memory_usage(deep=True) for column in sample_rows.columns)
-        row_size = total_size / sample_size / (1024 * 1024)
-        batch_size = int(self.settings.memory_limit / row_size)
+        sample_rows = self.remote_table.head(sample_size).to_pyarrow()
+        # batches are fetched as Arrow tables, so measure the sample the same way
+        total_size = sample_rows.get_total_buffer_size()
+        row_size = max(total_size / max(sample_rows.num_rows, 1), 1) / (1024 * 1024)
+        # process_batches holds two batches in memory: one being written, one being fetched
+        batch_size = int(self.settings.memory_limit / 2 / row_size)
         self.log.db_set(
             {
                 "row_size": row_size * 1024,
@@ -566,6 +1325,16 @@ class WarehouseTableImporter:
         return batch_size
 
     def process_batches(self, batch_size: int, writer: WarehouseTableWriter) -> int:
+        """Import the remote table in keyset-paginated batches.
+
+        Fetching and writing are pipelined: while a batch is written to parquet on
+        this thread, the next page is already being fetched from the remote database
+        on a background thread. The keyset bookmark for the next page comes from the
+        fetched batch itself, so no extra queries are needed between pages.
+
+        Only the fetch runs on the background thread. It touches nothing but the
+        remote connection, which this thread leaves alone until the fetch is done.
+        """
         remote_table = self.remote_table
         if self.primary_key:
             remote_table = remote_table.order_by(
@@ -575,29 +1344,198 @@ class WarehouseTableImporter:
         batch_number = 0
         total_rows = 0
 
-        while True:
-            self._log(f"Processing batch: {batch_number + 1}")
-            batch = remote_table.head(batch_size)
-            self._log(f"Batch Query: \n{ibis.to_sql(batch)}")
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="insights_import_fetch") as executor:
+            next_batch = self._fetch_batch(executor, remote_table, batch_size, batch_number)
+
+            while True:
+                batch: pa.Table = next_batch.result()
+                batch_count = batch.num_rows
+                total_rows += batch_count
 
-            batch = writer.insert(batch)
+                has_more = batch_count == batch_size and bool(self.primary_key)
+                if has_more:
+                    max_pk = pc.max(batch[self.primary_key]).as_py()
+                    has_more = max_pk is not None
 
-            batch_count = batch.count().execute()
-            total_rows += int(batch_count)
+                if has_more:
+                    self._log(f"Bookmark: {max_pk}")
+                    remote_table = remote_table.filter(_[self.primary_key] > max_pk)
+                    next_batch = self._fetch_batch(executor, remote_table, batch_size, batch_number + 1)
 
-            self._log(f"Rows: {batch_count} Total Rows: {total_rows}")
+                writer.insert(batch)
+                self._log(f"Rows: {batch_count} Total Rows: {total_rows}")
 
-            if batch_count < batch_size or not self.primary_key:
-                break
+                if not has_more:
+                    break
 
-            max_pk = batch[self.primary_key].max().execute()
-            self._log(f"Bookmark: {max_pk}")
-            remote_table = remote_table.filter(_[self.primary_key] > max_pk)
-            batch_number += 1
+                batch_number += 1
 
         self._log(f"Total Batches: {batch_number + 1} Total Rows: {total_rows}")
         return total_rows
 
+    def process_stream(self, writer: WarehouseTableWriter) -> int:
+        """Import the remote table with a single query, streamed as Arrow record batches."""
+        self._log(f"Streaming Query: \n{ibis.to_sql(self.remote_table)}")
+        reader = read_remote_batches(self.remote_table)
+        memory_limit = self.settings.memory_limit * 1024 * 1024
+        total_rows = writer.write_batches(reader, memory_limit=memory_limit)
+        self._log(f"Total Rows: {total_rows}")
+        return total_rows
+
+    def reconcile_deletes(self, writer: WarehouseTableWriter) -> None:
+        """Queue the removal of rows deleted at the source since the last sync.
+
+        Frappe tables list their deleted names in the Deleted Document log, so only
+        the deletions logged since the last sync are read. They are tracked by the
+        log's own creation time, since the cursor column need not be a timestamp of
+        the source's clock. Other tables have no such log, and the full set of keys is
+        compared against the warehouse instead.
+        """
+        bookmark = self.settings.last_sync_bookmark
+        if not bookmark:
+            # first sync, there is nothing in the warehouse to remove yet
+            return
+
+        if self._is_frappe_table():
+            backend = InsightsDataSourcev3.get_doc(self.table.data_source)._get_ibis_backend()
+            deleted_documents = backend.table("tabDeleted Document")
+            # tables synced before deletions were tracked fall back to the cursor's bookmark
+            deleted_since = self.settings.last_delete_bookmark or bookmark
+            deleted_keys = deleted_documents.filter(
+                _.deleted_doctype == self.table.table_name.removeprefix("tab"),
+                _.creation > deleted_since,
+            ).select(**{self.sync_key: _.deleted_name}, deleted_at=_.creation)
+            self._log(f"Deleted Keys Query: \n{ibis.to_sql(deleted_keys)}")
+            deleted_keys = deleted_keys.to_pyarrow()
+            writer.delete_keys(deleted_keys)
+            if deleted_keys.num_rows:
+                self.delete_bookmark = pc.max(deleted_keys["deleted_at"]).as_py()
+        else:
+            live_keys = self.source_table.select(self.sync_key)
+            self._log(f"Live Keys Query: \n{ibis.to_sql(live_keys)}")
+            writer.keep_only_keys(
+                read_remote_batches(live_keys),
+                memory_limit=self.settings.memory_limit * 1024 * 1024,
+            )
+
+    def _is_frappe_table(self) -> bool:
+        return bool(
+            self.table.table_name.startswith("tab")
+            and frappe.db.get_value("Insights Data Source v3", self.table.data_source, "is_frappe_db")
+        )
+
+    def process_partitions(self, writer: WarehouseTableWriter) -> int | None:
+        """Import the remote table as ranges of its key, each read over its own connection.
+
+        Returns None when the table can't be split, and the caller falls back to a
+        sequential import. The connections are opened here, on the main thread,
+        since opening one reads the data source's credentials.
+        """
+        bounds = self._get_partition_bounds()
+        if not bounds:
+            return None
+
+        partitions = len(bounds) - 1
+        # every partition holds one page in memory at a time
+        page_size = max(self.calculate_batch_size() // partitions, 1)
+        self._log(f"Page size: {page_size}")
+
+        data_source = frappe.get_doc("Insights Data Source v3", self.table.data_source)
+        connections = []
+        try:
+            readers = []
+            for idx in range(partitions):
+                connection = data_source.open_connection()
+                connections.append(connection)
+                self._disable_statement_timeout(connection)
+
+                partition = self._get_partition(bounds, idx)
+                self._log(f"Partition {idx + 1} Query: \n{ibis.to_sql(partition)}")
+                readers.append(
+                    partial(self._read_partition, connection, partition, page_size, include_nulls=idx == 0)
+                )
+
+            memory_limit = self.settings.memory_limit * 1024 * 1024
+            total_rows = writer.write_partitions(readers, memory_limit=memory_limit)
+        finally:
+            for connection in connections:
+                with suppress(Exception):
+                    connection.disconnect()
+
+        self._log(f"Total Partitions: {len(readers)} Total Rows: {total_rows}")
+        return total_rows
+
+    def _get_partition_bounds(self) -> list | None:
+        """Split the key's [min, max] range into equal-width ranges, one per connection.
+
+        Full imports only have a key when the table has a `creation` or `timestamp`
+        column. Equal widths assume rows are created evenly over that range, which
+        holds well enough for logs and transactions.
+        """
+        pk = self.primary_key
+        if self.settings.parallelism < 2 or not pk:
+            return None
+
+        dtype = self.remote_table_schema[pk]
+        if not (dtype.is_timestamp() or dtype.is_date()):
+            return None
+
+        key_range = self.remote_table.aggregate(lower=_[pk].min(), upper=_[pk].max()).to_pyarrow()
+        lower, upper = key_range["lower"][0].as_py(), key_range["upper"][0].as_py()
+        if lower is None or upper is None or lower == upper:
+            return None
+
+        partitions = self.settings.parallelism
+        bounds = [lower + (upper - lower) * idx / partitions for idx in range(partitions)]
+        bounds = sorted({*bounds, upper})
+        if len(bounds) < 3:
+            return None
+
+        self._log(f"Partitioning {pk} from {lower} to {upper} into {len(bounds) - 1} ranges")
+        return bounds
+
+    def _get_partition(self, bounds: list, idx: int) -> Expr:
+        key = _[self.primary_key]
+        is_last = idx == len(bounds) - 2
+
+        condition = key >= bounds[idx]
+        condition &= key <= bounds[idx + 1] if is_last else key < bounds[idx + 1]
+        return self.remote_table.filter(condition)
+
+    def _read_partition(
+        self, connection, partition: Expr, page_size: int, include_nulls: bool = False
+    ) -> pa.RecordBatchReader:
+        """Read a partition over `connection` in keyset-paginated pages of `page_size` rows.
+
+        MySQL and MariaDB fetch a whole result before handing out its first batch, so
+        streaming the partition with one query would hold all of it in memory. Runs on
+        a worker thread, so it must not touch `frappe.local`.
+        """
+        pk = self.primary_key
+
+        def read_pages():
+            if include_nulls:
+                # rows without a key fall outside every range, the first one reads them
+                yield from connection.to_pyarrow(self.remote_table.filter(_[pk].isnull())).to_batches()
+
+            page = partition.order_by(pk)
+            while True:
+                batch = connection.to_pyarrow(page.head(page_size))
+                yield from batch.to_batches()
+                if batch.num_rows < page_size:
+                    break
+                page = page.filter(_[pk] > pc.max(batch[pk]).as_py())
+
+        return pa.RecordBatchReader.from_batches(self.remote_table_schema.to_pyarrow(), read_pages())
+
+    def _fetch_batch(
+        self, executor: ThreadPoolExecutor, remote_table: Table, batch_size: int, batch_number: int
+    ) -> Future:
+        batch = remote_table.head(batch_size)
+        self._log(f"Fetching batch: {batch_number + 1}")
+        self._log(f"Batch Query: \n{ibis.to_sql(batch)}")
+        return executor.submit(batch.to_pyarrow)
+
     def update_log(self):
         ended_at = frappe.utils.now()
         self.log.db_set(
@@ -617,15 +1555,34 @@ class WarehouseTableImporter:
         )
         t.stored = 1
         t.last_synced_on = frappe.utils.now()
+        self._update_table_stats(t)
 
         if self.settings.sync_mode == "Incremental" and self.primary_key:
             new_bookmark = self._read_warehouse_bookmark()
             if new_bookmark is not None:
                 t.last_sync_bookmark = str(new_bookmark)
                 self._log(f"Bookmark updated: {self.primary_key} = {new_bookmark}")
+            if self.delete_bookmark is not None:
+                t.last_delete_bookmark = str(self.delete_bookmark)
+                self._log(f"Deletions synced up to {self.delete_bookmark}")
 
         t.save(ignore_permissions=True)
 
+    def _update_table_stats(self, t: InsightsTablev3) -> None:
+        try:
+            stats = self.table.compute_stats()
+        except Exception:
+            self._log(f"Warning: could not compute table stats.\n{frappe.get_traceback()}")
+            return
+
+        stats["last_import"] = {
+            "rows": self.log.rows_imported,
+            "duration": frappe.utils.time_diff_in_seconds(frappe.utils.now(), self.log.started_at),
+        }
+        t.row_count = stats["row_count"]
+        t.column_stats = frappe.as_json(stats, indent=None)
+        self._log(f"Table stats updated: {t.row_count} rows, {len(stats['columns'])} columns")
+
     def _read_warehouse_bookmark(self):
         """Query DuckDB for the MAX cursor value after a successful incremental import.
 
@@ -672,14 +1629,97 @@ def execute_warehouse_table_import(data_source: str, table_name: str):
     importer.start_import()
 
 
+def compact_warehouse():
+    """Compact every table file of the warehouse that has gathered enough free space."""
+    from insights.insights.doctype.insights_data_source_v3.insights_data_source_v3 import (
+        db_connections,
+    )
+
+    logger = frappe.logger("insights")
+    warehouse = insights.warehouse
+
+    for schema, table in sorted(get_schema_file_ids(warehouse.get_schemas_path())):
+        try:
+            with db_connections():
+                result = warehouse.compact(schema, table)
+        except Exception:
+            logger.exception(f"Insights warehouse: failed to compact '{schema}.{table}'")
+            continue
+
+        if result:
+            logger.info(
+                f"Insights warehouse: compacted '{schema}.{table}' ({result['free_ratio']:.0%} free) "
+                f"from {result['size_before'] / 1024**2:.1f} MB to {result['size_after'] / 1024**2:.1f} MB"
+            )
+
+
 def get_warehouse_schema_name(data_source: str) -> str:
     """Return the DuckDB schema name for a given data source name."""
     return frappe.scrub(data_source).replace(".", "_")
 
 
+def bump_table_version(schema: str, table_name: str) -> None:
+    """Give a warehouse table a new version, so cached results that read it are not used again."""
+    frappe.cache().hset(TABLE_VERSIONS_KEY, f"{schema}.{table_name}", time.time_ns())
+
+
+def read_remote_batches(query: Table, chunk_size: int = STREAM_CHUNK_SIZE) -> pa.RecordBatchReader:
+    """Stream the results of a query on a data source as Arrow record batches.
+
+    ibis fetches a whole MySQL or MariaDB result before handing out its first batch,
+    so those are read over an unbuffered cursor instead, `chunk_size` rows at a time.
+    """
+    backend = query.get_backend()
+    if backend.name != "mysql":
+        return query.to_pyarrow_batches(chunk_size=chunk_size)
+
+    from ibis.backends.mysql.converter import MySQLPandasData
+    from MySQLdb.cursors import SSCursor
+
+    schema = query.schema()
+    arrow_schema = schema.to_pyarrow()
+    sql = backend.compile(query)
+
+    def read_chunks():
+        cursor = backend.con.cursor(SSCursor)
+        try:
+            cursor.execute(sql)
+            while rows := cursor.fetchmany(chunk_size):
+                df = pd.DataFrame.from_records(rows, columns=schema.names, coerce_float=True)
+                df = MySQLPandasData.convert_table(df, schema)
+                yield from pa.Table.from_pandas(df, schema=arrow_schema, preserve_index=False).to_batches()
+        finally:
+            cursor.close()
+
+    return pa.RecordBatchReader.from_batches(arrow_schema, read_chunks())
+
+
+def get_table_versions(query: Expr) -> dict | None:
+    """Return the versions of the warehouse tables a query reads.
+
+    Returns None if the query reads anything without a version: tables imported
+    before versions were kept, temporary tables, or raw SQL whose tables are unknown.
+    """
+    if query.op().find((ops.SQLQueryResult, ops.SQLStringView)):
+        return None
+
+    versions = {}
+    for table in query.op().find(DatabaseTable):
+        namespace = table.namespace
+        # materialized results are written to a new file every time, a file never changes
+        if namespace.catalog and namespace.catalog.startswith(MATERIALIZED_CATALOG_PREFIX):
+            versions[namespace.catalog] = namespace.catalog
+            continue
+        key = f"{namespace.database or namespace.catalog}.{table.name}"
+        version = frappe.cache().hget(TABLE_VERSIONS_KEY, key)
+        if version is None:
+            return None
+        versions[key] = version
+    return versions
+
+
 def is_warehouse(backend: DuckDBBackend):
     args = getattr(backend, "_con_args", None)
     if args and isinstance(args, tuple) and len(args) > 0:
-        warehouse_db_path = insights.warehouse.get_db_path()
-        return args[0] == warehouse_db_path
+        return args[0] == insights.warehouse.get_schemas_path()
     return False
@@ -0,0 +1,229 @@
+"""Joins across data sources, run on a DuckDB database that lives for the request.
+
+A join of two tables on different connections can not run on either of them.
+Each side is replaced by an empty table of the same schema in the federation
+database, and the join and every operation after it are built on those tables.
+Rule based filters applied after the join, whose columns all come from one side,
+are also applied to that side at its source, unless the join can fill the side
+with nulls.
+
+Nothing is fetched while the query is built. Right before an expression on the
+federation database is executed, each side it reads is fetched from its source
+with the filters pushed down to it and only the columns the expression reads, and
+streamed into its table as Arrow batches. A side is fetched again if a later
+expression reads columns it was not fetched with.
+"""
+
+from contextlib import nullcontext
+
+import frappe
+import ibis.expr.operations as ops
+import pyarrow as pa
+from ibis.backends.duckdb import Backend as DuckDBBackend
+from ibis.expr.types import Table
+
+import insights
+from insights.insights.doctype.insights_query_v3.build_cache import SOURCE_NODES, TEMP_TABLE_FLAG
+
+from .admission import admit_query
+from .data_warehouse import WAREHOUSE_DB_NAME
+
+FEDERATION_DB_NAME = "insights_federation"
+FEDERATION_BATCH_SIZE = 50_000
+# operations after which a column still holds the values it was read with
+PUSHDOWN_OPERATIONS = ("join", "filter", "filter_group", "select", "remove", "order_by")
+# join types that fill the left or the right side with nulls for unmatched rows
+NULL_FILLED_LEFT = ("right", "outer")
+NULL_FILLED_RIGHT = ("left", "outer")
+
+
+class FederatedQuery:
+    """The sides of the cross data source joins of one query build."""
+
+    def __init__(self):
+        self.sides: list[frappe._dict] = []
+        # column of the query -> (side, column of the side), for columns filters can be pushed down for
+        self.columns: dict[str, tuple[frappe._dict, str]] = {}
+
+    def needs_federation(self, left: Table, right: Table) -> bool:
+        return len(get_backends(left) | get_backends(right)) > 1
+
+    def add_side(self, expr: Table) -> Table:
+        """Return an empty table in the federation database standing in for `expr`."""
+        db = get_federation_db()
+        if get_backends(expr) == {id(db)}:
+            return expr
+
+        name = f"federated_{frappe.generate_hash(length=10)}"
+        table = db.create_table(name, schema=expr.schema(), temp=True)
+        side = frappe._dict(
+            name=name,
+            expr=expr,
+            table=table,
+            data_source=get_data_source(expr),
+            filters=[],
+            # the columns the side was fetched with, None until it is fetched
+            loaded_columns=None,
+        )
+        self.sides.append(side)
+        db.sides[name] = side
+        # the expression is bound to tables of this request, it must not be memoized
+        frappe.flags[TEMP_TABLE_FLAG] = True
+        return table
+
+    def add_join(self, left: Table, right: Table, renamed_right: Table, how: str) -> None:
+        """Track the columns of a join of `left` with `right`, renamed to `renamed_right`."""
+        if not self.sides:
+            return
+
+        left_side = self.get_side(left)
+        if left_side is not None:
+            self.columns = {column: (left_side, column) for column in left.columns}
+        if how in NULL_FILLED_LEFT:
+            self.columns = {}
+
+        side = self.get_side(right)
+        if side is None or how in NULL_FILLED_RIGHT:
+            return
+        for column, renamed in zip(right.columns, renamed_right.columns, strict=True):
+            self.columns[renamed] = (side, column)
+
+    def after_operation(self, operation_type: str) -> None:
+        if operation_type not in PUSHDOWN_OPERATIONS:
+            self.columns = {}
+
+    def get_pushdown(self, filters: list, logical_operator="And") -> list[tuple[frappe._dict, list]]:
+        """Return the sides the filters can also be applied to, with the filters renamed to their columns.
+
+        Filters joined by Or are only pushed down if they all read from the same side.
+        """
+        pushdown = {}
+        for filter_args in filters:
+            column = self.get_pushdown_column(filter_args)
+            if column is None:
+                if logical_operator == "Or":
+                    return []
+                continue
+            side, side_column = column
+            column_args = frappe._dict(filter_args.column, column_name=side_column)
+            side_filters = pushdown.setdefault(side.name, (side, []))[1]
+            side_filters.append(frappe._dict(filter_args, column=column_args))
+
+        if logical_operator == "Or" and len(pushdown) > 1:
+            return []
+        return list(pushdown.values())
+
+    def get_pushdown_column(self, filter_args) -> tuple[frappe._dict, str] | None:
+        if filter_args.get("expression") or not filter_args.get("column"):
+            return None
+        # a comparison with another column could involve the other side
+        if getattr(filter_args.value, "column_name", None) is not None:
+            return None
+        column = self.columns.get(filter_args.column.column_name)
+        if column is None or column[0].loaded_columns is not None:
+            return None
+        return column
+
+    def get_side(self, table: Table) -> frappe._dict | None:
+        for side in self.sides:
+            if side.table.op() == table.op():
+                return side
+
+
+class FederationBackend(DuckDBBackend):
+    """The federation database, which fetches the sides an expression reads before executing it."""
+
+    def _run_pre_execute_hooks(self, expr) -> None:
+        load_sides(self, expr)
+        super()._run_pre_execute_hooks(expr)
+
+
+def load_sides(db: FederationBackend, expr) -> None:
+    """Fetch the sides `expr` reads into their tables, with the columns it reads of them."""
+    names = {node.name for node in expr.op().find(ops.DatabaseTable)} & db.sides.keys()
+    if not names:
+        return
+
+    read_columns = get_read_columns(expr)
+    for name in names:
+        side = db.sides[name]
+        columns = read_columns.get(name) or set(side.expr.columns)
+        if side.loaded_columns is not None:
+            if columns <= side.loaded_columns:
+                continue
+            # fetched before for an expression that read fewer columns
+            columns |= side.loaded_columns
+
+        side_expr = side.expr.filter(*side.filters) if side.filters else side.expr
+        if len(columns) < len(side_expr.columns):
+            side_expr = side_expr.select(*[column for column in side_expr.columns if column in columns])
+
+        with admit_query(side.data_source) if side.data_source else nullcontext():
+            load_side(side, side_expr)
+        side.loaded_columns = columns
+
+
+def load_side(side: frappe._dict, expr: Table) -> None:
+    from .ibis_utils import estimate_row_size, read_result_batches
+
+    budget = (frappe.db.get_single_value("Insights Settings", "max_result_size", cache=True) or 256) * 1024**2
+    max_rows = max(budget // estimate_row_size(expr.schema()), 1)
+    rows = 0
+
+    con = get_federation_db().con
+    # rows of an earlier fetch, with fewer columns or cut off
+    con.execute(f'DELETE FROM "{side.name}"')
+    view = f"{side.name}_batch"
+    # one row past the limit tells whether the side was cut off
+    with read_result_batches(expr, max_rows + 1, chunk_size=FEDERATION_BATCH_SIZE) as reader:
+        # a batch at a time from this thread, DuckDB would read a registered reader from its own
+        # threads, and the connections of some drivers can only be used from the thread they were made in
+        for batch in reader:
+            rows += batch.num_rows
+            con.register(view, pa.Table.from_batches([batch]))
+            try:
+                # by name, the columns the query does not read are left null
+                con.execute(f'INSERT INTO "{side.name}" BY NAME SELECT * FROM "{view}"')
+            finally:
+                con.unregister(view)
+
+    if rows > max_rows:
+        title = side.data_source or "one of the data sources"
+        frappe.throw(
+            title="Too Much Data to Join",
+            msg=f"More than {max_rows:,} rows would have to be fetched from {title} to join it with "
+            "another data source. Please add filters before the join or import the tables to the data store.",
+        )
+
+
+def get_federation_db() -> DuckDBBackend:
+    if FEDERATION_DB_NAME not in insights.db_connections:
+        db = FederationBackend().connect()
+        db.raw_sql("SET enable_external_access = false")
+        # side table name -> side
+        db.sides = {}
+        insights.db_connections[FEDERATION_DB_NAME] = db
+    return insights.db_connections[FEDERATION_DB_NAME]
+
+
+def get_backends(expr: Table) -> set[int]:
+    return {id(node.source) for node in expr.op().find(SOURCE_NODES)}
+
+
+def get_data_source(expr: Table) -> str | None:
+    backends = get_backends(expr)
+    if len(backends) != 1:
+        return None
+    for name, backend in insights.db_connections.items():
+        if id(backend) in backends and name not in (WAREHOUSE_DB_NAME, FEDERATION_DB_NAME):
+            return name
+
+
+def get_read_columns(query: Table) -> dict[str, set[str]]:
+    """Map the tables the query reads from to the columns it reads of them."""
+    read_columns = {}
+    for field in query.op().find(ops.Field):
+        rel = field.rel.parent if isinstance(field.rel, ops.Reference) else field.rel
+        if isinstance(rel, ops.DatabaseTable):
+            read_columns.setdefault(rel.name, set()).add(field.name)
+    return read_columns
@@ -1,13 +1,17 @@
 import ast
+import queue
 import re
 import time
-from contextlib import contextmanager
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager, nullcontext, suppress
 from datetime import date
 
 import frappe
 import ibis
-import numpy as np
+import ibis.expr.operations as ops
 import pandas as pd
+import pyarrow as pa
 import sqlglot as sg
 import sqlparse
 from frappe.utils.data import flt
@@ -17,21 +21,40 @@ from ibis.expr.datatypes import DataType
 from ibis.expr.operations.relations import DatabaseTable, Field
 from ibis.expr.types import Expr
 from ibis.expr.types import Table as IbisQuery
+from ibis.formats.pandas import PandasData
 
 import insights
 from insights import create_toast
 from insights.cache_utils import make_digest
-from insights.insights.doctype.insights_data_source_v3.data_warehouse import is_warehouse
+from insights.insights.doctype.insights_data_source_v3.data_warehouse import (
+    WAREHOUSE_DB_NAME,
+    get_table_versions,
+    is_warehouse,
+)
 from insights.insights.doctype.insights_table_v3.insights_table_v3 import (
     InsightsTablev3,
+    get_column_stats,
 )
 from insights.insights.query_builders.sql_functions import handle_timespan
 from insights.insights.query_utils import extract_sql_table_refs
-from insights.utils import create_execution_log
+from insights.utils import InsightsDataSourcev3, create_execution_log
 from insights.utils import deep_convert_dict_to_dict as _dict
 
+from .admission import DataSourceBusyError, acquire_slot, admit_query, release_slot, try_acquire_slot
+from .connection_pool import release_connection
+from .federation import FEDERATION_DB_NAME, FederatedQuery
 from .ibis.functions import fiscal_year_start, week_start
 from .ibis.utils import get_functions
+from .materialization import MaterializedReads
+from .result_cache import (
+    acquire_lock,
+    cache_results,
+    get_cached_results,
+    get_or_compute_results,
+    lookup_results,
+    release_lock,
+    replace_nulls,
+)
 
 try:
     from frappe.concurrency_limiter import concurrent_limit
@@ -57,6 +80,9 @@ class IbisQueryBuilder:
         self.active_operation_idx = active_operation_idx
         self.use_live_connection = bool(doc.use_live_connection)
         self.operations = doc.operations
+        # index of the operation being performed by `build`
+        self.operation_idx = None
+        self.federation = FederatedQuery()
         self.set_operations()
 
     def set_operations(self):
@@ -69,6 +95,7 @@ class IbisQueryBuilder:
         ):
             operations = operations[: self.active_operation_idx + 1]
 
+        self.operation_count = len(operations)
         if (
             hasattr(frappe.local, "insights_adhoc_filters")
             and self.doc.name in frappe.local.insights_adhoc_filters
@@ -99,12 +126,20 @@ class IbisQueryBuilder:
             )
 
         frappe.local._insights_building_queries.add(self.doc.name)
+        materialized_reads = None
+        if self.use_live_connection and self.doc.get("materialize_on_read"):
+            materialized_reads = MaterializedReads(self.operations, self.operation_count)
+
         try:
             self.query = None
             for idx, operation in enumerate(self.operations):
                 try:
                     operation = _dict(operation)
+                    self.operation_idx = idx
                     self.query = self.perform_operation(operation)
+                    self.federation.after_operation(operation.type)
+                    if materialized_reads:
+                        self.query = materialized_reads.read(self.query, idx + 1)
                 except CircularQueryReferenceError:
                     raise
                 except BaseException as e:
@@ -115,10 +150,45 @@ class IbisQueryBuilder:
                         type="error",
                     )
                     raise e
+
+            # federated joins read request-local tables, their SQL is never the same twice
+            if materialized_reads and not self.federation.sides:
+                materialized_reads.enqueue(self.doc)
             return self.query
         finally:
             frappe.local._insights_building_queries.discard(self.doc.name)
 
+    def get_stored_column_values(self, column_name: str) -> list | None:
+        """Return the distinct values of a column from the stats of its warehouse table, if they are kept."""
+        return (self.get_stored_column_stats(column_name) or {}).get("values")
+
+    def get_stored_column_stats(self, column_name: str, operation_count: int | None = None) -> dict | None:
+        """Return the stats of a column computed at the last import of its warehouse table.
+
+        Only answers when the first `operation_count` operations, or all of them, pass
+        the column through unchanged from a single imported table and no permission
+        rules could hide rows, else returns None.
+        """
+        operations = self.operations if operation_count is None else self.operations[:operation_count]
+        if self.use_live_connection or not operations:
+            return None
+
+        operations = [_dict(op) for op in operations]
+        source = operations[0]
+        if source.type != "source" or source.table.type != "table":
+            return None
+        if any(op.type not in ("select", "remove", "order_by") for op in operations[1:]):
+            return None
+
+        check_permissions = any(
+            frappe.get_single_value("Insights Settings", ["enable_permissions", "apply_user_permissions"])
+        )
+        if check_permissions:
+            return None
+
+        stats = get_column_stats(source.table.data_source, source.table.table_name)
+        return stats.get("columns", {}).get(column_name)
+
     def perform_operation(self, operation):
         if operation.type == "source":
             return self.apply_source(operation)
@@ -166,8 +236,16 @@ class IbisQueryBuilder:
                 use_live_connection=self.use_live_connection,
             )
         if table_args.type == "query":
+            from insights.insights.doctype.insights_query_v3.materialized_query import (
+                get_materialized_query_table,
+            )
+
             q = frappe.get_doc("Insights Query v3", table_args.query_name)
-            _table = q.build(use_live_connection=self.use_live_connection)
+            # a live query reads the query it is built on live as well
+            if not self.use_live_connection:
+                _table = get_materialized_query_table(q)
+            if _table is None:
+                _table = q.build(use_live_connection=self.use_live_connection)
 
         if _table is None:
             frappe.throw("Table or Query not found")
@@ -227,11 +305,18 @@ class IbisQueryBuilder:
 
     def apply_join(self, join_args):
         right_table = self.get_right_table(join_args)
+        # named after the source table even when the join is federated
+        right_table_name = get_ibis_table_name(right_table)
+        if self.federation.needs_federation(self.query, right_table):
+            self.query = self.federation.add_side(self.query)
+            right_table = self.federation.add_side(right_table)
+
         join_condition = self.translate_join_condition(join_args, right_table)
         join_type = "outer" if join_args.join_type == "full" else join_args.join_type
-        right_table = self.rename_duplicate_columns(right_table)
+        renamed_right_table = self.rename_duplicate_columns(right_table, right_table_name)
+        self.federation.add_join(self.query, right_table, renamed_right_table, join_type)
         return self.query.join(
-            right_table,
+            renamed_right_table,
             join_condition,
             how=join_type,
         )
@@ -308,11 +393,11 @@ class IbisQueryBuilder:
                 join_condition.right_column,
             )
 
-    def rename_duplicate_columns(self, right_table):
+    def rename_duplicate_columns(self, right_table, right_table_name=None):
         query: IbisQuery = self.query
         query_columns = set(query.columns)
         right_table_columns = set(right_table.columns)
-        right_table_name = get_ibis_table_name(right_table)
+        right_table_name = right_table_name or get_ibis_table_name(right_table)
         right_table_name = sanitize_name(right_table_name)
 
         duplicate_columns = query_columns.intersection(right_table_columns)
@@ -363,8 +448,20 @@ class IbisQueryBuilder:
 
     def apply_filter(self, filter_args):
         condition = self.make_filter_condition(filter_args)
+        self.push_down_filters([filter_args])
         return self.query.filter(condition)
 
+    def push_down_filters(self, filters, logical_operator="And"):
+        """Also apply the filters to the sides of a federated join their columns come from."""
+        for side, side_filters in self.federation.get_pushdown(filters, logical_operator):
+            query = self.query
+            self.query = side.expr
+            try:
+                conditions = [self.make_filter_condition(filter_args) for filter_args in side_filters]
+            finally:
+                self.query = query
+            side.filters.append(ibis.or_(*conditions) if logical_operator == "Or" else ibis.and_(*conditions))
+
     def make_filter_condition(self, filter_args):
         if hasattr(filter_args, "expression") and filter_args.expression:
             return self.evaluate_expression(filter_args.expression.expression)
@@ -437,6 +534,8 @@ class IbisQueryBuilder:
 
         logical_operator = filter_group_args.logical_operator
         conditions = [self.make_filter_condition(filter) for filter in filters]
+        if logical_operator in ("And", "Or"):
+            self.push_down_filters(filters, logical_operator)
 
         if logical_operator == "And":
             return self.query.filter(ibis.and_(*conditions))
@@ -535,7 +634,10 @@ class IbisQueryBuilder:
             max_names = pivot_args.get("max_column_values", 10)
             max_names = int(max_names)
             max_names = max(1, min(max_names, 100))
-            names = self.query.select(names_from).order_by(names_from).distinct().limit(max_names).execute()
+            names = self.get_stored_pivot_names(pivot_args["columns"], max_names)
+            if names is None:
+                names = self.query.select(names_from).order_by(names_from).distinct().limit(max_names)
+                names = names.execute()
             names = names.fillna("null").values
 
             # If we've limited the number of distinct column values, bucket the
@@ -567,6 +669,26 @@ class IbisQueryBuilder:
 
         return self.query
 
+    def get_stored_pivot_names(self, columns: list, max_names: int) -> pd.DataFrame | None:
+        """Return the first `max_names` values of a pivot column from the stats of its warehouse table.
+
+        Grouping keeps every value of the column, so when the operations before the
+        pivot pass it through unchanged its values are those of the table, in the same
+        order, with nulls last. Returns None for other pivots.
+        """
+        if len(columns) != 1:
+            return None
+        column = _dict(columns[0])
+        if self.is_date_type(column.data_type):
+            return None
+
+        stats = self.get_stored_column_stats(column.column_name, self.operation_idx)
+        if not stats or stats.get("values") is None or stats.get("null_count") is None:
+            return None
+
+        values = stats["values"] + ([None] if stats["null_count"] else [])
+        return pd.DataFrame({column.dimension_name or column.column_name: values[:max_names]})
+
     def apply_custom_operation(self, operation):
         return self.evaluate_expression(operation.expression.expression)
 
@@ -746,6 +868,8 @@ class IbisQueryBuilder:
 
         adhoc_filters = frappe.as_json(getattr(frappe.local, "insights_adhoc_filters", {}))
         digest = make_digest(code + adhoc_filters)
+        # the results table below only lives as long as this request's connection
+        frappe.flags.insights_build_uses_temp_tables = True
 
         cached_results = get_cached_results(digest)
         if cached_results is not None:
@@ -853,6 +977,21 @@ def clamp(value, lo: int, hi: int) -> int:
         return lo
 
 
+# results of warehouse tables are invalidated by the table versions, the expiry only bounds memory
+WAREHOUSE_RESULT_EXPIRY = 24 * 60 * 60
+VOLATILE_OPERATIONS = (ops.TimestampNow, ops.DateNow, ops.RandomScalar, ops.RandomUUID)
+MAX_PAGE_SIZE = 10_000
+RESULT_BATCH_SIZE = 50_000
+# backends whose drivers return the rows of a statement as they are fetched
+STREAMING_BACKENDS = ("duckdb", "postgres")
+# results on other backends are fetched in at most this many statements
+MAX_RESULT_PAGES = 4
+# guessed size of a string or other variable width value, with its offset
+VARIABLE_WIDTH_SIZE = 32
+MAX_CONCURRENT_QUERIES = 8
+MAX_CONCURRENT_QUERIES_PER_SOURCE = 4
+
+
 def execute_ibis_query(
     query: IbisQuery,
     page=1,
@@ -864,11 +1003,8 @@ def execute_ibis_query(
     reference_doctype=None,
     reference_name=None,
 ):
-    if paginate and hasattr(query, "limit"):
-        page_size = clamp(page_size, 1, 10_000)
-        page = clamp(page, 1, 10_000)
-        offset = (page - 1) * page_size
-        query = query.limit(page_size, offset=offset)
+    if paginate:
+        query = paginate_query(query, page, page_size)
 
     try:
         sql = ibis.to_sql(query)
@@ -877,34 +1013,446 @@ def execute_ibis_query(
         raise
 
     backend = query.get_backend()
-    if cache:
-        backend_id = backend.db_identity if backend else None
-        cache_key = make_digest(sql, backend_id)
+    if not cache:
+        result, time_taken = _execute_query(query, sql, backend, reference_name)
+    else:
+        cache_key, cache_expiry = get_result_cache_key(query, sql, backend, cache_expiry)
+        result, time_taken = get_or_compute_results(
+            cache_key,
+            lambda: _execute_query(query, sql, backend, reference_name),
+            cache_expiry=cache_expiry,
+            force=force,
+        )
+        if time_taken == -1:
+            return result, time_taken
+
+    if isinstance(result, pd.DataFrame):
+        result = replace_nulls(result)
+
+    return result, time_taken
+
+
+def paginate_query(query: IbisQuery, page=1, page_size=100) -> IbisQuery:
+    if not hasattr(query, "limit"):
+        return query
+
+    page_size = clamp(page_size, 1, MAX_PAGE_SIZE)
+    page = clamp(page, 1, 10_000)
+    offset = (page - 1) * page_size
+    return query.limit(page_size, offset=offset)
+
+
+def get_keyset(query: IbisQuery) -> list[ops.SortKey] | None:
+    """Return the sort keys the query can be paged through with a cursor.
+
+    Only a query that ends in an ORDER BY over plain columns can be, since the cursor
+    seeks to the values of those columns in the last row of the previous page.
+    """
+    op = query.op()
+    if not isinstance(op, ops.Sort) or not op.keys:
+        return None
+    for key in op.keys:
+        if not isinstance(key.expr, ops.Field) or key.expr.rel != op.parent:
+            return None
+    return list(op.keys)
+
+
+def seek_query(query: IbisQuery, keys: list[ops.SortKey], cursor: dict, page_size=100) -> IbisQuery:
+    """Return the page of the query that follows the cursor, without scanning the pages before it.
+
+    Rows tied with the last row of the previous page on every key sort next to it, so
+    the page starts at those rows and skips the ones that were already returned.
+    """
+    page_size = clamp(page_size, 1, MAX_PAGE_SIZE)
+    return seek_rows(query, keys, cursor, page_size)
+
+
+def seek_rows(query: IbisQuery, keys: list[ops.SortKey], cursor: dict, limit: int) -> IbisQuery:
+    """Return the first `limit` rows of the query that follow the cursor, see `seek_query`."""
+    parent = query.op().parent.to_expr()
+
+    predicate = None
+    for key, value in reversed(list(zip(keys, cursor["values"], strict=True))):
+        after, equal = _get_seek_predicates(parent[key.expr.name], value, key.ascending, key.nulls_first)
+        predicate = (after | equal) if predicate is None else (after | (equal & predicate))
+
+    query = order_by_keyset(parent.filter(predicate), keys)
+    return query.limit(limit, offset=cursor.get("skip") or 0)
+
+
+def order_by_keyset(query: IbisQuery, keys: list[ops.SortKey]) -> IbisQuery:
+    """Return the query ordered by the keys, and then by a unique key to break the ties.
+
+    The cursor skips the rows tied with the last row of the previous page, which only
+    works if the database returns tied rows in the same order every time. A unique key
+    makes sure of that, see `get_unique_key`. A query without one is ordered by every
+    column instead, which leaves only rows that are equal anyway.
+    """
+    table = query.op().parent.to_expr() if isinstance(query.op(), ops.Sort) else query
+    names = {key.expr.name for key in keys}
+    sort_keys = [
+        ibis.asc(table[key.expr.name], nulls_first=key.nulls_first)
+        if key.ascending
+        else ibis.desc(table[key.expr.name], nulls_first=key.nulls_first)
+        for key in keys
+    ]
+    unique_key = get_unique_key(table)
+    if unique_key is None:
+        unique_key = [name for name, dtype in table.schema().items() if is_orderable(dtype)]
+    sort_keys += [table[name] for name in unique_key if name not in names]
+    return table.order_by(sort_keys)
+
+
+def get_unique_key(query: IbisQuery) -> list[str] | None:
+    """Return the columns of the query that no two of its rows share the values of, if they are known.
+
+    Those are the group by columns of an aggregation, or the `name` column of a Frappe
+    table, as long as the query passes them through unchanged.
+    """
+    # columns of the query, by their name in the relation they are read from
+    columns = {name: name for name in query.columns}
+    op = query.op()
+    while True:
+        if isinstance(op, (ops.Filter, ops.Sort, ops.Limit)):
+            op = op.parent
+        elif isinstance(op, ops.Project):
+            fields = {
+                name: value.name
+                for name, value in op.values.items()
+                if isinstance(value, ops.Field) and value.rel == op.parent
+            }
+            columns = {fields[name]: column for name, column in columns.items() if name in fields}
+            op = op.parent
+        elif isinstance(op, ops.Aggregate):
+            if not op.groups or not all(name in columns for name in op.groups):
+                return None
+            return [columns[name] for name in op.groups]
+        elif isinstance(op, ops.PhysicalTable):
+            if op.name.lower().startswith("tab") and "name" in columns:
+                return [columns["name"]]
+            return None
+        else:
+            return None
+
+
+def _get_seek_predicates(column, value, ascending: bool, nulls_first: bool):
+    # comparisons with null are null, so nulls are matched explicitly wherever they sort
+    if value is None:
+        equal = column.isnull()
+        after = column.notnull() if nulls_first else ibis.literal(False)
+        return after, equal
+
+    value = ibis.literal(value, type=column.type())
+    equal = column == value
+    after = column > value if ascending else column < value
+    if not nulls_first:
+        after = after | column.isnull()
+    return after, equal
+
+
+def get_next_cursor(keys: list[ops.SortKey], rows: list[dict], page_size=100, cursor=None) -> dict | None:
+    """Return the cursor to the page after `rows`, or None if this is the last page."""
+    if not rows or len(rows) < clamp(page_size, 1, MAX_PAGE_SIZE):
+        return None
+
+    names = [key.expr.name for key in keys]
+
+    def key_values(row):
+        return frappe.parse_json(frappe.as_json([row[name] for name in names]))
+
+    last = key_values(rows[-1])
+    ties = 0
+    for row in reversed(rows):
+        if key_values(row) != last:
+            break
+        ties += 1
+
+    if cursor and ties == len(rows) and cursor["values"] == last:
+        # the whole page is tied with the previous one
+        ties += cursor.get("skip") or 0
+
+    return {"values": last, "skip": ties}
+
+
+def get_cached_query_results(query: IbisQuery) -> pd.DataFrame | None:
+    """Return the results of the query if they are cached and fresh, without executing it."""
+    sql = ibis.to_sql(query)
+    cache_key, _cache_expiry = get_result_cache_key(query, sql, query.get_backend())
+    result, fresh = lookup_results(cache_key)
+    return result if fresh else None
+
+
+def estimate_row_count(query: IbisQuery) -> int | None:
+    """Return the planner's estimate of the rows the query returns on a live database.
+
+    Returns None if the query does not run on a single MariaDB or PostgreSQL source,
+    or the plan has no estimate. Exact counts on the warehouse are cheap anyway.
+    """
+    data_source = get_live_data_source(query)
+    if not data_source:
+        return None
+
+    database_type = frappe.db.get_value("Insights Data Source v3", data_source, "database_type", cache=True)
+    backend = query.get_backend()
+    sql = ibis.to_sql(query)
+
+    try:
+        if database_type == "PostgreSQL":
+            with closing(backend.raw_sql(f"EXPLAIN (FORMAT JSON) {sql}")) as cursor:
+                plan = cursor.fetchone()[0]
+            plan = frappe.parse_json(plan) if isinstance(plan, str) else plan
+            return int(plan[0]["Plan"]["Plan Rows"])
+
+        with closing(backend.raw_sql(f"EXPLAIN {sql}")) as cursor:
+            columns = [column[0].lower() for column in cursor.description]
+            plan = [dict(zip(columns, row, strict=True)) for row in cursor.fetchall()]
+        # the first table is the one the optimizer drives the query from
+        driving_table = plan[0]
+        return int(flt(driving_table.get("rows")) * flt(driving_table.get("filtered") or 100) / 100)
+    except Exception:
+        # not every query can be explained, the caller falls back to an exact count
+        return None
+
 
-        if has_cached_results(cache_key) and not force:
-            return get_cached_results(cache_key), -1
+def get_result_cache_key(query: IbisQuery, sql: str, backend, cache_expiry=3600) -> tuple[str, int]:
+    """Return the key the results of the query are cached under, and how long they stay fresh."""
+    backend_id = backend.db_identity if backend else None
+    table_versions = get_table_versions(query) if is_warehouse(backend) else None
+    cache_key = make_digest(sql, backend_id, table_versions)
+    if table_versions and not query.op().find(VOLATILE_OPERATIONS):
+        cache_expiry = max(cache_expiry, WAREHOUSE_RESULT_EXPIRY)
+    return cache_key, cache_expiry
 
+
+def execute_ibis_queries(
+    queries: list[tuple[IbisQuery, str | None]],
+    force=False,
+    cache_expiry=3600,
+) -> list[tuple[pd.DataFrame | Exception, float]]:
+    """Execute several queries in one request, running each distinct query once.
+
+    `queries` is a list of (query, reference_name). Results are served from the cache
+    and computed at most once across workers, as `execute_ibis_query` would. Queries
+    on the warehouse run one after the other, while queries on a live database run
+    concurrently over connections of their own, at most
+    `MAX_CONCURRENT_QUERIES_PER_SOURCE` per data source.
+
+    Returns the results and time taken of each query, in order. A query that fails
+    does not fail the others, its exception is returned in place of the results.
+    """
+    jobs: dict[str, frappe._dict] = {}
+    outcomes = {}
+    for idx, (query, reference_name) in enumerate(queries):
+        try:
+            sql = ibis.to_sql(query)
+            backend = query.get_backend()
+            cache_key, expiry = get_result_cache_key(query, sql, backend, cache_expiry)
+        except Exception as e:
+            outcomes[f"error:{idx}"] = (e, -1)
+            jobs[f"error:{idx}"] = frappe._dict(indexes=[idx])
+            continue
+
+        job = jobs.setdefault(
+            cache_key,
+            frappe._dict(
+                query=query,
+                sql=sql,
+                backend=backend,
+                reference_name=reference_name,
+                cache_expiry=expiry,
+                stale=None,
+                indexes=[],
+            ),
+        )
+        job.indexes.append(idx)
+
+    live_jobs = defaultdict(list)
+    for cache_key, job in jobs.items():
+        if cache_key in outcomes:
+            continue
+
+        if not force:
+            job.stale, fresh = lookup_results(cache_key)
+            if fresh:
+                outcomes[cache_key] = (job.stale, -1)
+                continue
+
+        data_source = get_live_data_source(job.query)
+        if data_source:
+            live_jobs[data_source].append((cache_key, job))
+            continue
+
+        try:
+            outcomes[cache_key] = get_or_compute_results(
+                cache_key,
+                lambda job=job: _execute_query(job.query, job.sql, job.backend, job.reference_name),
+                cache_expiry=job.cache_expiry,
+                force=force,
+            )
+        except Exception as e:
+            outcomes[cache_key] = (e, -1)
+
+    if live_jobs:
+        outcomes.update(_execute_live_queries(live_jobs, force))
+
+    results = [None] * len(queries)
+    for cache_key, job in jobs.items():
+        result, time_taken = outcomes[cache_key]
+        if isinstance(result, pd.DataFrame) and time_taken != -1:
+            result = replace_nulls(result)
+        for idx in job.indexes:
+            results[idx] = (result, time_taken)
+    return results
+
+
+def get_query_data_source(query: IbisQuery) -> str | None:
+    """Return the data source a query runs on, if it only reads from a single one other than the warehouse.
+
+    Federated queries run on a database of the request, not on a data source. Each
+    of their sides is admitted to its own data source when it is fetched.
+    """
+    from insights.insights.doctype.insights_query_v3.build_cache import get_sources
+
+    sources = get_sources(query)
+    if not sources or len(sources) != 1:
+        return None
+
+    name = next(iter(sources))
+    return name if name not in (WAREHOUSE_DB_NAME, FEDERATION_DB_NAME) else None
+
+
+def get_live_data_source(query: IbisQuery) -> str | None:
+    """Return the data source a query runs on, if it only reads from a single live database."""
+    name = get_query_data_source(query)
+    if not name:
+        return None
+
+    database_type = frappe.db.get_value("Insights Data Source v3", name, "database_type", cache=True)
+    return name if database_type in ("MariaDB", "PostgreSQL") else None
+
+
+def _execute_live_queries(live_jobs: dict[str, list], force=False) -> dict:
+    """Run the live queries concurrently, each computed at most once across workers.
+
+    A query another worker is computing is served its expired results if there are
+    any, or waited for once the others have run, see `get_or_compute_results`.
+    """
+    outcomes = {}
+    claimed = defaultdict(list)
+    locks = []
+    waiting = []
+    for data_source, jobs in live_jobs.items():
+        for cache_key, job in jobs:
+            lock_token = "" if force else acquire_lock(cache_key)
+            if lock_token is None and job.stale is not None:
+                outcomes[cache_key] = (job.stale, -1)
+            elif lock_token is None:
+                waiting.append((cache_key, job))
+            else:
+                locks.append((cache_key, lock_token))
+                claimed[data_source].append((cache_key, job))
+
+    try:
+        outcomes.update(_run_live_queries(claimed))
+    finally:
+        for cache_key, lock_token in locks:
+            if lock_token:
+                release_lock(cache_key, lock_token)
+
+    for cache_key, job in waiting:
+        try:
+            outcomes[cache_key] = get_or_compute_results(
+                cache_key,
+                lambda job=job: _execute_query(job.query, job.sql, job.backend, job.reference_name),
+                cache_expiry=job.cache_expiry,
+            )
+        except Exception as e:
+            outcomes[cache_key] = (e, -1)
+    return outcomes
+
+
+def _run_live_queries(live_jobs: dict[str, list]) -> dict:
+    # connections are opened here, threads only run the queries and never touch frappe.local
+    outcomes = {}
+    slots = []
+    workers = []
+    budget = get_result_budget()
+    try:
+        for data_source, jobs in live_jobs.items():
+            # wait for one slot on the source, then take as many more as are free right away
+            try:
+                tokens = [acquire_slot(data_source)]
+            except DataSourceBusyError as e:
+                for cache_key, _job in jobs:
+                    outcomes[cache_key] = (e, -1)
+                continue
+            while len(tokens) < min(len(jobs), MAX_CONCURRENT_QUERIES_PER_SOURCE):
+                token = try_acquire_slot(data_source)
+                if token is None:
+                    break
+                tokens.append(token)
+            slots.extend((data_source, token) for token in tokens)
+
+            doc = InsightsDataSourcev3.get_doc(data_source)
+            pending = queue.SimpleQueue()
+            for job in jobs:
+                pending.put(job)
+            for _ in tokens:
+                workers.append((doc.checkout_connection(), pending))
+
+        def run_pending(connection, pending):
+            finished = []
+            while True:
+                try:
+                    cache_key, job = pending.get_nowait()
+                except queue.Empty:
+                    return finished
+                start = time.monotonic()
+                try:
+                    result = fetch_results(job.query, backend=connection, budget=budget)
+                    finished.append((cache_key, job, result, flt(time.monotonic() - start, 3)))
+                except Exception as e:
+                    finished.append((cache_key, job, e, -1))
+
+        if not workers:
+            return outcomes
+
+        with ThreadPoolExecutor(max_workers=min(len(workers), MAX_CONCURRENT_QUERIES)) as executor:
+            for finished in executor.map(lambda worker: run_pending(*worker), workers):
+                for cache_key, job, result, time_taken in finished:
+                    if isinstance(result, Exception):
+                        try:
+                            raise_for_timeout(result, job.sql)
+                        except Exception as e:
+                            result = e
+                        outcomes[cache_key] = (result, time_taken)
+                        continue
+                    outcomes[cache_key] = (result, time_taken)
+                    create_execution_log(job.sql, time_taken, query_name=job.reference_name)
+                    if isinstance(result, pd.DataFrame):
+                        cache_results(cache_key, result, job.cache_expiry)
+        return outcomes
+    finally:
+        for connection, _pending in workers:
+            with suppress(Exception):
+                release_connection(connection)
+        for data_source, token in slots:
+            release_slot(data_source, token)
+
+
+def _execute_query(query: IbisQuery, sql: str, backend, reference_name=None):
     time_taken = -1
     use_data_store = is_warehouse(backend)
 
     try:
         if use_data_store:
             start = time.monotonic()
-            result = query.execute()
+            result = fetch_results(query)
             time_taken = flt(time.monotonic() - start, 3)
         else:
             result, time_taken = _execute_live_query(query)
     except Exception as e:
-        if "max_statement_time" in str(e):
-            frappe.log_error(
-                title="Query execution time exceeded the limit.",
-                message=f"Query: {sql}",
-            )
-            max_time = frappe.db.get_single_value("Insights Settings", "max_execution_time") or 180
-            frappe.throw(
-                title="Query Timeout",
-                msg=f"Query execution time exceeded the limit of {max_time} seconds. Please try again with a smaller timespan or a more specific filter.",
-            )
+        raise_for_timeout(e, sql)
         raise e
 
     create_execution_log(
@@ -913,22 +1461,174 @@ def execute_ibis_query(
         query_name=reference_name,
         data_store=use_data_store,
     )
+    return result, time_taken
 
-    if isinstance(result, pd.DataFrame):
-        result = result.replace({pd.NaT: None, np.nan: None})
-        if cache:
-            cache_results(cache_key, result, cache_expiry)
 
-    return result, time_taken
+def raise_for_timeout(e: Exception, sql: str):
+    """Raise a readable error in place of `e` if the query ran past `max_execution_time`."""
+    if "max_statement_time" in str(e):
+        frappe.log_error(
+            title="Query execution time exceeded the limit.",
+            message=f"Query: {sql}",
+        )
+        max_time = frappe.db.get_single_value("Insights Settings", "max_execution_time") or 180
+        frappe.throw(
+            title="Query Timeout",
+            msg=f"Query execution time exceeded the limit of {max_time} seconds. Please try again with a smaller timespan or a more specific filter.",
+        )
 
 
-@concurrent_limit()
 def _execute_live_query(query: IbisQuery):
+    data_source = get_query_data_source(query)
+    # the slot on the source first: waiting for a busy source must not hold a worker slot
+    # that queries on idle sources could run in
+    with admit_query(data_source) if data_source else nullcontext():
+        return _fetch_live_results(query)
+
+
+@concurrent_limit()
+def _fetch_live_results(query: IbisQuery):
     start = time.monotonic()
-    result = query.execute()
+    result = fetch_results(query)
     return result, flt(time.monotonic() - start, 3)
 
 
+def fetch_results(query: IbisQuery, backend=None, budget: int | None = None) -> pd.DataFrame:
+    """Execute the query, fetching no more than `max_result_size` MB of results.
+
+    Pages are small and are executed as they are. Other queries are limited on the
+    server to the rows that fit the budget going by their schema, then fetched as
+    Arrow batches until the budget runs out, see `read_result_batches`. Results that
+    were cut off have `attrs["truncated"]` set.
+
+    `backend` runs the query on another connection to the same database, and with
+    `budget` given it does not touch `frappe.local`, so it can run on other threads.
+    """
+    backend = backend or query.get_backend()
+    op = query.op()
+    if isinstance(op, ops.Limit) and isinstance(op.n, int) and op.n <= MAX_PAGE_SIZE:
+        return backend.execute(query)
+
+    budget = budget or get_result_budget()
+    max_rows = max(budget // estimate_row_size(query.schema()), 1)
+    # one row past the limit tells whether there were more
+    reader = read_result_batches(query, max_rows + 1, backend=backend)
+
+    batches = []
+    rows = size = 0
+    truncated = False
+    with reader:
+        for batch in reader:
+            if rows + batch.num_rows > max_rows:
+                batch = batch.slice(0, max_rows - rows)
+                truncated = True
+            if size + batch.nbytes > budget:
+                fits = batch.num_rows * (budget - size) // max(batch.nbytes, 1)
+                batch = batch.slice(0, fits)
+                truncated = True
+            batches.append(batch)
+            rows += batch.num_rows
+            size += batch.nbytes
+            report_fetch_progress(rows)
+            if truncated:
+                break
+
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    del batches
+    # self_destruct frees each column's Arrow memory as it is converted
+    result = PandasData.convert_table(table.to_pandas(self_destruct=True, split_blocks=True), query.schema())
+    result.attrs["truncated"] = truncated
+    return result
+
+
+def get_result_budget() -> int:
+    return (frappe.db.get_single_value("Insights Settings", "max_result_size", cache=True) or 256) * 1024**2
+
+
+def report_fetch_progress(rows: int):
+    # set by query jobs, see `query_jobs.report_progress`
+    on_progress = getattr(frappe.local, "insights_fetch_progress", None)
+    if on_progress:
+        on_progress(rows)
+
+
+def read_result_batches(
+    query: IbisQuery, max_rows: int, chunk_size=RESULT_BATCH_SIZE, backend=None
+) -> pa.RecordBatchReader:
+    """Return a reader of the first `max_rows` rows of the query as Arrow batches.
+
+    The drivers of backends other than `STREAMING_BACKENDS`, like MySQL's, fetch all
+    the rows of a statement before returning any. On those the rows are fetched in
+    pages of their own statement, so that a reader that stops early does not hold
+    all of them in memory first. Each page seeks past the last row of the previous
+    one, see `seek_rows`, and is fetched in full before the budget is checked, so
+    there are at most `MAX_RESULT_PAGES`. A query that cannot be paged in a stable
+    order, because it is already limited or ordered by an expression, is fetched in
+    one statement.
+    """
+    backend = backend or query.get_backend()
+    if backend.name in STREAMING_BACKENDS:
+        return backend.to_pyarrow_batches(query.limit(max_rows), chunk_size=chunk_size)
+
+    schema = query.schema().to_pyarrow()
+    ordered = get_stable_order(query)
+    if ordered is None:
+        return backend.to_pyarrow(query.limit(max_rows)).to_reader(max_chunksize=chunk_size)
+
+    keys = list(ordered.op().keys)
+    names = [key.expr.name for key in keys]
+    page_size = min(max_rows, max(-(-max_rows // MAX_RESULT_PAGES), chunk_size))
+
+    def read_pages():
+        rows = 0
+        cursor = None
+        while rows < max_rows:
+            limit = min(page_size, max_rows - rows)
+            page_query = ordered.limit(limit) if cursor is None else seek_rows(ordered, keys, cursor, limit)
+            page = backend.to_pyarrow(page_query)
+            yield from page.cast(schema).to_batches(max_chunksize=chunk_size)
+            rows += page.num_rows
+            if page.num_rows < limit:
+                return
+            cursor = get_next_cursor(keys, page.select(names).to_pylist(), limit, cursor)
+
+    return pa.RecordBatchReader.from_batches(schema, read_pages())
+
+
+def get_stable_order(query: IbisQuery) -> IbisQuery | None:
+    """Return the query ordered so that keyset seeks page through it the same way every time."""
+    if keys := get_keyset(query):
+        return order_by_keyset(query, keys)
+    if isinstance(query.op(), (ops.Sort, ops.Limit)):
+        return None
+    if not any(is_orderable(dtype) for dtype in query.schema().types):
+        return None
+    return order_by_keyset(query, [])
+
+
+def is_orderable(dtype: DataType) -> bool:
+    return dtype.is_numeric() or dtype.is_string() or dtype.is_temporal() or dtype.is_boolean()
+
+
+def estimate_row_size(schema: ibis.Schema) -> int:
+    """Return the bytes a row of the schema takes in Arrow, guessing the size of variable width values."""
+    size = 0
+    for dtype in schema.types:
+        if dtype.is_boolean():
+            size += 1
+        elif dtype.is_integer() or dtype.is_floating():
+            size += getattr(dtype, "nbytes", 8)
+        elif dtype.is_decimal():
+            size += 16
+        elif dtype.is_date():
+            size += 4
+        elif dtype.is_temporal():
+            size += 8
+        else:
+            size += VARIABLE_WIDTH_SIZE
+    return max(size, 1)
+
+
 def get_columns_from_schema(schema: ibis.Schema):
     return [
         {
@@ -961,28 +1661,6 @@ def to_insights_type(dtype: DataType):
     return "String"
 
 
-def cache_results(cache_key, result: pd.DataFrame, cache_expiry=3600):
-    cache_key = "insights:query_results:" + cache_key
-    data = result.to_dict(orient="records")
-    data = frappe.as_json(data)
-    frappe.cache().set_value(cache_key, data, expires_in_sec=cache_expiry)
-
-
-def get_cached_results(cache_key) -> pd.DataFrame:
-    cache_key = "insights:query_results:" + cache_key
-    data = frappe.cache().get_value(cache_key)
-    if not data:
-        return None
-    data = frappe.parse_json(data)
-    df = pd.DataFrame(data).replace({pd.NaT: None, np.nan: None})
-    return df
-
-
-def has_cached_results(cache_key):
-    cache_key = "insights:query_results:" + cache_key
-    return frappe.cache().get_value(cache_key) is not None
-
-
 def exec_with_return(
     script: str,
     _globals: dict | None = None,
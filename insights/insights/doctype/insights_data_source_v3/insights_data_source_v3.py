@@ -18,6 +18,7 @@ from insights.insights.doctype.insights_table_v3.insights_table_v3 import (
     InsightsTablev3,
 )
 
+from .connection_pool import close_live_pool, get_live_pool, release_connection
 from .connectors.bigquery import get_bigquery_connection
 from .connectors.clickhouse import get_clickhouse_connection
 from .connectors.duckdb import get_duckdb_connection
@@ -32,6 +33,14 @@ from .connectors.mssql import get_mssql_connection
 from .connectors.postgresql import get_postgres_connection
 from .connectors.rest_api import RestAPIClient
 from .connectors.sqlite import get_sqlite_connection
+from .replicas import (
+    check_replica,
+    choose_replica,
+    get_read_replicas,
+    get_replica_doc,
+    release_replica,
+    set_replica_status,
+)
 
 
 class DataSourceConnectionError(frappe.ValidationError):
@@ -111,6 +120,9 @@ class InsightsDataSourceDocument:
         self.status = "Active" if self.test_connection() else "Inactive"
         self.db_set("status", self.status)
 
+        if credentials_changed:
+            close_live_pool(self.name)
+
         if self.status == "Active" and credentials_changed:
             self.update_table_list()
 
@@ -153,6 +165,8 @@ class InsightsDataSourceDocument:
             ):
                 frappe.delete_doc(doctype, name)
 
+        close_live_pool(self.name)
+
     def validate(self):
         if self.is_site_db:
             return
@@ -164,6 +178,7 @@ class InsightsDataSourceDocument:
             self.validate_bigquery_fields()
         else:
             self.validate_remote_db_fields()
+            self.validate_read_replicas()
 
     def validate_api_fields(self):
         if not self.api_base_url:
@@ -192,6 +207,11 @@ class InsightsDataSourceDocument:
             if not self.get(field):
                 frappe.throw(f"{field} is mandatory for Database")
 
+    def validate_read_replicas(self):
+        if self.read_replicas and self.connection_string:
+            frappe.throw("Read replicas cannot be used with a connection string")
+        get_read_replicas(self)
+
     def validate_bigquery_fields(self):
         mandatory = (
             "bigquery_project_id",
@@ -227,11 +247,17 @@ class InsightsDataSourcev3(InsightsDataSourceDocument, Document):
         enable_stored_procedure_execution: DF.Check
         host: DF.Data | None
         http_headers: DF.JSON | None
+        import_parallelism: DF.Int
         is_ducklake: DF.Check
         is_frappe_db: DF.Check
         is_site_db: DF.Check
+        max_concurrent_queries: DF.Int
+        max_queue_wait: DF.Int
+        max_replica_lag: DF.Int
         password: DF.Password | None
         port: DF.Int
+        read_replicas: DF.SmallText | None
+        replica_routing: DF.Literal["Least Outstanding Queries", "Round Robin"]
         schema: DF.Data | None
         status: DF.Literal["Inactive", "Active"]
         title: DF.Data
@@ -244,8 +270,46 @@ class InsightsDataSourcev3(InsightsDataSourceDocument, Document):
         if self.name in insights.db_connections:
             return insights.db_connections[self.name]
 
+        db = self.checkout_connection()
+        insights.db_connections[self.name] = db
+        return db
+
+    def checkout_connection(self) -> BaseBackend:
+        """Take a connection to a read replica, or to the primary if no replica is available.
+
+        Connections are taken from this process's pool, or opened if the data source is
+        not pooled. The caller owns the connection and must hand it to `release_connection`
+        when done.
+        """
+        while replica := choose_replica(self):
+            replica_doc = get_replica_doc(self, replica.host)
+            try:
+                db = self._checkout_connection(replica_doc, replica_doc.connect)
+            except Exception:
+                release_replica(replica)
+                set_replica_status(self.name, replica.host, available=False)
+                continue
+
+            db._insights_replica = replica
+            if check_replica(self, replica.host, db):
+                return db
+            release_connection(db)
+
+        return self._checkout_connection(self, self.open_connection)
+
+    def _checkout_connection(self, doc, open_connection) -> BaseBackend:
+        pool = get_live_pool(doc)
+        if pool is None:
+            return open_connection()
+        return pool.checkout(open_connection)
+
+    def open_connection(self) -> BaseBackend:
+        """Open a new connection, configured for querying, that is not shared with the request.
+
+        The caller owns the connection and must disconnect it when done.
+        """
         try:
-            db: BaseBackend = self._get_db_connection()
+            return self.connect()
         except Exception as e:
             frappe.throw(
                 title="Connection Error",
@@ -253,6 +317,10 @@ class InsightsDataSourcev3(InsightsDataSourceDocument, Document):
                 exc=DataSourceConnectionError,
             )
 
+    def connect(self) -> BaseBackend:
+        """Same as `open_connection`, but raises the error of the driver as is."""
+        db: BaseBackend = self._get_db_connection()
+
         if self.database_type == "MariaDB":
             db.raw_sql("SET SESSION time_zone='+00:00'")
             db.raw_sql("SET collation_connection = 'utf8mb4_unicode_ci'")
@@ -261,16 +329,12 @@ class InsightsDataSourcev3(InsightsDataSourceDocument, Document):
             except Exception:
                 db.raw_sql("SET SESSION TRANSACTION_READ_ONLY = 1")
 
-            MAX_STATEMENT_TIMEOUT = (
-                frappe.db.get_single_value("Insights Settings", "max_execution_time", cache=True) or 180
-            )
             ## Todo: Permanent fix for this
             try:
-                db.raw_sql(f"SET MAX_STATEMENT_TIME={MAX_STATEMENT_TIMEOUT}")
+                set_statement_timeout(db)
             except Exception:
                 pass
 
-        insights.db_connections[self.name] = db
         return db
 
     def get_sqlglot_dialect(self) -> str | None:
@@ -307,6 +371,10 @@ class InsightsDataSourcev3(InsightsDataSourceDocument, Document):
         if self.is_site_db:
             database_name = frappe.conf.db_name
 
+        if self.type == "REST API":
+            # the connection is already scoped to the data source's warehouse schema
+            return db.list_tables()
+
         if not database_name or self.database_type == "SQLite":
             return db.list_tables()
 
@@ -423,14 +491,19 @@ def after_request():
     closed = {}
     for name, db in insights.db_connections.items():
         try:
-            db.disconnect()
+            release_connection(db)
             closed[name] = True
         except Exception:
-            frappe.log_error(title=f"Failed to disconnect db connection for {name}")
+            frappe.log_error(title=f"Failed to release db connection for {name}")
 
     for name in closed:
         del insights.db_connections[name]
 
+    try:
+        insights.warehouse.pool.refresh()
+    except Exception:
+        frappe.log_error(title="Failed to refresh the warehouse connection pool")
+
 
 @contextmanager
 def db_connections():
@@ -441,6 +514,14 @@ def db_connections():
         after_request()
 
 
+def set_statement_timeout(db: BaseBackend) -> None:
+    """Limit the statements of the MariaDB session to the `max_execution_time` of the settings."""
+    max_statement_time = (
+        frappe.db.get_single_value("Insights Settings", "max_execution_time", cache=True) or 180
+    )
+    db.raw_sql(f"SET MAX_STATEMENT_TIME={max_statement_time}")
+
+
 def db_type_to_sqlglot_dialect(db_type: str) -> str | None:
     if db_type == "REST API":
         return "duckdb"
@@ -0,0 +1,314 @@
+"""Materialize on read: results of live queries kept in the warehouse for a while.
+
+A live query with `materialize_on_read` has its results written to a file of the
+warehouse by a background job after it is first read. What is written is
+the rows its first summarize or pivot reads, so the pages, counts, distinct values
+and drill-downs of the query can all be computed from them. If those rows are too
+many, the final results are written instead.
+
+Every build of such a query looks up its operations up to the first aggregation,
+then all of them, and continues from the materialized table of the first one found
+instead of the source. A
+materialization is fresh for `MATERIALIZATION_TTL`, after which the query reads
+the source again and is materialized anew.
+
+Materialized results are kept out of the schema files of the warehouse, so writing
+them does not make every warehouse connection reopen. Each write is a new file in
+the folder of its schema under `materializations/`, attached to the warehouse
+connection the first time it is read. Older files of the schema are removed once
+a new one is written.
+"""
+
+import os
+import tempfile
+import time
+from contextlib import nullcontext, suppress
+
+import frappe
+import ibis
+import pyarrow as pa
+from ibis.expr.types import Table
+
+import insights
+from insights.cache_utils import make_digest
+
+from .admission import admit_query
+from .connectors.duckdb import get_local_duckdb_connection
+from .data_warehouse import (
+    MATERIALIZED_CATALOG_PREFIX,
+    escape_sql_path,
+    quote_identifier,
+    remove_duckdb_file,
+)
+
+MATERIALIZATION_KEY_PREFIX = "insights:materialization:"
+MATERIALIZED_SCHEMA_PREFIX = "insights_materialized_"
+MATERIALIZED_TABLE = "result"
+MATERIALIZATION_TTL = 10 * 60
+MATERIALIZATION_TIMEOUT = 30 * 60
+MATERIALIZATION_BATCH_SIZE = 50_000
+# operations whose input rows can answer the reads of everything built on them
+AGGREGATE_OPERATIONS = ("summarize", "pivot_wider")
+
+
+class MaterializationTooLarge(Exception):
+    pass
+
+
+class MaterializedReads:
+    """Lookups of the materialized operation prefixes of one live query build."""
+
+    def __init__(self, operations: list, operation_count: int):
+        # adhoc filters are appended after the operations of the query, they are never materialized
+        self.operations = operations[:operation_count]
+        self.point = get_materialization_point(self.operations)
+        self.point_entry = None
+        self.found = False
+        # what the build reads depends on what is materialized, it must not be memoized
+        frappe.flags.insights_build_uses_temp_tables = True
+
+    def read(self, query: Table, operation_count: int) -> Table:
+        """Return the materialized table of the first `operation_count` operations if there is one.
+
+        Only the operations up to the materialization point and all of them are ever
+        materialized, see `enqueue`, so other prefixes are not looked up.
+        """
+        if self.found or operation_count not in (self.point, len(self.operations)):
+            return query
+
+        try:
+            digest = get_digest(query)
+        except Exception:
+            return query
+
+        entry = frappe.cache().get_value(MATERIALIZATION_KEY_PREFIX + digest)
+        if operation_count == self.point:
+            self.point_entry = entry
+
+        table = get_materialized_table(entry)
+        if table is None:
+            return query
+        self.found = True
+        return table
+
+    def enqueue(self, doc) -> None:
+        """Materialize the query in the background if nothing it reads is materialized yet."""
+        if self.found or self.point_entry is not None or not self.operations:
+            return
+
+        candidates = [self.operations[: self.point]]
+        if self.point < len(self.operations):
+            candidates.append(self.operations)
+
+        frappe.enqueue(
+            materialize_results,
+            queue="long",
+            timeout=MATERIALIZATION_TIMEOUT,
+            job_id=f"insights_materialize:{make_digest(frappe.as_json(candidates), frappe.session.user)}",
+            deduplicate=True,
+            query=doc.name,
+            title=doc.title,
+            candidates=candidates,
+        )
+
+
+def get_materialization_point(operations: list) -> int:
+    """Return how many operations are materialized: those before the first aggregation, or all."""
+    for idx, operation in enumerate(operations):
+        if idx and operation.get("type") in AGGREGATE_OPERATIONS:
+            return idx
+    return len(operations)
+
+
+def get_digest(query: Table) -> str:
+    # the permission restrictions of the user are part of the SQL
+    return make_digest(frappe.local.site, ibis.to_sql(query))
+
+
+def get_materialized_table(entry: dict | None) -> Table | None:
+    if not entry or not entry.get("schema"):
+        return None
+    return read_materialization(entry["schema"])
+
+
+def read_materialization(schema: str) -> Table | None:
+    """Return the latest results written to `schema`, None if there are none."""
+    path = get_latest_materialization_path(schema)
+    if path is None:
+        return None
+
+    catalog = f"{MATERIALIZED_CATALOG_PREFIX}{schema}/{os.path.basename(path).removesuffix('.duckdb')}"
+    db = insights.warehouse.db
+    try:
+        # attached to the shared warehouse database, once for all its connections
+        db.raw_sql(
+            f"ATTACH IF NOT EXISTS '{escape_sql_path(path)}' AS {quote_identifier(catalog)} (READ_ONLY)"
+        )
+        table = db.table(MATERIALIZED_TABLE, database=(catalog, "main"))
+    except Exception:
+        # removed since, after a newer one was written
+        return None
+
+    detach_older_materializations(db, schema, catalog)
+    return table
+
+
+def detach_older_materializations(db, schema: str, latest: str) -> None:
+    """Detach the files of `schema` written before the one attached as `latest`."""
+    prefix = f"{MATERIALIZED_CATALOG_PREFIX}{schema}/".replace("'", "''")
+    attached = db.raw_sql(
+        f"SELECT database_name FROM duckdb_databases() WHERE starts_with(database_name, '{prefix}')"
+    ).fetchall()
+    for (catalog,) in attached:
+        if catalog < latest:
+            # a query still reading it keeps it attached, it is detached by a later read
+            with suppress(Exception):
+                db.raw_sql(f"DETACH DATABASE IF EXISTS {quote_identifier(catalog)}")
+
+
+def get_latest_materialization_path(schema: str) -> str | None:
+    folder = get_materialization_folder(schema)
+    try:
+        # named by when they were written
+        names = [entry.name for entry in os.scandir(folder) if entry.name.endswith(".duckdb")]
+    except FileNotFoundError:
+        return None
+    return os.path.join(folder, max(names)) if names else None
+
+
+def get_materialization_folder(schema: str) -> str:
+    if not schema or os.sep in schema:
+        frappe.throw(f"Invalid materialization schema: {schema}")
+    return os.path.join(insights.warehouse.get_materializations_path(), schema)
+
+
+def materialize_results(query: str, title: str | None, candidates: list[list]):
+    """Write the results of the first candidate operations that fit `max_result_size` to the warehouse."""
+    from .ibis_utils import IbisQueryBuilder, get_query_data_source
+    from .insights_data_source_v3 import db_connections
+
+    for operations in candidates:
+        doc = frappe._dict(
+            doctype="Insights Query v3",
+            name=query,
+            title=title,
+            operations=operations,
+            use_live_connection=1,
+        )
+        with db_connections():
+            ibis_query = IbisQueryBuilder(doc).build()
+            digest = get_digest(ibis_query)
+            key = MATERIALIZATION_KEY_PREFIX + digest
+            if frappe.cache().get_value(key):
+                return
+
+            data_source = get_query_data_source(ibis_query)
+            try:
+                with admit_query(data_source) if data_source else nullcontext():
+                    rows = write_materialization(ibis_query, get_schema_name(digest))
+            except MaterializationTooLarge:
+                # remembered, so reads do not enqueue it again until it expires
+                frappe.cache().set_value(key, {"too_large": True}, expires_in_sec=MATERIALIZATION_TTL)
+                continue
+
+        frappe.cache().set_value(
+            key,
+            {"schema": get_schema_name(digest), "rows": rows, "materialized_at": time.time()},
+            expires_in_sec=MATERIALIZATION_TTL,
+        )
+        return
+
+
+def write_materialization(query: Table, schema: str, budgeted: bool = True) -> int:
+    """Write the results of the query to a new file of `schema`, as its table "result".
+
+    Raises `MaterializationTooLarge` if the results of a budgeted write do not fit `max_result_size`.
+    """
+    from .ibis_utils import estimate_row_size
+
+    max_rows = None
+    if budgeted:
+        max_result_size = frappe.db.get_single_value("Insights Settings", "max_result_size", cache=True)
+        budget = (max_result_size or 256) * 1024**2
+        max_rows = max(budget // estimate_row_size(query.schema()), 1)
+    rows = 0
+
+    def count_rows(reader):
+        nonlocal rows
+        for batch in reader:
+            rows += batch.num_rows
+            if max_rows is not None and rows > max_rows:
+                raise MaterializationTooLarge
+            yield batch
+
+    # one row past the limit tells whether the results fit
+    reader = (query if max_rows is None else query.limit(max_rows + 1)).to_pyarrow_batches(
+        chunk_size=MATERIALIZATION_BATCH_SIZE
+    )
+    folder = get_materialization_folder(schema)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{time.time_ns()}_{frappe.generate_hash(length=8)}.duckdb")
+    # not read until it is complete
+    staging_path = f"{path}.staging"
+    try:
+        with reader:
+            db = get_local_duckdb_connection(staging_path, read_only=False, allowed_dir=tempfile.gettempdir())
+            try:
+                db.con.register(
+                    "batches", pa.RecordBatchReader.from_batches(reader.schema, count_rows(reader))
+                )
+                try:
+                    db.raw_sql(f'CREATE TABLE "{MATERIALIZED_TABLE}" AS SELECT * FROM batches')
+                except Exception:
+                    if max_rows is not None and rows > max_rows:
+                        raise MaterializationTooLarge from None
+                    raise
+                db.raw_sql("CHECKPOINT")
+            finally:
+                db.disconnect()
+    except BaseException:
+        remove_duckdb_file(staging_path)
+        raise
+
+    os.replace(staging_path, path)
+    remove_older_materializations(folder, os.path.basename(path))
+    return rows
+
+
+def remove_older_materializations(folder: str, latest: str) -> None:
+    # connections that attached them keep reading them until they are closed
+    with suppress(FileNotFoundError), os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".duckdb") and entry.name < latest:
+                remove_duckdb_file(entry.path)
+
+
+def drop_materializations(schema: str) -> None:
+    """Remove every file written to `schema`."""
+    folder = get_materialization_folder(schema)
+    with suppress(FileNotFoundError), os.scandir(folder) as entries:
+        for entry in entries:
+            with suppress(FileNotFoundError):
+                os.remove(entry.path)
+    with suppress(OSError):
+        os.rmdir(folder)
+
+
+def get_schema_name(digest: str) -> str:
+    return f"{MATERIALIZED_SCHEMA_PREFIX}{digest[:20]}"
+
+
+def delete_expired_materializations():
+    # called hourly via hooks
+    cutoff = time.time() - MATERIALIZATION_TTL
+    for schema in os.scandir(insights.warehouse.get_materializations_path()):
+        if not schema.name.startswith(MATERIALIZED_SCHEMA_PREFIX) or not schema.is_dir():
+            continue
+        # files being written are newer, as are the ones written again since
+        with suppress(FileNotFoundError), os.scandir(schema.path) as entries:
+            for entry in entries:
+                with suppress(FileNotFoundError):
+                    if entry.stat().st_mtime <= cutoff:
+                        os.remove(entry.path)
+        with suppress(OSError):
+            os.rmdir(schema.path)
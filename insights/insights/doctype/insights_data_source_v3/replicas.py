@@ -0,0 +1,207 @@
+"""Routing of live queries to the read replicas of MariaDB and PostgreSQL data sources.
+
+Every connection a request checks out goes to one of the data source's replicas,
+picked by round robin or by the fewest connections in use, counted across all
+workers. A replica that cannot be connected to, or lags behind the primary by more
+than `max_replica_lag`, is skipped for `REPLICA_STATUS_TTL` seconds. Queries go to
+the primary when no replica is available.
+"""
+
+import copy
+from contextlib import closing
+
+import frappe
+from ibis.backends import BaseBackend
+
+from .admission import lease, run_script
+
+REPLICA_KEY_PREFIX = "insights:replicas:"
+REPLICA_STATUS_TTL = 30
+REPLICA_DATABASE_TYPES = ("MariaDB", "PostgreSQL")
+DEFAULT_PORTS = {"MariaDB": 3306, "PostgreSQL": 5432}
+
+# KEYS: in use, turn
+# ARGV: routing, now, expires, token, replicas...
+CHOOSE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local replicas = {unpack(ARGV, 5)}
+local turn = redis.call('INCR', KEYS[2])
+
+local chosen
+if ARGV[1] == 'Round Robin' then
+    chosen = replicas[(turn - 1) % #replicas + 1]
+else
+    local in_use = {}
+    for _, replica in ipairs(replicas) do
+        in_use[replica] = 0
+    end
+    for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+        local replica = string.match(member, '^(.*)|')
+        if in_use[replica] then
+            in_use[replica] = in_use[replica] + 1
+        end
+    end
+    -- start from a different replica each turn, so ties are spread out
+    for i = 0, #replicas - 1 do
+        local replica = replicas[(turn + i) % #replicas + 1]
+        if not chosen or in_use[replica] < in_use[chosen] then
+            chosen = replica
+        end
+    end
+end
+
+redis.call('ZADD', KEYS[1], ARGV[3], chosen .. '|' .. ARGV[4])
+return chosen
+"""
+
+# MariaDB 10.5 renamed SLAVE to REPLICA
+MARIADB_LAG_QUERIES = ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS")
+POSTGRES_LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+def get_read_replicas(doc) -> list[str]:
+    """Return the replicas of the data source as `host:port`."""
+    if (
+        doc.is_site_db
+        or doc.connection_string
+        or doc.database_type not in REPLICA_DATABASE_TYPES
+        or not doc.read_replicas
+    ):
+        return []
+
+    replicas = []
+    for line in doc.read_replicas.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        host, _, port = line.partition(":")
+        if not host or (port and not port.isdigit()):
+            frappe.throw(f"Invalid read replica '{line}'. Use one host or host:port per line.")
+        replicas.append(f"{host}:{port or doc.port or DEFAULT_PORTS[doc.database_type]}")
+    return replicas
+
+
+def choose_replica(doc) -> frappe._dict | None:
+    """Pick the replica the next connection goes to, None if no replica is available.
+
+    The replica counts as in use until it is passed to `release_replica`.
+    """
+    replicas = [replica for replica in get_read_replicas(doc) if is_replica_available(doc.name, replica)]
+    if not replicas:
+        return None
+
+    keys = get_keys(doc.name)
+    token = frappe.generate_hash(length=12)
+    now, lease_for = lease()
+    replica = run_script(
+        CHOOSE_SCRIPT,
+        (keys["in_use"], keys["turn"]),
+        doc.replica_routing or "Least Outstanding Queries",
+        now,
+        now + lease_for,
+        token,
+        *replicas,
+    )
+    return frappe._dict(data_source=doc.name, host=frappe.safe_decode(replica), token=token)
+
+
+def release_replica(replica: frappe._dict):
+    keys = get_keys(replica.data_source)
+    frappe.cache().zrem(keys["in_use"], f"{replica.host}|{replica.token}")
+
+
+def get_replica_doc(doc, host: str):
+    """Return a copy of the data source that connects to the replica at `host:port`."""
+    replica_doc = copy.copy(doc)
+    replica_doc.host, _, port = host.rpartition(":")
+    replica_doc.port = int(port)
+    return replica_doc
+
+
+def is_replica_available(data_source: str, replica: str) -> bool:
+    status = frappe.cache().get_value(get_status_key(data_source, replica))
+    return status is None or status["available"]
+
+
+def check_replica(doc, replica: str, db: BaseBackend) -> bool:
+    """Return whether the replica is within `max_replica_lag` of the primary.
+
+    The lag is measured at most once every `REPLICA_STATUS_TTL` across workers.
+    """
+    status = frappe.cache().get_value(get_status_key(doc.name, replica))
+    if status is not None:
+        return status["available"]
+
+    lag = get_replica_lag(db, doc.database_type)
+    # a lag that cannot be measured, say for lack of privileges, is not held against the replica
+    available = lag is None or not doc.max_replica_lag or lag <= doc.max_replica_lag
+    set_replica_status(doc.name, replica, available, lag)
+    return available
+
+
+def set_replica_status(data_source: str, replica: str, available: bool, lag: float | None = None):
+    frappe.cache().set_value(
+        get_status_key(data_source, replica),
+        {"available": available, "lag": lag},
+        expires_in_sec=REPLICA_STATUS_TTL,
+    )
+
+
+def get_replica_lag(db: BaseBackend, database_type: str) -> float | None:
+    """Seconds the replica is behind its primary, infinite if replication is stopped."""
+    if database_type == "PostgreSQL":
+        try:
+            with closing(db.raw_sql(POSTGRES_LAG_QUERY)) as cursor:
+                return float(cursor.fetchone()[0])
+        except Exception:
+            return None
+
+    for sql in MARIADB_LAG_QUERIES:
+        try:
+            with closing(db.raw_sql(sql)) as cursor:
+                row = cursor.fetchone()
+                columns = [column[0] for column in cursor.description or []]
+        except Exception:
+            continue
+        if not row:
+            # not replicating from anywhere
+            return 0.0
+        lag = dict(zip(columns, row, strict=True)).get("Seconds_Behind_Master")
+        return float("inf") if lag is None else float(lag)
+    return None
+
+
+def get_replica_stats(doc) -> list[dict]:
+    """Connections in use and the last known status of each replica of the data source."""
+    cache = frappe.cache()
+    keys = get_keys(doc.name)
+    members = [frappe.safe_decode(member) for member in cache.zrange(keys["in_use"], 0, -1)]
+    stats = []
+    for replica in get_read_replicas(doc):
+        status = cache.get_value(get_status_key(doc.name, replica)) or {}
+        stats.append(
+            {
+                "replica": replica,
+                "in_use": sum(1 for member in members if member.rsplit("|", 1)[0] == replica),
+                "available": status.get("available", True),
+                "lag": status.get("lag"),
+            }
+        )
+    return stats
+
+
+def get_keys(data_source: str) -> dict:
+    # made once and only used with scripts and commands RedisWrapper does not wrap
+    cache = frappe.cache()
+    prefix = f"{REPLICA_KEY_PREFIX}{data_source}:"
+    return {name: cache.make_key(prefix + name).decode() for name in ("in_use", "turn")}
+
+
+def get_status_key(data_source: str, replica: str) -> str:
+    return f"{REPLICA_KEY_PREFIX}{data_source}:status:{replica}"
@@ -0,0 +1,209 @@
+"""Cache of query results.
+
+Results are stored as zstd-compressed Arrow IPC streams. The stream carries its own
+schema, so typed columns (timestamps, decimals) survive the round trip, and encoding
+it is far cheaper than JSON. Entries larger than `REDIS_ENTRY_LIMIT` are spilled to
+the site's disk and Redis only holds the path to the file.
+
+Entries outlive their expiry by `STALE_TTL`, so that when a popular result expires
+one caller recomputes it while the others are served the stale copy.
+"""
+
+import json
+import os
+import time
+from collections.abc import Callable
+from contextlib import suppress
+
+import frappe
+import pandas as pd
+import pyarrow as pa
+
+CACHE_KEY_PREFIX = "insights:query_results:"
+LOCK_KEY_PREFIX = "insights:query_results_lock:"
+REDIS_ENTRY_LIMIT = 1024 * 1024
+MAX_ENTRY_SIZE = 256 * 1024 * 1024
+# longer than any cache expiry used for query results, plus STALE_TTL
+SPILLED_RESULT_MAX_AGE = 25 * 60 * 60
+STALE_TTL = 5 * 60
+# DataFrame.attrs, like the truncation flag, travel in the schema metadata
+ATTRS_METADATA_KEY = b"insights:attrs"
+# longer than the max execution time of a query
+LOCK_TTL = 5 * 60
+WAIT_TIMEOUT = 30
+WAIT_INTERVAL = 0.2
+
+
+def get_or_compute_results(
+    cache_key, compute: Callable[[], tuple[pd.DataFrame, float]], cache_expiry=3600, force=False
+) -> tuple[pd.DataFrame, float]:
+    """Return the cached results of a query, computing them at most once across workers.
+
+    The first caller to miss takes a lock on the key and runs `compute`. The others
+    are served the expired entry if there is one, or wait for the first caller to
+    cache its results. Returns the results and the time taken, -1 if cached.
+    """
+    stale = None
+    if not force:
+        stale, fresh = lookup_results(cache_key)
+        if fresh:
+            return stale, -1
+
+    lock_token = None
+    if not force:
+        lock_token = acquire_lock(cache_key)
+        if not lock_token:
+            if stale is not None:
+                return stale, -1
+            result = wait_for_results(cache_key)
+            if result is not None:
+                return result, -1
+            # the caller holding the lock is slow or failed, compute anyway
+
+    try:
+        result, time_taken = compute()
+        if isinstance(result, pd.DataFrame):
+            cache_results(cache_key, result, cache_expiry)
+        return result, time_taken
+    finally:
+        if lock_token:
+            release_lock(cache_key, lock_token)
+
+
+def acquire_lock(cache_key) -> str | None:
+    token = frappe.generate_hash(length=12)
+    key = frappe.cache().make_key(LOCK_KEY_PREFIX + cache_key)
+    if frappe.cache().set(key, token, nx=True, ex=LOCK_TTL):
+        return token
+    return None
+
+
+def release_lock(cache_key, token: str):
+    key = frappe.cache().make_key(LOCK_KEY_PREFIX + cache_key)
+    # the lock may have expired and been taken by another caller
+    if frappe.safe_decode(frappe.cache().get(key)) == token:
+        frappe.cache().delete(key)
+
+
+def wait_for_results(cache_key) -> pd.DataFrame | None:
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        result, _fresh = lookup_results(cache_key)
+        if result is not None:
+            return result
+        # RedisWrapper.exists prefixes keys itself, get takes the made key like the lock does
+        if frappe.cache().get(frappe.cache().make_key(LOCK_KEY_PREFIX + cache_key)) is None:
+            # released without caching, the computation failed
+            return None
+
+
+def cache_results(cache_key, result: pd.DataFrame, cache_expiry=3600):
+    try:
+        payload = serialize_results(result)
+    except (pa.ArrowException, TypeError, ValueError):
+        # columns of mixed python objects have no arrow type, leave them uncached
+        return
+
+    if len(payload) > MAX_ENTRY_SIZE:
+        return
+
+    entry = {"fresh_until": time.time() + cache_expiry}
+    if len(payload) > REDIS_ENTRY_LIMIT:
+        entry["path"] = spill_results(cache_key, payload)
+    else:
+        entry["data"] = payload
+
+    frappe.cache().set_value(CACHE_KEY_PREFIX + cache_key, entry, expires_in_sec=cache_expiry + STALE_TTL)
+
+
+def get_cached_results(cache_key) -> pd.DataFrame | None:
+    result, fresh = lookup_results(cache_key)
+    return result if fresh else None
+
+
+def lookup_results(cache_key) -> tuple[pd.DataFrame | None, bool]:
+    """Return the cached results, stale or not, and whether they are fresh, in a single GET."""
+    # expires=True keeps large results out of the request-local cache
+    entry = frappe.cache().get_value(CACHE_KEY_PREFIX + cache_key, expires=True)
+    if not isinstance(entry, dict) or "fresh_until" not in entry:
+        # missing, or written by an older version
+        return None, False
+
+    fresh = entry["fresh_until"] > time.time()
+    if "data" in entry:
+        return deserialize_results(pa.py_buffer(entry["data"])), fresh
+
+    try:
+        with pa.memory_map(entry["path"]) as source:
+            return deserialize_results(source), fresh
+    except (FileNotFoundError, pa.ArrowInvalid):
+        # spilled on another host, or cleaned up already
+        return None, False
+
+
+def serialize_results(result: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(result, preserve_index=False)
+    if result.attrs:
+        metadata = {**(table.schema.metadata or {}), ATTRS_METADATA_KEY: json.dumps(result.attrs)}
+        table = table.replace_schema_metadata(metadata)
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def deserialize_results(source) -> pd.DataFrame:
+    with pa.ipc.open_stream(source) as reader:
+        table = reader.read_all()
+
+    result = table.to_pandas()
+    attrs = (table.schema.metadata or {}).get(ATTRS_METADATA_KEY)
+    if attrs:
+        result.attrs.update(json.loads(attrs))
+    return replace_nulls(result)
+
+
+def replace_nulls(result: pd.DataFrame) -> pd.DataFrame:
+    """Replace NaN and NaT with None in place, so the results serialize to JSON nulls.
+
+    Only the columns that hold nulls are converted, one at a time, instead of copying
+    the whole frame.
+    """
+    for idx in range(result.shape[1]):
+        values = result.iloc[:, idx]
+        nulls = values.isna()
+        if nulls.any():
+            result.isetitem(idx, values.astype(object).where(~nulls, None))
+    return result
+
+
+def spill_results(cache_key: str, payload: bytes) -> str:
+    folder = get_spill_folder()
+    os.makedirs(folder, exist_ok=True)
+
+    path = os.path.join(folder, f"{cache_key}.arrow")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(payload)
+    os.replace(temp_path, path)
+    return path
+
+
+def get_spill_folder() -> str:
+    return frappe.get_site_path("private", "insights_result_cache")
+
+
+def clear_spilled_results():
+    # called hourly via hooks
+    folder = get_spill_folder()
+    if not os.path.exists(folder):
+        return
+
+    cutoff = time.time() - SPILLED_RESULT_MAX_AGE
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            with suppress(FileNotFoundError):
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
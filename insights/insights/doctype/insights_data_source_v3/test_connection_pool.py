@@ -0,0 +1,46 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+from unittest.mock import MagicMock
+
+from frappe.tests.utils import FrappeTestCase
+
+from insights.insights.doctype.insights_data_source_v3.connection_pool import LiveConnectionPool
+
+
+class TestLiveConnectionPool(FrappeTestCase):
+    def setUp(self):
+        self.pool = LiveConnectionPool("Test Source", "localhost:3306", "key")
+        self.addCleanup(self.pool.close)
+
+    def open_connection(self):
+        db = MagicMock()
+        db._insights_restore_session = None
+        return db
+
+    def test_returned_connection_is_reused(self):
+        db = self.pool.checkout(self.open_connection)
+        self.pool.checkin(db)
+
+        self.assertIs(self.pool.checkout(self.open_connection), db)
+        db.con.rollback.assert_called_once()
+
+    def test_changed_session_is_restored_before_reuse(self):
+        db = self.pool.checkout(self.open_connection)
+        restore_session = db._insights_restore_session = MagicMock()
+
+        self.pool.checkin(db)
+
+        restore_session.assert_called_once_with(db)
+        self.assertIsNone(db._insights_restore_session)
+        self.assertIs(self.pool.checkout(self.open_connection), db)
+
+    def test_connection_is_closed_if_its_session_cannot_be_restored(self):
+        db = self.pool.checkout(self.open_connection)
+        db._insights_restore_session = MagicMock(side_effect=Exception("connection lost"))
+
+        self.pool.checkin(db)
+
+        db.disconnect.assert_called_once()
+        self.assertIsNot(self.pool.checkout(self.open_connection), db)
+        self.assertEqual(self.pool.stats.evictions, 1)
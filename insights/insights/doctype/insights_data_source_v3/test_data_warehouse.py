@@ -0,0 +1,439 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import os
+import tempfile
+import time
+from unittest.mock import MagicMock, patch
+
+import duckdb
+import frappe
+import ibis
+import pyarrow as pa
+from frappe.tests.utils import FrappeTestCase
+from ibis.expr.types import Table
+
+import insights
+from insights.insights.doctype.insights_data_source_v3 import data_warehouse
+from insights.insights.doctype.insights_data_source_v3.connection_pool import release_connection
+from insights.insights.doctype.insights_data_source_v3.data_warehouse import (
+    TABLE_VERSIONS_KEY,
+    Warehouse,
+    WarehouseConnectionPool,
+    WarehouseTableImporter,
+    WarehouseTableWriter,
+    get_table_versions,
+    get_warehouse_pool,
+    read_remote_batches,
+)
+
+
+def write_schema_file(schemas_path, schema, value, table="t"):
+    os.makedirs(os.path.join(schemas_path, schema), exist_ok=True)
+    path = os.path.join(schemas_path, schema, f"{table}.duckdb")
+    staging_path = f"{path}.staging"
+    con = duckdb.connect(staging_path)
+    con.execute(f'CREATE TABLE "{table}" AS SELECT {value} AS x')
+    con.close()
+    # replaced the way write commits replace it
+    os.replace(staging_path, path)
+
+
+def read_value(db, schema, table="t"):
+    return db.raw_sql(f'SELECT x FROM "{schema}"."{table}"').fetchone()[0]
+
+
+class TemporaryWarehouse(Warehouse):
+    def __init__(self, folder_path):
+        self.folder_path = folder_path
+
+    def get_folder_path(self):
+        return self.folder_path
+
+
+class TestWarehouseConnectionPool(FrappeTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.schemas_path = self.tmp.name
+        write_schema_file(self.schemas_path, "sales", 1)
+        self.pool = WarehouseConnectionPool(self.schemas_path)
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp.cleanup()
+
+    def test_cursors_share_one_handle(self):
+        first = self.pool.checkout()
+        second = self.pool.checkout()
+
+        self.assertEqual(read_value(first, "sales"), 1)
+        self.assertEqual(read_value(second, "sales"), 1)
+        stats = self.pool.get_stats()
+        self.assertEqual((stats["misses"], stats["hits"], stats["cursors"]), (1, 1, 2))
+        self.assertEqual(stats["attached_schemas"], ["sales"])
+        self.assertEqual(stats["attached_tables"], 1)
+
+        release_connection(first)
+        release_connection(second)
+        self.assertEqual(self.pool.get_stats()["cursors"], 0)
+        self.assertTrue(self.pool.get_stats()["is_open"])
+
+    def test_replaced_file_does_not_close_cursors_in_use(self):
+        old = self.pool.checkout()
+        write_schema_file(self.schemas_path, "sales", 2)
+
+        new = self.pool.checkout()
+        self.assertEqual(read_value(new, "sales"), 2)
+        # still on the snapshot it was checked out on
+        self.assertEqual(read_value(old, "sales"), 1)
+        stats = self.pool.get_stats()
+        self.assertEqual((stats["reopens"], stats["superseded"], stats["superseded_cursors"]), (1, 1, 1))
+
+        release_connection(old)
+        self.assertEqual(self.pool.get_stats()["superseded"], 0)
+        self.assertEqual(read_value(new, "sales"), 2)
+        release_connection(new)
+
+    def test_refresh_lets_go_of_replaced_files(self):
+        db = self.pool.checkout()
+        write_schema_file(self.schemas_path, "orders", 3)
+
+        self.pool.refresh()
+        self.assertFalse(self.pool.get_stats()["is_open"])
+        self.assertEqual(read_value(db, "sales"), 1)
+
+        release_connection(db)
+        self.assertEqual(self.pool.get_stats()["superseded"], 0)
+
+        db = self.pool.checkout()
+        self.assertEqual(read_value(db, "orders"), 3)
+        release_connection(db)
+
+    def test_idle_timeout_waits_for_cursors(self):
+        self.pool.idle_timeout = 0.2
+        db = self.pool.checkout()
+        time.sleep(0.5)
+        self.assertEqual(read_value(db, "sales"), 1)
+        self.assertTrue(self.pool.get_stats()["is_open"])
+
+        release_connection(db)
+        time.sleep(0.5)
+        stats = self.pool.get_stats()
+        self.assertFalse(stats["is_open"])
+        self.assertEqual(stats["evictions"], 1)
+
+    def test_close_keeps_cursors_in_use_open(self):
+        db = self.pool.checkout()
+        self.pool.close()
+
+        self.assertEqual(read_value(db, "sales"), 1)
+        self.assertEqual(self.pool.get_stats()["superseded_cursors"], 1)
+        release_connection(db)
+        self.assertEqual(self.pool.get_stats()["superseded"], 0)
+
+    def test_checkin_is_idempotent(self):
+        db = self.pool.checkout()
+        other = self.pool.checkout()
+        self.pool.checkin(db)
+        self.pool.checkin(db)
+
+        self.assertEqual(self.pool.get_stats()["cursors"], 1)
+        self.assertEqual(read_value(other, "sales"), 1)
+        release_connection(other)
+
+
+class TestWarehouseWrites(FrappeTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.warehouse = TemporaryWarehouse(self.tmp.name)
+        self.pool = get_warehouse_pool(self.warehouse.get_schemas_path())
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp.cleanup()
+
+    def write(self, table, sql, copy_live_file=True):
+        with self.warehouse.get_write_connection("sales", table, copy_live_file=copy_live_file) as db:
+            db.raw_sql(sql)
+
+    def read(self, sql):
+        db = self.pool.checkout()
+        try:
+            return db.raw_sql(sql).fetchall()
+        finally:
+            release_connection(db)
+
+    def get_staging_files(self):
+        return [name for name in os.listdir(self.warehouse.get_schema_path("sales")) if "staging" in name]
+
+    def test_write_publishes_the_table(self):
+        self.write("orders", "CREATE TABLE orders AS SELECT 1 AS x")
+
+        self.assertEqual(self.read("SELECT x FROM sales.orders"), [(1,)])
+        self.assertTrue(os.path.exists(self.warehouse.get_table_path("sales", "orders")))
+        self.assertEqual(self.get_staging_files(), [])
+
+    def test_failed_write_keeps_the_live_file(self):
+        self.write("orders", "CREATE TABLE orders AS SELECT 1 AS x")
+
+        with self.assertRaises(ZeroDivisionError):
+            with self.warehouse.get_write_connection("sales", "orders") as db:
+                db.raw_sql("INSERT INTO orders VALUES (2)")
+                1 / 0
+
+        self.assertEqual(self.read("SELECT x FROM sales.orders"), [(1,)])
+        self.assertEqual(self.get_staging_files(), [])
+
+    def test_write_only_replaces_its_own_table(self):
+        self.write("orders", "CREATE TABLE orders AS SELECT 1 AS x")
+        self.write("items", "CREATE TABLE items AS SELECT 10 AS x")
+        items_inode = os.stat(self.warehouse.get_table_path("sales", "items")).st_ino
+
+        self.write("orders", "INSERT INTO orders VALUES (2)")
+
+        self.assertEqual(self.read("SELECT x FROM sales.orders ORDER BY x"), [(1,), (2,)])
+        self.assertEqual(os.stat(self.warehouse.get_table_path("sales", "items")).st_ino, items_inode)
+        self.assertEqual(self.read("SELECT x FROM sales.items"), [(10,)])
+
+    def test_write_without_copy_starts_empty(self):
+        self.write("orders", "CREATE TABLE orders AS SELECT 1 AS x")
+        self.write("orders", "CREATE TABLE orders AS SELECT 5 AS x", copy_live_file=False)
+
+        self.assertEqual(self.read("SELECT x FROM sales.orders"), [(5,)])
+
+    def test_readers_keep_their_snapshot(self):
+        self.write("orders", "CREATE TABLE orders AS SELECT 1 AS x")
+        reader = self.pool.checkout()
+
+        self.write("orders", "CREATE TABLE orders AS SELECT 2 AS x", copy_live_file=False)
+
+        self.assertEqual(read_value(reader, "sales", "orders"), 1)
+        self.assertEqual(self.read("SELECT x FROM sales.orders"), [(2,)])
+        release_connection(reader)
+
+    def test_drop_table(self):
+        self.write("orders", "CREATE TABLE orders AS SELECT 1 AS x")
+        self.write("items", "CREATE TABLE items AS SELECT 10 AS x")
+
+        self.warehouse.drop_table("sales", "orders")
+
+        self.assertFalse(os.path.exists(self.warehouse.get_table_path("sales", "orders")))
+        self.assertEqual(self.read("SELECT x FROM sales.items"), [(10,)])
+        self.assertEqual(
+            self.read("SELECT view_name FROM duckdb_views() WHERE schema_name = 'sales'"), [("items",)]
+        )
+
+    def test_request_cursor_is_released_on_publish(self):
+        self.write("orders", "CREATE TABLE orders AS SELECT 1 AS x")
+        insights.db_connections["insights"] = self.pool.checkout()
+
+        self.write("orders", "CREATE TABLE orders AS SELECT 2 AS x", copy_live_file=False)
+
+        self.assertNotIn("insights", insights.db_connections)
+        self.assertEqual(self.pool.get_stats()["superseded"], 0)
+
+
+class TestWarehouseTableWriter(FrappeTestCase):
+    schema = ibis.schema({"name": "string", "value": "int64"})
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.warehouse = TemporaryWarehouse(self.tmp.name)
+        frappe.local.insights_warehouse = self.warehouse
+        self.write([{"name": "a", "value": 1}, {"name": "b", "value": 2}, {"name": "c", "value": 3}])
+
+    def tearDown(self):
+        del frappe.local.insights_warehouse
+        self.warehouse.pool.close()
+        self.tmp.cleanup()
+
+    def write(self, *batches, mode="replace", deleted_keys=None, live_keys=None):
+        with WarehouseTableWriter("items", self.schema, database="sales", mode=mode, key="name") as writer:
+            for batch in batches:
+                writer.insert(pa.Table.from_pylist(batch, schema=self.schema.to_pyarrow()))
+            if deleted_keys is not None:
+                writer.delete_keys(pa.table({"name": deleted_keys}))
+            if live_keys is not None:
+                writer.keep_only_keys(pa.table({"name": live_keys}).to_reader(), memory_limit=1024**2)
+
+    def read(self):
+        db = self.warehouse.pool.checkout()
+        try:
+            return dict(db.raw_sql("SELECT name, value FROM sales.items").fetchall())
+        finally:
+            release_connection(db)
+
+    def test_merge_replaces_updated_rows(self):
+        self.write([{"name": "b", "value": 20}, {"name": "d", "value": 4}], mode="merge")
+
+        self.assertEqual(self.read(), {"a": 1, "b": 20, "c": 3, "d": 4})
+
+    def test_merge_keeps_the_last_copy_of_a_key(self):
+        # updated while it was pulled, read once per page
+        self.write(
+            [{"name": "b", "value": 20}, {"name": "b", "value": 21}],
+            [{"name": "b", "value": 22}],
+            mode="merge",
+        )
+
+        self.assertEqual(self.read(), {"a": 1, "b": 22, "c": 3})
+
+    def test_merge_keeps_batch_order_past_nine_batches(self):
+        self.write(*[[{"name": "b", "value": value}] for value in range(12)], mode="merge")
+
+        self.assertEqual(self.read()["b"], 11)
+
+    def test_deleted_keys_are_removed_before_the_merge(self):
+        # "c" was deleted and then created again
+        self.write([{"name": "c", "value": 30}], mode="merge", deleted_keys=["a", "c"])
+
+        self.assertEqual(self.read(), {"b": 2, "c": 30})
+
+    def test_keys_missing_from_the_source_are_removed(self):
+        self.write([{"name": "d", "value": 4}], mode="merge", live_keys=["a", "d"])
+
+        self.assertEqual(self.read(), {"a": 1, "d": 4})
+
+    def test_append_keeps_every_row(self):
+        self.write([{"name": "b", "value": 20}], mode="append")
+
+        db = self.warehouse.pool.checkout()
+        try:
+            self.assertEqual(db.raw_sql("SELECT count(*) FROM sales.items").fetchone()[0], 4)
+        finally:
+            release_connection(db)
+
+
+class TestReconcileDeletes(FrappeTestCase):
+    def setUp(self):
+        self.source = ibis.duckdb.connect()
+        self.source.raw_sql(
+            """
+            CREATE TABLE "tabDeleted Document" AS SELECT * FROM (VALUES
+                ('ToDo', 'a', TIMESTAMP '2026-01-01 10:00:00'),
+                ('ToDo', 'b', TIMESTAMP '2026-01-02 10:00:00'),
+                ('ToDo', 'c', TIMESTAMP '2026-01-03 10:00:00'),
+                ('Note', 'd', TIMESTAMP '2026-01-03 10:00:00')
+            ) AS t(deleted_doctype, deleted_name, creation)
+            """
+        )
+        self.importer = WarehouseTableImporter(frappe._dict(data_source="site", table_name="tabToDo"))
+        self.importer.sync_key = "name"
+        self.importer.settings = frappe._dict(
+            last_sync_bookmark="2026-01-01 00:00:00", last_delete_bookmark=""
+        )
+        self.importer._log = lambda *args, **kwargs: None
+
+    def reconcile(self):
+        data_source = frappe._dict(_get_ibis_backend=lambda: self.source)
+        writer = frappe._dict(delete_keys=lambda keys: setattr(self, "deleted", keys))
+        with (
+            patch.object(WarehouseTableImporter, "_is_frappe_table", return_value=True),
+            patch.object(data_warehouse.InsightsDataSourcev3, "get_doc", return_value=data_source),
+        ):
+            self.importer.reconcile_deletes(writer)
+        return sorted(self.deleted["name"].to_pylist())
+
+    def test_deletions_since_the_cursor_bookmark(self):
+        self.assertEqual(self.reconcile(), ["a", "b", "c"])
+        self.assertEqual(str(self.importer.delete_bookmark), "2026-01-03 10:00:00")
+
+    def test_deletions_since_the_delete_bookmark(self):
+        # a cursor column of dates in the future must not hide deletions
+        self.importer.settings.last_sync_bookmark = "2030-01-01 00:00:00"
+        self.importer.settings.last_delete_bookmark = "2026-01-02 10:00:00"
+
+        self.assertEqual(self.reconcile(), ["c"])
+
+    def test_no_new_deletions_keep_the_bookmark(self):
+        self.importer.settings.last_delete_bookmark = "2026-01-03 10:00:00"
+
+        self.assertEqual(self.reconcile(), [])
+        self.assertIsNone(self.importer.delete_bookmark)
+
+
+class TestTableVersions(FrappeTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.warehouse = TemporaryWarehouse(self.tmp.name)
+        frappe.local.insights_warehouse = self.warehouse
+        self.schema = f"test_{frappe.generate_hash(length=8)}"
+        self.write("orders")
+        self.write("items")
+
+    def tearDown(self):
+        frappe.cache().hdel(TABLE_VERSIONS_KEY, f"{self.schema}.orders", f"{self.schema}.items")
+        del frappe.local.insights_warehouse
+        self.warehouse.pool.close()
+        self.tmp.cleanup()
+
+    def write(self, table):
+        schema = ibis.schema({"x": "int64"})
+        with WarehouseTableWriter(table, schema, database=self.schema) as writer:
+            writer.insert(pa.table({"x": [1]}))
+
+    def get_versions(self, *tables):
+        db = self.warehouse.get_connection()
+        try:
+            query = db.table(tables[0], database=self.schema)
+            for table in tables[1:]:
+                query = query.union(db.table(table, database=self.schema))
+            return get_table_versions(query)
+        finally:
+            release_connection(db)
+
+    def test_write_gives_the_table_a_new_version(self):
+        versions = self.get_versions("orders", "items")
+        self.assertEqual(set(versions), {f"{self.schema}.orders", f"{self.schema}.items"})
+
+        self.write("orders")
+
+        new_versions = self.get_versions("orders", "items")
+        self.assertNotEqual(new_versions[f"{self.schema}.orders"], versions[f"{self.schema}.orders"])
+        self.assertEqual(new_versions[f"{self.schema}.items"], versions[f"{self.schema}.items"])
+
+    def test_table_without_a_version_has_no_versions(self):
+        frappe.cache().hdel(TABLE_VERSIONS_KEY, f"{self.schema}.items")
+
+        self.assertIsNone(self.get_versions("orders", "items"))
+
+    def test_raw_sql_has_no_versions(self):
+        db = self.warehouse.get_connection()
+        try:
+            self.assertIsNone(get_table_versions(db.sql(f"SELECT * FROM {self.schema}.orders")))
+        finally:
+            release_connection(db)
+
+
+class TestReadRemoteBatches(FrappeTestCase):
+    def setUp(self):
+        self.query = ibis.table({"id": "int64", "status": "string"}, name="orders")
+
+    def test_mysql_results_are_read_over_an_unbuffered_cursor(self):
+        from MySQLdb.cursors import SSCursor
+
+        backend = MagicMock()
+        backend.name = "mysql"
+        backend.compile.return_value = "SELECT `id`, `status` FROM `orders`"
+        cursor = backend.con.cursor.return_value
+        cursor.fetchmany.side_effect = [[(1, "a"), (2, "b")], [(3, None)], []]
+
+        with patch.object(Table, "get_backend", return_value=backend):
+            reader = read_remote_batches(self.query, chunk_size=2)
+            # nothing is fetched before the first batch is read
+            cursor.execute.assert_not_called()
+            table = reader.read_all()
+
+        backend.con.cursor.assert_called_once_with(SSCursor)
+        cursor.fetchmany.assert_called_with(2)
+        cursor.close.assert_called_once()
+        self.assertEqual(table.to_pydict(), {"id": [1, 2, 3], "status": ["a", "b", None]})
+
+    def test_other_backends_stream_through_ibis(self):
+        db = ibis.duckdb.connect()
+        self.addCleanup(db.disconnect)
+        orders = db.create_table("orders", {"id": [1, 2, 3]})
+
+        batches = list(read_remote_batches(orders, chunk_size=2))
+
+        self.assertEqual(sum(batch.num_rows for batch in batches), 3)
@@ -0,0 +1,94 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+from contextlib import nullcontext
+from unittest.mock import patch
+
+import frappe
+import ibis
+from frappe.tests.utils import FrappeTestCase
+
+import insights
+from insights.insights.doctype.insights_data_source_v3 import federation
+from insights.insights.doctype.insights_data_source_v3.federation import (
+    FEDERATION_DB_NAME,
+    FederatedQuery,
+)
+from insights.insights.doctype.insights_data_source_v3.ibis_utils import get_query_data_source
+
+
+class TestFederatedQuery(FrappeTestCase):
+    def setUp(self):
+        self.orders_db = ibis.sqlite.connect()
+        self.customers_db = ibis.duckdb.connect()
+        self.orders = self.orders_db.create_table(
+            "orders", {"id": [1, 2, 3], "customer": [10, 20, 30], "note": ["x", "y", "z"]}
+        )
+        self.customers = self.customers_db.create_table("customers", {"cid": [10, 20], "name": ["p", "q"]})
+
+        self.connections = {"Orders": self.orders_db, "Customers": self.customers_db}
+        insights.db_connections.update(self.connections)
+        self.addCleanup(self.disconnect)
+
+        self.loaded = []
+        load_side = federation.load_side
+
+        def track_load(side, expr):
+            self.loaded.append(sorted(expr.columns))
+            return load_side(side, expr)
+
+        patches = [
+            patch.object(federation, "admit_query", return_value=nullcontext()),
+            patch.object(federation, "load_side", side_effect=track_load),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def disconnect(self):
+        for name in (*self.connections, FEDERATION_DB_NAME):
+            db = insights.db_connections.pop(name, None)
+            if db is not None:
+                db.disconnect()
+
+    def join(self):
+        fq = FederatedQuery()
+        orders, customers = fq.add_side(self.orders), fq.add_side(self.customers)
+        return orders.join(customers, orders.customer == customers.cid)
+
+    def test_sides_are_not_fetched_while_building(self):
+        query = self.join()
+
+        self.assertEqual(self.loaded, [])
+        self.assertEqual(len(query.schema()), 5)
+        self.assertIn("JOIN", ibis.to_sql(query))
+        self.assertEqual(self.loaded, [])
+
+    def test_sides_are_fetched_with_the_columns_read_when_executed(self):
+        query = self.join()
+
+        result = query.select("id", "name").order_by("id").execute()
+
+        self.assertEqual(result.to_dict(orient="list"), {"id": [1, 2], "name": ["p", "q"]})
+        self.assertEqual(sorted(self.loaded), [["cid", "name"], ["customer", "id"]])
+
+    def test_side_is_fetched_again_for_columns_it_was_not_fetched_with(self):
+        query = self.join()
+        query.select("id", "name").execute()
+        self.loaded.clear()
+
+        result = query.order_by("id").execute()
+
+        self.assertEqual(result["note"].tolist(), ["x", "y"])
+        self.assertEqual(self.loaded, [["customer", "id", "note"]])
+
+        self.loaded.clear()
+        query.execute()
+        self.assertEqual(self.loaded, [])
+
+    def test_federated_query_has_no_data_source(self):
+        query = self.join()
+
+        self.assertIsNone(get_query_data_source(query))
+        self.assertEqual(get_query_data_source(self.orders), "Orders")
+        self.assertTrue(frappe.flags.get(federation.TEMP_TABLE_FLAG))
@@ -0,0 +1,328 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+from unittest.mock import MagicMock, patch
+
+import frappe
+import ibis
+from frappe.tests.utils import FrappeTestCase
+
+from insights.insights.doctype.insights_data_source_v3 import ibis_utils
+from insights.insights.doctype.insights_data_source_v3.ibis_utils import (
+    IbisQueryBuilder,
+    execute_ibis_queries,
+    get_keyset,
+    get_next_cursor,
+    get_result_cache_key,
+    order_by_keyset,
+    read_result_batches,
+    seek_query,
+)
+from insights.insights.doctype.insights_data_source_v3.result_cache import (
+    CACHE_KEY_PREFIX,
+    acquire_lock,
+    cache_results,
+    release_lock,
+)
+
+
+class TestKeysetPagination(FrappeTestCase):
+    def setUp(self):
+        self.db = ibis.duckdb.connect()
+        # ties on `status` span pages, and some of them are null
+        self.table = self.db.create_table(
+            "orders",
+            {
+                "id": list(range(1, 12)),
+                "status": ["a", "b", None, "a", "b", "a", None, "a", "c", "a", None],
+                "amount": [5, 3, 2, 5, 1, 5, 4, 2, 3, 5, 1],
+            },
+        )
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def get_rows(self, query):
+        return query.to_pandas().to_dict(orient="records")
+
+    def get_pages(self, query, page_size):
+        keys = get_keyset(query)
+        pages = [self.get_rows(order_by_keyset(query, keys).limit(page_size))]
+        cursor = get_next_cursor(keys, pages[-1], page_size)
+        while cursor:
+            pages.append(self.get_rows(seek_query(query, keys, cursor, page_size)))
+            cursor = get_next_cursor(keys, pages[-1], page_size, cursor)
+        return pages
+
+    def assertPagesMatch(self, query, page_size):
+        pages = self.get_pages(query, page_size)
+        rows = [row for page in pages for row in page]
+        expected = self.get_rows(query)
+
+        self.assertEqual(sorted(row["id"] for row in rows), sorted(row["id"] for row in expected))
+        # rows tied on the keys may come back in any order, the keys themselves may not
+        keys = [key.expr.name for key in get_keyset(query)]
+        self.assertEqual(
+            [[row[k] for k in keys] for row in rows], [[row[k] for k in keys] for row in expected]
+        )
+        self.assertTrue(all(len(page) <= page_size for page in pages))
+
+    def test_only_ordered_queries_have_a_keyset(self):
+        t = self.table
+
+        self.assertIsNone(get_keyset(t))
+        self.assertIsNone(get_keyset(t.filter(t.amount > 1)))
+        # the cursor cannot seek to the value of an expression
+        self.assertIsNone(get_keyset(t.order_by((t.amount * 2).desc())))
+        self.assertEqual(
+            [(key.expr.name, key.ascending) for key in get_keyset(t.order_by([t.status, t.amount.desc()]))],
+            [("status", True), ("amount", False)],
+        )
+
+    def test_pages_cover_every_row_once(self):
+        t = self.table
+        for page_size in (1, 2, 3, 4, 11):
+            with self.subTest(page_size=page_size):
+                self.assertPagesMatch(t.order_by([t.status, t.id]), page_size)
+                self.assertPagesMatch(t.order_by([t.amount.desc(), t.id.desc()]), page_size)
+
+    def test_ties_on_every_key_span_pages(self):
+        t = self.table
+        for page_size in (1, 2, 3):
+            with self.subTest(page_size=page_size):
+                self.assertPagesMatch(t.order_by(t.status), page_size)
+                self.assertPagesMatch(t.order_by([t.status.desc(), t.amount]), page_size)
+
+    def test_nulls_are_paged_where_they_sort(self):
+        t = self.table
+        for page_size in (1, 2, 4):
+            with self.subTest(page_size=page_size):
+                self.assertPagesMatch(t.order_by([ibis.asc(t.status, nulls_first=True), t.id]), page_size)
+                self.assertPagesMatch(t.order_by([ibis.desc(t.status, nulls_first=True), t.id]), page_size)
+                self.assertPagesMatch(t.order_by([ibis.desc(t.status), t.id]), page_size)
+
+    def test_last_page_has_no_cursor(self):
+        t = self.table
+        query = t.order_by(t.id)
+        keys = get_keyset(query)
+
+        self.assertIsNone(get_next_cursor(keys, [], 5))
+        self.assertIsNone(get_next_cursor(keys, self.get_rows(query.limit(3)), 5))
+        self.assertEqual(get_next_cursor(keys, self.get_rows(query.limit(3)), 3), {"values": [3], "skip": 1})
+
+    def test_cursor_skips_rows_tied_with_the_previous_page(self):
+        t = self.table
+        query = t.order_by(t.amount.desc())
+        keys = get_keyset(query)
+
+        # four rows have amount 5
+        first = get_next_cursor(keys, self.get_rows(order_by_keyset(query, keys).limit(2)), 2)
+        second = get_next_cursor(keys, self.get_rows(seek_query(query, keys, first, 2)), 2, first)
+        third = get_next_cursor(keys, self.get_rows(seek_query(query, keys, second, 2)), 2, second)
+
+        self.assertEqual(first, {"values": [5], "skip": 2})
+        self.assertEqual(second, {"values": [5], "skip": 4})
+        # the page after them starts at the next amount
+        self.assertEqual(third, {"values": [3], "skip": 1})
+
+    def test_ties_are_broken_on_a_unique_key(self):
+        t = self.table
+        frappe_table = self.db.create_table("tabOrder", t.mutate(name=t.id.cast("string")).to_pyarrow())
+
+        def get_order(query):
+            ordered = order_by_keyset(query, get_keyset(query))
+            return [key.expr.name for key in ordered.op().keys]
+
+        self.assertEqual(get_order(frappe_table.order_by(frappe_table.status)), ["status", "name"])
+        self.assertEqual(
+            get_order(
+                frappe_table.select(order=frappe_table.name, status=frappe_table.status).order_by("status")
+            ),
+            ["status", "order"],
+        )
+        totals = t.group_by("status").aggregate(id=t.id.max(), total=t.amount.sum())
+        self.assertEqual(get_order(totals.order_by(totals.total)), ["total", "status"])
+        # without a unique key every column breaks the ties
+        self.assertEqual(get_order(t.order_by(t.status)), ["status", "id", "amount"])
+
+        for page_size in (1, 2, 3):
+            with self.subTest(page_size=page_size):
+                self.assertPagesMatch(frappe_table.order_by(frappe_table.status), page_size)
+                self.assertPagesMatch(totals.order_by(totals.total.desc()), page_size)
+
+
+class TestReadResultBatches(FrappeTestCase):
+    def setUp(self):
+        # SQLite's driver is not one of the streaming ones, so results are read in pages
+        self.db = ibis.sqlite.connect()
+        self.table = self.db.create_table(
+            "orders", {"id": list(range(1, 1001)), "status": [str(i % 7) for i in range(1000)]}
+        )
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def read(self, query, max_rows):
+        with read_result_batches(query, max_rows, chunk_size=50) as reader:
+            return reader.read_all()
+
+    def test_pages_return_each_row_once(self):
+        t = self.table
+        for query in (t, t.order_by(t.status), t.order_by((t.id * 2).desc()), t.limit(500)):
+            with self.subTest(query=type(query.op()).__name__):
+                ids = self.read(query, 301)["id"].to_pylist()
+                self.assertEqual(len(ids), 301)
+                self.assertEqual(len(set(ids)), 301)
+
+    def test_ordered_pages_keep_the_order(self):
+        t = self.table
+        query = t.order_by([t.status.desc(), t.id])
+
+        rows = self.read(query, 1000).to_pylist()
+
+        self.assertEqual(rows, query.to_pyarrow().to_pylist())
+
+    def count_statements(self, statements):
+        backend_class = type(self.db)
+        to_pyarrow = backend_class.to_pyarrow
+
+        def count_statements(backend, query, *args, **kwargs):
+            statements.append(query)
+            return to_pyarrow(backend, query, *args, **kwargs)
+
+        return patch.object(backend_class, "to_pyarrow", count_statements)
+
+    def test_pages_stop_once_the_reader_stops(self):
+        statements = []
+        with self.count_statements(statements):
+            with read_result_batches(self.table, 1000, chunk_size=50) as reader:
+                reader.read_next_batch()
+            self.assertEqual(len(statements), 1)
+
+            self.read(self.table, 1000)
+            self.assertEqual(len(statements), 1 + ibis_utils.MAX_RESULT_PAGES)
+
+    def test_pages_seek_past_the_previous_page(self):
+        t = self.db.create_table(
+            "tabOrder", self.table.mutate(name=self.table.id.cast("string")).to_pyarrow()
+        )
+        query = t.order_by(t.status)
+        statements = []
+
+        with self.count_statements(statements):
+            rows = self.read(query, 1000).to_pylist()
+
+        self.assertEqual(rows, order_by_keyset(query, get_keyset(query)).to_pyarrow().to_pylist())
+        # each page skips only the last row of the previous one, which it seeks to
+        self.assertEqual([statement.op().offset for statement in statements], [0, 1, 1, 1])
+        self.assertEqual([key.expr.name for key in statements[-1].op().parent.keys], ["status", "name"])
+
+
+class TestExecuteIbisQueries(FrappeTestCase):
+    def setUp(self):
+        self.db = ibis.duckdb.connect()
+        self.db.db_identity = frappe.generate_hash(length=12)
+        self.table = self.db.create_table("orders", {"id": [1, 2, 3], "status": ["a", "b", "a"]})
+
+        self.fetched = []
+        fetch_results = ibis_utils.fetch_results
+
+        def track_fetch(query, **kwargs):
+            self.fetched.append(query)
+            return fetch_results(query, **kwargs)
+
+        data_source = MagicMock()
+        data_source.checkout_connection.return_value = self.db
+        patches = [
+            patch.object(ibis_utils, "get_live_data_source", return_value="Orders"),
+            patch.object(ibis_utils, "acquire_slot", return_value=""),
+            patch.object(ibis_utils, "try_acquire_slot", return_value=""),
+            patch.object(ibis_utils, "release_slot"),
+            patch.object(ibis_utils, "release_connection"),
+            patch.object(ibis_utils, "create_execution_log"),
+            patch.object(ibis_utils.InsightsDataSourcev3, "get_doc", return_value=data_source),
+            patch.object(ibis_utils, "fetch_results", side_effect=track_fetch),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def get_cache_key(self, query):
+        return get_result_cache_key(query, ibis.to_sql(query), self.db)[0]
+
+    def test_identical_queries_are_fetched_once_and_cached(self):
+        t = self.table
+        counts = t.group_by("status").aggregate(count=t.count()).order_by("status")
+
+        results = execute_ibis_queries([(counts, "a"), (counts, "b"), (t.filter(t.id > 1), "c")])
+
+        self.assertEqual(len(self.fetched), 2)
+        self.assertEqual(results[0][0].to_dict(orient="list"), {"status": ["a", "b"], "count": [2, 1]})
+        self.assertEqual(results[1][0].to_dict(orient="list"), results[0][0].to_dict(orient="list"))
+
+        self.fetched.clear()
+        results = execute_ibis_queries([(counts, "a")])
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(results[0][1], -1)
+
+    def test_query_computed_by_another_worker_is_served_its_expired_results(self):
+        query = self.table.filter(self.table.id > 1)
+        cache_key = self.get_cache_key(query)
+        cache_results(cache_key, query.to_pandas().head(1), cache_expiry=-1)
+        token = acquire_lock(cache_key)
+        self.addCleanup(release_lock, cache_key, token)
+        self.addCleanup(frappe.cache().delete_value, CACHE_KEY_PREFIX + cache_key)
+
+        results = execute_ibis_queries([(query, "a")])
+
+        self.assertEqual(self.fetched, [])
+        self.assertEqual(results[0][0]["id"].tolist(), [2])
+        self.assertEqual(results[0][1], -1)
+
+    def test_results_are_limited_to_the_size_budget(self):
+        query = self.table.order_by("id")
+
+        # room for two rows going by the schema
+        budget = 2 * ibis_utils.estimate_row_size(query.schema())
+        with patch.object(ibis_utils, "get_result_budget", return_value=budget):
+            results = execute_ibis_queries([(query, "a")], force=True)
+
+        self.assertEqual(results[0][0]["id"].tolist(), [1, 2])
+        self.assertTrue(results[0][0].attrs["truncated"])
+
+
+class TestStoredPivotNames(FrappeTestCase):
+    def setUp(self):
+        self.stats = {"columns": {"status": {"null_count": 1, "values": ["a", "b"]}}}
+        patches = [
+            patch.object(ibis_utils, "get_column_stats", side_effect=lambda *args: self.stats),
+            patch.object(frappe, "get_single_value", return_value=[0, 0]),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def get_names(self, operations, max_names=10):
+        source = {"type": "source", "table": {"type": "table", "data_source": "db", "table_name": "orders"}}
+        operations = [source, *operations, {"type": "pivot_wider"}]
+        doc = frappe._dict(name="orders-query", title="Orders", operations=operations, use_live_connection=0)
+        builder = IbisQueryBuilder(doc)
+        builder.operation_idx = len(operations) - 1
+        column = {"column_name": "status", "data_type": "String"}
+        names = builder.get_stored_pivot_names([column], max_names)
+        return names["status"].tolist() if names is not None else None
+
+    def test_names_of_a_pivot_on_a_stored_column_come_from_its_stats(self):
+        self.assertEqual(self.get_names([]), ["a", "b", None])
+        self.assertEqual(self.get_names([{"type": "order_by"}], max_names=2), ["a", "b"])
+
+    def test_names_are_queried_when_the_stats_cannot_tell(self):
+        # a filter could leave out some of the values
+        self.assertIsNone(self.get_names([{"type": "filter"}]))
+
+        # stats of imports before nulls were counted
+        del self.stats["columns"]["status"]["null_count"]
+        self.assertIsNone(self.get_names([]))
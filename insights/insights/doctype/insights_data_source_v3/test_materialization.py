@@ -0,0 +1,117 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import os
+import tempfile
+from unittest.mock import patch
+
+import frappe
+import ibis
+from frappe.tests.utils import FrappeTestCase
+
+import insights
+from insights.insights.doctype.insights_data_source_v3 import materialization
+from insights.insights.doctype.insights_data_source_v3.connection_pool import release_connection
+from insights.insights.doctype.insights_data_source_v3.data_warehouse import (
+    WAREHOUSE_DB_NAME,
+    get_schema_file_ids,
+)
+from insights.insights.doctype.insights_data_source_v3.materialization import (
+    MATERIALIZED_CATALOG_PREFIX,
+    MaterializedReads,
+    drop_materializations,
+    get_materialization_folder,
+    read_materialization,
+    write_materialization,
+)
+from insights.insights.doctype.insights_data_source_v3.test_data_warehouse import (
+    TemporaryWarehouse,
+    write_schema_file,
+)
+
+
+class TestMaterializationFiles(FrappeTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.warehouse = TemporaryWarehouse(self.tmp.name)
+        frappe.local.insights_warehouse = self.warehouse
+        write_schema_file(self.warehouse.get_schemas_path(), "sales", 1)
+        self.schema = "insights_materialized_test"
+
+    def tearDown(self):
+        db = insights.db_connections.pop(WAREHOUSE_DB_NAME, None)
+        if db is not None:
+            release_connection(db)
+        del frappe.local.insights_warehouse
+        self.warehouse.pool.close()
+        self.tmp.cleanup()
+
+    def write(self, values):
+        return write_materialization(ibis.memtable({"x": values}), self.schema, budgeted=False)
+
+    def read(self):
+        table = read_materialization(self.schema)
+        return table.x.to_pyarrow().to_pylist() if table is not None else None
+
+    def get_files(self):
+        return sorted(os.listdir(get_materialization_folder(self.schema)))
+
+    def test_write_does_not_change_the_schema_files(self):
+        file_ids = get_schema_file_ids(self.warehouse.get_schemas_path())
+
+        self.assertEqual(self.write([1, 2]), 2)
+
+        self.assertEqual(get_schema_file_ids(self.warehouse.get_schemas_path()), file_ids)
+        self.assertEqual(self.read(), [1, 2])
+
+    def test_each_write_is_a_new_file(self):
+        self.write([1])
+        first = self.get_files()
+        self.assertEqual(self.read(), [1])
+
+        self.write([2, 3])
+
+        files = self.get_files()
+        self.assertEqual(len(files), 1)
+        self.assertNotEqual(files, first)
+        self.assertEqual(self.read(), [2, 3])
+
+    def test_older_files_are_detached_once_a_newer_one_is_read(self):
+        self.write([1])
+        self.assertEqual(self.read(), [1])
+        self.write([2])
+        self.assertEqual(self.read(), [2])
+
+        attached = self.warehouse.db.raw_sql(
+            "SELECT database_name FROM duckdb_databases() "
+            f"WHERE starts_with(database_name, '{MATERIALIZED_CATALOG_PREFIX}{self.schema}/')"
+        ).fetchall()
+        self.assertEqual(len(attached), 1)
+
+    def test_only_materialized_prefixes_are_looked_up(self):
+        operations = [{"type": "source"}, {"type": "filter"}, {"type": "summarize"}, {"type": "order_by"}]
+        reads = MaterializedReads(operations, len(operations))
+        query = ibis.memtable({"x": [1]})
+
+        with patch.object(materialization, "get_digest", return_value="digest") as get_digest:
+            for count in range(1, len(operations) + 1):
+                self.assertIs(reads.read(query, count), query)
+
+        # the operations before the summarize, and all of them
+        self.assertEqual(get_digest.call_count, 2)
+
+    def test_missing_or_dropped_results_are_not_read(self):
+        self.assertIsNone(self.read())
+
+        self.write([1])
+        drop_materializations(self.schema)
+
+        self.assertIsNone(self.read())
+        self.assertFalse(os.path.exists(get_materialization_folder(self.schema)))
+
+    def test_other_paths_cannot_be_attached(self):
+        self.write([1])
+        outside = os.path.join(self.tmp.name, "outside.duckdb")
+
+        with self.assertRaises(Exception):
+            self.warehouse.db.raw_sql(f"ATTACH '{outside}' AS outside")
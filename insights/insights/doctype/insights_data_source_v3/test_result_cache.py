@@ -0,0 +1,155 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import os
+import tempfile
+from decimal import Decimal
+from unittest.mock import patch
+
+import frappe
+import pandas as pd
+from frappe.tests.utils import FrappeTestCase
+
+from insights.insights.doctype.insights_data_source_v3 import result_cache
+from insights.insights.doctype.insights_data_source_v3.result_cache import (
+    CACHE_KEY_PREFIX,
+    LOCK_KEY_PREFIX,
+    acquire_lock,
+    cache_results,
+    get_cached_results,
+    get_or_compute_results,
+    lookup_results,
+    release_lock,
+    wait_for_results,
+)
+
+
+def make_results(value=1):
+    results = pd.DataFrame(
+        {
+            "value": [value, None],
+            "amount": [Decimal("1.50"), Decimal("2.25")],
+            "created": pd.to_datetime(["2026-01-01 10:00:00", None]),
+        }
+    )
+    results.attrs["truncated"] = True
+    return results
+
+
+class TestResultCache(FrappeTestCase):
+    def setUp(self):
+        self.cache_key = frappe.generate_hash(length=12)
+
+    def tearDown(self):
+        frappe.cache().delete_value(CACHE_KEY_PREFIX + self.cache_key)
+        frappe.cache().delete(frappe.cache().make_key(LOCK_KEY_PREFIX + self.cache_key))
+
+    def compute(self, value=2):
+        self.computed = getattr(self, "computed", 0) + 1
+        return make_results(value), 0.5
+
+    def test_results_keep_their_types(self):
+        cache_results(self.cache_key, make_results())
+        results = get_cached_results(self.cache_key)
+
+        self.assertEqual(results["amount"].tolist(), [Decimal("1.50"), Decimal("2.25")])
+        self.assertEqual(results["created"][0], pd.Timestamp("2026-01-01 10:00:00"))
+        # nulls come back as None, so they serialize to JSON nulls
+        self.assertIsNone(results["value"][1])
+        self.assertIsNone(results["created"][1])
+        self.assertEqual(results.attrs, {"truncated": True})
+
+    def test_fresh_results_are_not_recomputed(self):
+        cache_results(self.cache_key, make_results())
+
+        results, time_taken = get_or_compute_results(self.cache_key, self.compute)
+
+        self.assertEqual(time_taken, -1)
+        self.assertEqual(results["value"][0], 1)
+        self.assertFalse(hasattr(self, "computed"))
+
+    def test_expired_results_are_recomputed(self):
+        cache_results(self.cache_key, make_results(), cache_expiry=-1)
+        self.assertIsNone(get_cached_results(self.cache_key))
+
+        results, time_taken = get_or_compute_results(self.cache_key, self.compute)
+
+        self.assertEqual((time_taken, results["value"][0], self.computed), (0.5, 2, 1))
+        self.assertEqual(get_cached_results(self.cache_key)["value"][0], 2)
+
+    def test_expired_results_are_served_while_another_caller_recomputes(self):
+        cache_results(self.cache_key, make_results(), cache_expiry=-1)
+        acquire_lock(self.cache_key)
+
+        results, time_taken = get_or_compute_results(self.cache_key, self.compute)
+
+        self.assertEqual((time_taken, results["value"][0]), (-1, 1))
+        self.assertFalse(hasattr(self, "computed"))
+
+    def test_force_recomputes_fresh_results(self):
+        cache_results(self.cache_key, make_results())
+
+        results, time_taken = get_or_compute_results(self.cache_key, self.compute, force=True)
+
+        self.assertEqual((time_taken, results["value"][0]), (0.5, 2))
+
+    def test_lock_is_taken_once(self):
+        token = acquire_lock(self.cache_key)
+
+        self.assertTrue(token)
+        self.assertIsNone(acquire_lock(self.cache_key))
+        release_lock(self.cache_key, token)
+        self.assertTrue(acquire_lock(self.cache_key))
+
+    def test_release_leaves_a_lock_taken_by_another_caller(self):
+        acquire_lock(self.cache_key)
+
+        release_lock(self.cache_key, "expired-token")
+
+        self.assertIsNone(acquire_lock(self.cache_key))
+
+    def test_lock_is_released_when_compute_fails(self):
+        def compute():
+            raise ValueError("query failed")
+
+        with self.assertRaises(ValueError):
+            get_or_compute_results(self.cache_key, compute)
+
+        self.assertTrue(acquire_lock(self.cache_key))
+
+    def test_waiting_caller_gets_the_results_of_the_lock_holder(self):
+        acquire_lock(self.cache_key)
+
+        # the lock holder caches its results while the other caller waits
+        def sleep(_seconds):
+            cache_results(self.cache_key, make_results(3))
+
+        with patch.object(result_cache.time, "sleep", side_effect=sleep):
+            results, time_taken = get_or_compute_results(self.cache_key, self.compute)
+
+        self.assertEqual((time_taken, results["value"][0]), (-1, 3))
+        self.assertFalse(hasattr(self, "computed"))
+
+    def test_waiting_stops_when_the_lock_is_released_without_results(self):
+        token = acquire_lock(self.cache_key)
+
+        with patch.object(
+            result_cache.time, "sleep", side_effect=lambda _: release_lock(self.cache_key, token)
+        ):
+            self.assertIsNone(wait_for_results(self.cache_key))
+
+    def test_large_results_are_spilled_to_disk(self):
+        with (
+            tempfile.TemporaryDirectory() as folder,
+            patch.object(result_cache, "REDIS_ENTRY_LIMIT", 0),
+            patch.object(result_cache, "get_spill_folder", return_value=folder),
+        ):
+            cache_results(self.cache_key, make_results())
+            entry = frappe.cache().get_value(CACHE_KEY_PREFIX + self.cache_key)
+
+            self.assertNotIn("data", entry)
+            self.assertTrue(os.path.exists(entry["path"]))
+            self.assertEqual(get_cached_results(self.cache_key)["value"][0], 1)
+
+            os.remove(entry["path"])
+            self.assertEqual(lookup_results(self.cache_key), (None, False))
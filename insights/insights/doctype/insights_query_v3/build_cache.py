@@ -0,0 +1,209 @@
+"""Per-process memo of built Insights Query v3 expressions.
+
+Building a query replays all of its operations, evaluates their expressions and
+builds every query it references. The built expression only depends on the inputs
+that make up the build key, so it is kept in an LRU for the life of the process.
+
+Connections do not outlive a request. The memoized expression refers to the
+connections it reads from by name only, and on a hit it is bound to the
+connections of the current request before it is returned.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import frappe
+import ibis
+import ibis.expr.operations as ops
+from ibis.expr.types import Table
+
+import insights
+from insights.cache_utils import make_digest
+from insights.insights.doctype.insights_data_source_v3.data_warehouse import (
+    TABLE_VERSIONS_KEY,
+    WAREHOUSE_DB_NAME,
+    get_warehouse_schema_name,
+)
+from insights.insights.query_utils import transitive_closure
+from insights.utils import InsightsDataSourcev3
+
+MAX_ENTRIES = 256
+# bounds how long schema changes at the source and permission changes go unnoticed
+MAX_AGE = 5 * 60
+# set while building when an operation creates a table that only lives in this request
+TEMP_TABLE_FLAG = "insights_build_uses_temp_tables"
+SOURCE_NODES = (ops.DatabaseTable, ops.SQLQueryResult)
+
+_entries: OrderedDict[str, frappe._dict] = OrderedDict()
+_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class DetachedSource:
+    """The connection a memoized expression reads from, by the name it is opened with."""
+
+    name: str
+
+
+def get_build_key(doc, active_operation_idx, use_live_connection) -> str:
+    """Return a digest of everything a query's built expression depends on."""
+    query_names = {doc.name} | transitive_closure(doc.name)
+
+    # materialized dependencies are read from their results, which are refreshed without a save
+    dependencies = frappe.get_all(
+        "Insights Query v3",
+        filters={"name": ["in", list(query_names - {doc.name})]},
+        fields=["name", "modified", "materialized_at"],
+        order_by="name",
+    )
+
+    table_versions = [] if use_live_connection else get_source_table_versions(query_names)
+
+    return make_digest(
+        frappe.local.site,
+        doc.name,
+        doc.modified,
+        # executions of unsaved changes build the operations sent by the client
+        frappe.as_json(frappe.parse_json(doc.operations or "[]")),
+        frappe.as_json([(v.variable_name, v.variable_value) for v in doc.get("variables") or []]),
+        active_operation_idx,
+        int(bool(use_live_connection)),
+        frappe.as_json(getattr(frappe.local, "insights_adhoc_filters", None) or {}),
+        get_permission_fingerprint(),
+        frappe.as_json(dependencies),
+        frappe.as_json(table_versions),
+    )
+
+
+def get_source_table_versions(query_names: set[str]) -> list[tuple[str, int | None]]:
+    """Return the versions of the data store tables the queries read, sorted by table."""
+    Ref = frappe.qb.DocType("Insights Query Reference")
+    tables = (
+        frappe.qb.from_(Ref)
+        .select(Ref.data_source, Ref.table_name)
+        .where((Ref.query.isin(list(query_names))) & (Ref.ref_type == "Table"))
+        .distinct()
+        .run(as_dict=True)
+    )
+
+    table_versions = []
+    for table in sorted(tables, key=lambda t: (t.data_source, t.table_name)):
+        key = f"{get_warehouse_schema_name(table.data_source)}.{frappe.scrub(table.table_name)}"
+        table_versions.append((key, frappe.cache().hget(TABLE_VERSIONS_KEY, key)))
+    return table_versions
+
+
+def get_permission_fingerprint() -> str:
+    if frappe.flags.get("insights_for_public_access"):
+        return "Guest"
+
+    # permissions are applied while building, so the expression is specific to the user
+    return frappe.session.user if permissions_applied() else ""
+
+
+def permissions_applied() -> bool:
+    return any(frappe.get_single_value("Insights Settings", ["enable_permissions", "apply_user_permissions"]))
+
+
+def get_built_query(build_key: str) -> Table | None:
+    with _lock:
+        entry = _entries.get(build_key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.built_at > MAX_AGE:
+            del _entries[build_key]
+            return None
+        _entries.move_to_end(build_key)
+
+    backends = {name: get_backend(name) for name in entry.sources}
+    expr = replace_sources(entry.expr, lambda source: backends[source.name])
+    remember_sql(expr, entry.sql)
+    return expr
+
+
+def set_built_query(build_key: str, expr: Table) -> None:
+    sources = get_sources(expr)
+    if sources is None:
+        return
+
+    try:
+        sql = ibis.to_sql(expr)
+    except Exception:
+        sql = None
+
+    # the entry must not keep the connections of this request open
+    names = {id(backend): name for name, backend in sources.items()}
+    detached = replace_sources(expr, lambda source: DetachedSource(names[id(source)]))
+
+    with _lock:
+        _entries[build_key] = frappe._dict(
+            expr=detached,
+            sql=sql,
+            sources=list(sources),
+            built_at=time.monotonic(),
+        )
+        _entries.move_to_end(build_key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+    remember_sql(expr, sql)
+
+
+def replace_sources(expr: Table, get_source) -> Table:
+    replacements = {node: node.copy(source=get_source(node.source)) for node in expr.op().find(SOURCE_NODES)}
+    return expr.op().replace(replacements).to_expr()
+
+
+def get_sources(expr: Table) -> dict | None:
+    """Map the connections the expression reads from to the names they are opened by.
+
+    Returns None if any connection was not opened through `insights.db_connections`,
+    since the expression could then not be rebound in a later request.
+    """
+    backends = {id(node.source) for node in expr.op().find(SOURCE_NODES)}
+    sources = {name: backend for name, backend in insights.db_connections.items() if id(backend) in backends}
+    if len(sources) != len(backends):
+        return None
+    return sources
+
+
+def get_backend(name: str):
+    if name == WAREHOUSE_DB_NAME:
+        return insights.warehouse.db
+    return InsightsDataSourcev3.get_doc(name)._get_ibis_backend()
+
+
+def remember_sql(expr: Table, sql: str | None) -> None:
+    if not sql:
+        return
+    if not hasattr(frappe.local, "insights_compiled_sql"):
+        frappe.local.insights_compiled_sql = {}
+    # keep the expression alive with its sql, so the id can't be reused this request
+    frappe.local.insights_compiled_sql[id(expr)] = (expr, sql)
+
+
+def get_compiled_sql(expr: Table) -> str:
+    """Return the SQL of an expression, reusing the SQL compiled when it was built."""
+    compiled = getattr(frappe.local, "insights_compiled_sql", None) or {}
+    hit = compiled.get(id(expr))
+    if hit and hit[0] is expr:
+        return hit[1]
+    return ibis.to_sql(expr)
+
+
+@contextmanager
+def track_temp_tables():
+    """Yield a callable that tells whether the build created request-scoped tables.
+
+    The flag is carried up to enclosing builds, so a query that references such a
+    query is not memoized either.
+    """
+    outer = frappe.flags.get(TEMP_TABLE_FLAG)
+    frappe.flags[TEMP_TABLE_FLAG] = False
+    try:
+        yield lambda: bool(frappe.flags.get(TEMP_TABLE_FLAG))
+    finally:
+        frappe.flags[TEMP_TABLE_FLAG] = outer or frappe.flags.get(TEMP_TABLE_FLAG)
@@ -13,13 +13,36 @@ import sqlparse
 from frappe.model.document import Document
 from ibis import _
 
+from insights.cache_utils import make_digest
 from insights.decorators import insights_whitelist
 from insights.insights.doctype.insights_data_source_v3.ibis_utils import (
     CircularQueryReferenceError,
     IbisQueryBuilder,
+    estimate_row_count,
     execute_ibis_query,
+    get_cached_query_results,
     get_columns_from_schema,
+    get_keyset,
+    get_next_cursor,
+    order_by_keyset,
+    seek_query,
 )
+from insights.insights.doctype.insights_data_source_v3.insights_data_source_v3 import db_connections
+from insights.insights.doctype.insights_query_v3.build_cache import (
+    get_build_key,
+    get_built_query,
+    get_compiled_sql,
+    set_built_query,
+    track_temp_tables,
+)
+from insights.insights.doctype.insights_query_v3.materialized_query import (
+    MATERIALIZATION_FIELDS,
+    drop_materialization,
+    enqueue_materialization,
+    get_variables,
+)
+from insights.insights.doctype.insights_query_v3.query_jobs import submit_execution
+from insights.insights.doctype.insights_query_v3.result_export import cast_decimals, enqueue_export
 from insights.insights.query_utils import (
     extract_query_deps_from_operations,
     find_cycle,
@@ -45,10 +68,18 @@ class InsightsQueryv3(Document):
 
         folder: DF.Data | None
         is_builder_query: DF.Check
+        is_materialized: DF.Check
         is_native_query: DF.Check
         is_script_query: DF.Check
+        materialize_on_read: DF.Check
+        materialized_at: DF.Datetime | None
+        materialized_rows: DF.Int
+        materialized_signature: DF.Data | None
+        materialized_sources: DF.Data | None
         old_name: DF.Data | None
         operations: DF.JSON | None
+        refresh_interval: DF.Literal["Hourly", "Daily", "Weekly"]
+        refresh_on_source_change: DF.Check
         sort_order: DF.Int
         title: DF.Data | None
         use_live_connection: DF.Check
@@ -74,12 +105,16 @@ class InsightsQueryv3(Document):
         frappe.db.delete("Insights Query Reference", {"query": self.name})
         frappe.db.delete("Insights Query Reference", {"ref_query": self.name})
 
+        if self.is_materialized:
+            drop_materialization(self.name)
+
         # Clean up empty folders
         if self.folder:
             self.cleanup_empty_folder(self.folder)
 
     def validate(self):
         self._validate_no_circular_dependency()
+        self._keep_materialization_state()
 
     def _validate_no_circular_dependency(self):
         """Raise an error if the current operations would create a circular query reference."""
@@ -99,8 +134,30 @@ class InsightsQueryv3(Document):
                 exc=CircularQueryReferenceError,
             )
 
+    def _keep_materialization_state(self):
+        # only written by the materialization job, a save of an older copy must not undo it
+        doc_before_save = self.get_doc_before_save()
+        for fieldname in MATERIALIZATION_FIELDS:
+            self.set(fieldname, doc_before_save.get(fieldname) if doc_before_save else None)
+
     def on_update(self):
         sync_query_references(self.name, self.operations)
+        self.update_materialization()
+
+    def update_materialization(self):
+        if self.is_materialized:
+            variables_changed = get_variables(self) != get_variables(self.get_doc_before_save())
+            if variables_changed:
+                # not part of the signature, so the results written before are unmarked instead
+                self.db_set("materialized_signature", None, update_modified=False)
+            if variables_changed or any(
+                self.has_value_changed(fieldname)
+                for fieldname in ("is_materialized", "use_live_connection", "operations")
+            ):
+                # results written for other operations are not read anymore, see `get_definition_signature`
+                enqueue_materialization(self.name)
+        elif (doc_before_save := self.get_doc_before_save()) and doc_before_save.is_materialized:
+            drop_materialization(self.name)
 
     def cleanup_empty_folder(self, folder_name):
         """Delete folder if it has no queries or charts"""
@@ -133,15 +190,25 @@ class InsightsQueryv3(Document):
         return [{"data_source": r.data_source, "table_name": r.table_name} for r in rows]
 
     def build(self, active_operation_idx=None, use_live_connection=None):
+        if use_live_connection is None:
+            use_live_connection = self.use_live_connection
+
+        build_key = get_build_key(self, active_operation_idx, use_live_connection)
+        ibis_query = get_built_query(build_key)
+        if ibis_query is not None:
+            return ibis_query
+
         builder = IbisQueryBuilder(self, active_operation_idx)
-        builder.use_live_connection = (
-            use_live_connection if use_live_connection is not None else self.use_live_connection
-        )
-        ibis_query = builder.build()
+        builder.use_live_connection = use_live_connection
+        with track_temp_tables() as uses_temp_tables:
+            ibis_query = builder.build()
+            memoize = not uses_temp_tables()
 
         if ibis_query is None:
             frappe.throw("Failed to build query")
 
+        if memoize:
+            set_built_query(build_key, ibis_query)
         return ibis_query
 
     @frappe.whitelist()
@@ -152,19 +219,61 @@ class InsightsQueryv3(Document):
         force: bool = False,
         page: int = 1,
         page_size: int = 100,
+        cursor: dict | None = None,
     ):
         with set_adhoc_filters(adhoc_filters):
             ibis_query = self.build(active_operation_idx)
 
+        # queries that end in an ORDER BY are paged by seeking past the previous page
+        keys = get_keyset(ibis_query)
+        cursor = frappe.parse_json(cursor) if keys and cursor else None
+        if cursor and len(cursor.get("values") or []) != len(keys):
+            cursor = None
+
+        paged_query = ibis_query
+        if cursor:
+            paged_query = seek_query(ibis_query, keys, cursor, page_size)
+        elif keys:
+            paged_query = order_by_keyset(ibis_query, keys)
+
         results, time_taken = execute_ibis_query(
-            ibis_query,
+            paged_query,
             page=page,
             page_size=page_size,
+            paginate=not cursor,
             force=force,
             cache_expiry=60 * 10,
             reference_doctype=self.doctype,
             reference_name=self.name,
         )
+        response = self.get_results_response(ibis_query, results, time_taken)
+        if keys:
+            response["next_cursor"] = get_next_cursor(keys, response["rows"], page_size, cursor)
+        return response
+
+    @frappe.whitelist()
+    def submit_execution(
+        self,
+        active_operation_idx: int | None = None,
+        adhoc_filters: dict | None = None,
+        force: bool = False,
+        page: int = 1,
+        page_size: int = 100,
+        cursor: dict | None = None,
+    ):
+        """Execute in a background job, see `query_jobs`. Returns the state of the job."""
+        return submit_execution(
+            self,
+            active_operation_idx=active_operation_idx,
+            adhoc_filters=frappe.parse_json(adhoc_filters),
+            force=frappe.parse_json(force),
+            page=page,
+            page_size=page_size,
+            cursor=frappe.parse_json(cursor),
+        )
+
+    def get_results_response(self, ibis_query, results, time_taken) -> dict:
+        truncated = bool(results.attrs.get("truncated"))
         results = results.to_dict(orient="records")
 
         columns = get_columns_from_schema(ibis_query.schema())
@@ -177,11 +286,12 @@ class InsightsQueryv3(Document):
                     break
 
         return {
-            "sql": ibis.to_sql(ibis_query),
+            "sql": get_compiled_sql(ibis_query),
             "columns": columns,
             "rows": results,
             "time_taken": time_taken,
             "is_aggregated_sql": _sql_has_group_by(sql) if sql else False,
+            "truncated": truncated,
         }
 
     @insights_whitelist()
@@ -192,37 +302,57 @@ class InsightsQueryv3(Document):
         return sqlparse.format(str(raw_sql), reindent=True, keyword_case="upper")
 
     @insights_whitelist()
-    def get_count(self, active_operation_idx: int | None = None, adhoc_filters: dict | None = None):
+    def get_count(
+        self,
+        active_operation_idx: int | None = None,
+        adhoc_filters: dict | None = None,
+        approximate: bool = False,
+    ):
+        """Return the number of rows of the query.
+
+        With `approximate`, a count that is not cached is estimated from the query plan
+        and returned as `{"count", "approximate"}` right away, while the exact count is
+        computed in a background job and published as `insights_query_count`.
+        """
         with set_adhoc_filters(adhoc_filters):
             ibis_query = self.build(active_operation_idx)
 
         count_query = ibis_query.aggregate(count=_.count())
+        if approximate:
+            cached = get_cached_query_results(count_query)
+            estimate = estimate_row_count(ibis_query) if cached is None else None
+            if estimate is not None:
+                job_key = make_digest(ibis.to_sql(count_query), frappe.session.user)
+                frappe.enqueue(
+                    count_query_results,
+                    query=self.name,
+                    active_operation_idx=active_operation_idx,
+                    adhoc_filters=adhoc_filters,
+                    job_id=f"insights_query_count:{job_key}",
+                    deduplicate=True,
+                )
+                return {"count": estimate, "approximate": True}
+
         count_results, _time_taken = execute_ibis_query(
             count_query,
             cache_expiry=60 * 5,
             reference_doctype=self.doctype,
             reference_name=self.name,
         )
-        total_count = count_results.values[0][0]
-        return int(total_count)
+        total_count = int(count_results.values[0][0])
+        if approximate:
+            return {"count": total_count, "approximate": False}
+        return total_count
 
     @insights_whitelist()
     def download_results(
         self, format: str = "csv", active_operation_idx: int | None = None, adhoc_filters: dict | None = None
     ):
+        """Return the first 100,000 rows, for guests of public queries who cannot read exported files."""
         with set_adhoc_filters(adhoc_filters):
             ibis_query = self.build(active_operation_idx)
 
-        import ibis.expr.datatypes as dt
-
-        decimal_casts = {
-            col: ibis_query[col].cast("float64")
-            for col in ibis_query.columns
-            if isinstance(ibis_query[col].type(), dt.Decimal)
-        }
-        if decimal_casts:
-            ibis_query = ibis_query.mutate(**decimal_casts)
-
+        ibis_query = cast_decimals(ibis_query)
         if hasattr(ibis_query, "limit"):
             ibis_query = ibis_query.limit(100_000)
 
@@ -242,6 +372,13 @@ class InsightsQueryv3(Document):
         else:
             return results.to_csv(index=False)
 
+    @insights_whitelist()
+    def export_results(
+        self, format: str = "csv", active_operation_idx: int | None = None, adhoc_filters: dict | None = None
+    ):
+        """Export all the results in a background job, see `result_export`."""
+        return enqueue_export(self, format, active_operation_idx, adhoc_filters)
+
     @insights_whitelist()
     def get_distinct_column_values(
         self,
@@ -252,7 +389,15 @@ class InsightsQueryv3(Document):
         adhoc_filters: dict | None = None,
     ):
         with set_adhoc_filters(adhoc_filters):
-            ibis_query = self.build(active_operation_idx)
+            # low-cardinality columns of imported tables have their values in the table stats
+            stored_values = IbisQueryBuilder(self, active_operation_idx).get_stored_column_values(column_name)
+            if stored_values is None:
+                ibis_query = self.build(active_operation_idx)
+
+        if stored_values is not None:
+            if search_term:
+                stored_values = [v for v in stored_values if search_term.lower() in str(v).lower()]
+            return stored_values[:limit]
 
         values_query = (
             ibis_query.select(column_name)
@@ -362,6 +507,14 @@ class InsightsQueryv3(Document):
             "is_analyze": use_analyze,
         }
 
+    @insights_whitelist(role="Insights Admin")
+    def refresh_materialization(self):
+        """Write the results of this query to the data store again"""
+        if not self.is_materialized:
+            frappe.throw("Query results are not materialized")
+        enqueue_materialization(self.name)
+        return {"message": "Refreshing materialized results"}
+
     @insights_whitelist(role="Insights Admin")
     def refresh_stored_tables(self):
         """Import all source tables used in this query to the data store"""
@@ -470,3 +623,21 @@ def set_adhoc_filters(filters):
     frappe.local.insights_adhoc_filters = filters or current or {}
     yield
     frappe.local.insights_adhoc_filters = None
+
+
+def count_query_results(query: str, active_operation_idx=None, adhoc_filters=None):
+    # enqueued by `get_count` with `approximate`, the exact count is cached for its next call
+    doc = frappe.get_doc("Insights Query v3", query)
+    with db_connections():
+        count = doc.get_count(active_operation_idx, adhoc_filters)
+
+    frappe.publish_realtime(
+        event="insights_query_count",
+        user=frappe.session.user,
+        message={
+            "query": query,
+            "active_operation_idx": active_operation_idx,
+            "adhoc_filters": adhoc_filters,
+            "count": count,
+        },
+    )
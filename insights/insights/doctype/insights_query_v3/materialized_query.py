@@ -0,0 +1,198 @@
+"""Materialized queries: results of a query kept in the warehouse for the queries built on it.
+
+The results of a query marked `is_materialized` are written to a file of the
+warehouse of its own by a background job. The job runs on the refresh schedule
+of the query, after the query is changed and, with `refresh_on_source_change`,
+after a data store table or another materialized query it reads is refreshed.
+
+Queries built on a materialized query read its results instead of building it,
+unless they use the live connection, or permissions or adhoc filters would have to
+be applied to it. Results written for other operations of the query are not read,
+saves that leave them as they were do not refresh the query.
+"""
+
+from contextlib import nullcontext, suppress
+
+import frappe
+from frappe.utils import get_datetime, now_datetime
+from ibis.expr.types import Table
+
+from insights.cache_utils import make_digest
+from insights.insights.doctype.insights_data_source_v3.admission import admit_query
+from insights.insights.doctype.insights_data_source_v3.materialization import (
+    drop_materializations,
+    read_materialization,
+    write_materialization,
+)
+from insights.insights.doctype.insights_query_v3.build_cache import (
+    get_source_table_versions,
+    permissions_applied,
+)
+from insights.insights.query_utils import get_direct_dependencies
+
+MATERIALIZED_QUERY_SCHEMA_PREFIX = "insights_query_"
+MATERIALIZATION_FIELDS = (
+    "materialized_at",
+    "materialized_rows",
+    "materialized_sources",
+    "materialized_signature",
+)
+REFRESH_INTERVALS = {"Hourly": 60 * 60, "Daily": 24 * 60 * 60, "Weekly": 7 * 24 * 60 * 60}
+REFRESH_TIMEOUT = 60 * 60
+# a query that failed to materialize is not refreshed again by the scheduler for this long
+RETRY_AFTER = 60 * 60
+FAILED_KEY_PREFIX = "insights:materialized_query:failed:"
+
+
+def get_materialized_query_table(doc) -> Table | None:
+    """Return the materialized results of the query, None if the query has to be built instead."""
+    if not doc.is_materialized or not doc.materialized_at:
+        return None
+    # written for other operations of the query
+    if doc.materialized_signature != get_definition_signature(doc):
+        return None
+    # permissions and adhoc filters are applied while building, not to the materialized results
+    adhoc_filters = getattr(frappe.local, "insights_adhoc_filters", None) or {}
+    if permissions_applied() or adhoc_filters.get(doc.name):
+        return None
+
+    return read_materialization(get_schema_name(doc.name))
+
+
+def enqueue_materialization(query: str) -> None:
+    frappe.enqueue(
+        materialize_query,
+        queue="long",
+        timeout=REFRESH_TIMEOUT,
+        job_id=f"insights_materialize_query:{frappe.local.site}:{query}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        query=query,
+    )
+
+
+def materialize_query(query: str) -> None:
+    """Write the results of the query to the warehouse, replacing the ones written before."""
+    from insights.insights.doctype.insights_data_source_v3.ibis_utils import get_query_data_source
+    from insights.insights.doctype.insights_data_source_v3.insights_data_source_v3 import db_connections
+
+    doc = frappe.get_doc("Insights Query v3", query)
+    if not doc.is_materialized:
+        return
+
+    # read before building, so a change made while the results are written is refreshed again
+    started_at = now_datetime()
+    sources = get_source_versions(doc)
+    signature = get_definition_signature(doc)
+    try:
+        with db_connections():
+            ibis_query = doc.build()
+            data_source = get_query_data_source(ibis_query)
+            with admit_query(data_source) if data_source else nullcontext():
+                rows = write_materialization(ibis_query, get_schema_name(doc.name), budgeted=False)
+    except Exception:
+        frappe.cache().set_value(FAILED_KEY_PREFIX + doc.name, True, expires_in_sec=RETRY_AFTER)
+        raise
+
+    frappe.cache().delete_value(FAILED_KEY_PREFIX + doc.name)
+    # unmarked while the results were written
+    if not frappe.db.get_value("Insights Query v3", doc.name, "is_materialized"):
+        drop_materialization(doc.name)
+        return
+
+    doc.db_set(
+        {
+            "materialized_at": started_at,
+            "materialized_rows": rows,
+            "materialized_sources": sources,
+            "materialized_signature": signature,
+        },
+        update_modified=False,
+    )
+
+
+def refresh_materialized_queries():
+    # called via hooks
+    queries = frappe.get_all(
+        "Insights Query v3",
+        filters={"is_materialized": 1},
+        fields=[
+            "name",
+            "operations",
+            "use_live_connection",
+            "refresh_interval",
+            "refresh_on_source_change",
+            *MATERIALIZATION_FIELDS,
+        ],
+    )
+    for query in queries:
+        if frappe.cache().get_value(FAILED_KEY_PREFIX + query.name):
+            continue
+        if is_refresh_due(query):
+            enqueue_materialization(query.name)
+
+
+def is_refresh_due(query) -> bool:
+    if not query.materialized_at or query.materialized_signature != get_definition_signature(query):
+        return True
+
+    interval = REFRESH_INTERVALS.get(query.refresh_interval, REFRESH_INTERVALS["Daily"])
+    if (now_datetime() - get_datetime(query.materialized_at)).total_seconds() >= interval:
+        return True
+
+    return bool(query.refresh_on_source_change) and get_source_versions(query) != query.materialized_sources
+
+
+def get_definition_signature(doc) -> str:
+    """Return a digest of the operations of the query and the connection it reads through.
+
+    Variables are left out, they are not read by the scheduler; results written before
+    they change are dropped from the signature on save instead.
+    """
+    operations = frappe.parse_json(doc.operations or "[]")
+    return make_digest(frappe.as_json(operations), int(bool(doc.use_live_connection)))
+
+
+def get_variables(doc) -> list[tuple]:
+    return [(v.variable_name, v.variable_value) for v in (doc.get("variables") or [])] if doc else []
+
+
+def get_source_versions(doc) -> str:
+    """Return a digest of the versions of what the query reads.
+
+    Those are the data store tables it reads, and when the materialized queries it
+    reads were last refreshed. Queries read from their materialized results do not
+    add what they read themselves.
+    """
+    query_names = {doc.name}
+    materialized = []
+    seen = set()
+    stack = list(get_direct_dependencies(doc.name))
+    while stack:
+        name = stack.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+
+        materialized_at = frappe.db.get_value(
+            "Insights Query v3", {"name": name, "is_materialized": 1}, "materialized_at"
+        )
+        if materialized_at:
+            materialized.append((name, str(materialized_at)))
+            continue
+
+        query_names.add(name)
+        stack.extend(get_direct_dependencies(name))
+
+    table_versions = [] if doc.use_live_connection else get_source_table_versions(query_names)
+    return make_digest(frappe.as_json(table_versions), frappe.as_json(sorted(materialized)))
+
+
+def drop_materialization(query: str) -> None:
+    # a refresh being written adds its file after, and is not read once the query is not materialized
+    with suppress(Exception):
+        drop_materializations(get_schema_name(query))
+
+
+def get_schema_name(query: str) -> str:
+    return f"{MATERIALIZED_QUERY_SCHEMA_PREFIX}{frappe.scrub(query)}"
@@ -0,0 +1,259 @@
+"""Asynchronous execution of Insights Query v3.
+
+A submitted execution runs in a background job instead of the web worker, on the
+short queue so it does not wait behind imports and exports. The job builds the
+query as the client sent it, unsaved changes included, the way `execute` does. Its
+state is kept in Redis under the job id and published to the user as it changes:
+queued, running, then finished, failed or cancelled. The results of a finished job
+are kept for `JOB_TTL` to be fetched once the client is notified.
+
+While a running job fetches results in batches, the rows fetched so far are
+published at most every `PROGRESS_INTERVAL` seconds. Pages are fetched in one go
+and report their rows once fetched.
+
+Cancelling a running job stops the statement where it runs: `KILL QUERY` on
+MariaDB and `pg_cancel_backend` on PostgreSQL, issued over a new connection to the
+host the job runs on, and an interrupt of the warehouse connection from within
+the job.
+"""
+
+import threading
+import time
+from contextlib import closing, contextmanager
+
+import frappe
+from frappe.utils import now
+
+from insights.insights.doctype.insights_data_source_v3.data_warehouse import is_warehouse
+from insights.insights.doctype.insights_data_source_v3.ibis_utils import get_live_data_source
+from insights.insights.doctype.insights_data_source_v3.insights_data_source_v3 import db_connections
+from insights.insights.doctype.insights_data_source_v3.replicas import get_replica_doc
+from insights.utils import InsightsDataSourcev3
+
+JOB_KEY_PREFIX = "insights:query_job:"
+RESULT_KEY_PREFIX = "insights:query_job_result:"
+CANCEL_KEY_PREFIX = "insights:query_job_cancel:"
+JOB_TTL = 10 * 60
+CANCEL_POLL_INTERVAL = 0.5
+PROGRESS_INTERVAL = 1
+# interactive executions, not the long queue of imports, exports and materializations
+QUERY_JOB_QUEUE = "short"
+FINAL_STATUSES = ("finished", "failed", "cancelled")
+
+
+def submit_execution(doc, **execute_args) -> dict:
+    """Enqueue `doc.execute(**execute_args)` and return the state of the job.
+
+    `doc` is the query as the client sent it, which may not have been saved yet.
+    """
+    job_id = frappe.generate_hash(length=16)
+    state = set_job_state(
+        job_id,
+        {
+            "job_id": job_id,
+            "query": doc.name,
+            "user": frappe.session.user,
+            "status": "queued",
+            "queued_at": now(),
+        },
+    )
+
+    max_execution_time = (
+        frappe.db.get_single_value("Insights Settings", "max_execution_time", cache=True) or 180
+    )
+    frappe.enqueue(
+        run_query_job,
+        queue=QUERY_JOB_QUEUE,
+        timeout=max_execution_time + 60,
+        query_job_id=job_id,
+        doc=doc.as_dict(),
+        execute_args=execute_args,
+    )
+    return state
+
+
+def run_query_job(query_job_id: str, doc: dict, execute_args: dict):
+    # not `job_id`, which frappe.enqueue takes for itself
+    from insights.insights.doctype.insights_query_v3.insights_query_v3 import set_adhoc_filters
+
+    if is_cancel_requested(query_job_id):
+        update_job_state(query_job_id, status="cancelled", finished_at=now())
+        return
+
+    # what the client sent, not what was last saved
+    doc = frappe.get_doc(doc)
+    with db_connections():
+        try:
+            with set_adhoc_filters(execute_args.get("adhoc_filters")):
+                ibis_query = doc.build(execute_args.get("active_operation_idx"))
+
+            backend = ibis_query.get_backend()
+            cancel_handle = get_cancel_handle(ibis_query)
+            update_job_state(query_job_id, status="running", started_at=now(), **cancel_handle)
+            # a cancel that came in before the handle was published could not kill anything
+            if is_cancel_requested(query_job_id):
+                update_job_state(query_job_id, status="cancelled", finished_at=now())
+                return
+
+            with (
+                interrupt_on_cancel(query_job_id, backend if is_warehouse(backend) else None),
+                report_progress(query_job_id),
+            ):
+                response = doc.execute(**execute_args)
+        except Exception as e:
+            if is_cancel_requested(query_job_id):
+                update_job_state(query_job_id, status="cancelled", finished_at=now())
+            else:
+                update_job_state(query_job_id, status="failed", error=str(e), finished_at=now())
+            return
+
+    frappe.cache().set_value(RESULT_KEY_PREFIX + query_job_id, response, expires_in_sec=JOB_TTL)
+    update_job_state(
+        query_job_id,
+        status="finished",
+        rows_fetched=len(response["rows"]),
+        time_taken=response["time_taken"],
+        finished_at=now(),
+    )
+
+
+def get_cancel_handle(ibis_query) -> dict:
+    """Return what is needed to cancel the query's statement from another worker."""
+    data_source = get_live_data_source(ibis_query)
+    if not data_source:
+        return {}
+
+    database_type = frappe.db.get_value("Insights Data Source v3", data_source, "database_type", cache=True)
+    sql = "SELECT CONNECTION_ID()" if database_type == "MariaDB" else "SELECT pg_backend_pid()"
+    backend = ibis_query.get_backend()
+    try:
+        with closing(backend.raw_sql(sql)) as cursor:
+            connection_id = cursor.fetchone()[0]
+    except Exception:
+        return {}
+
+    replica = getattr(backend, "_insights_replica", None)
+    return {
+        "data_source": data_source,
+        "database_type": database_type,
+        "connection_id": int(connection_id),
+        "replica": replica.host if replica else None,
+    }
+
+
+@contextmanager
+def report_progress(job_id: str):
+    """Publish the rows fetched so far while the job fetches results, see `fetch_results`."""
+    last_reported = 0
+
+    def on_progress(rows: int):
+        nonlocal last_reported
+        if time.monotonic() - last_reported >= PROGRESS_INTERVAL:
+            last_reported = time.monotonic()
+            update_job_state(job_id, rows_fetched=rows)
+
+    frappe.local.insights_fetch_progress = on_progress
+    try:
+        yield
+    finally:
+        frappe.local.insights_fetch_progress = None
+
+
+@contextmanager
+def interrupt_on_cancel(job_id: str, backend=None):
+    """Interrupt the warehouse connection from a watcher thread once the job is cancelled.
+
+    DuckDB runs in this process, so there is no statement to kill from another worker.
+    """
+    if backend is None:
+        yield
+        return
+
+    cache = frappe.cache()
+    # made here, the watcher thread must not touch frappe.local
+    cancel_key = cache.make_key(CANCEL_KEY_PREFIX + job_id)
+    stop = threading.Event()
+
+    def watch():
+        while not stop.wait(CANCEL_POLL_INTERVAL):
+            if cache.get(cancel_key) is not None:
+                backend.con.interrupt()
+                return
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        watcher.join()
+
+
+def cancel_job(job_id: str) -> dict:
+    state = get_job_state(job_id)
+    if state.status in FINAL_STATUSES:
+        return state
+
+    cache = frappe.cache()
+    cache.set(cache.make_key(CANCEL_KEY_PREFIX + job_id), 1, ex=JOB_TTL)
+
+    state = get_job_state(job_id)
+    if state.status == "queued":
+        return update_job_state(job_id, status="cancelled", finished_at=now())
+    if state.status == "running" and state.get("connection_id"):
+        kill_statement(state)
+    return state
+
+
+def kill_statement(state: dict):
+    doc = InsightsDataSourcev3.get_doc(state["data_source"])
+    if state.get("replica"):
+        # the statement runs on the replica the job was connected to
+        doc = get_replica_doc(doc, state["replica"])
+    connection = doc.open_connection()
+    try:
+        connection_id = int(state["connection_id"])
+        if state["database_type"] == "MariaDB":
+            sql = f"KILL QUERY {connection_id}"
+        else:
+            sql = f"SELECT pg_cancel_backend({connection_id})"
+        with closing(connection.raw_sql(sql)):
+            pass
+    except Exception:
+        frappe.log_error(title=f"Failed to cancel query on {state['data_source']}")
+    finally:
+        connection.disconnect()
+
+
+def is_cancel_requested(job_id: str) -> bool:
+    cache = frappe.cache()
+    return cache.get(cache.make_key(CANCEL_KEY_PREFIX + job_id)) is not None
+
+
+def get_job_state(job_id: str) -> frappe._dict:
+    state = frappe.cache().get_value(JOB_KEY_PREFIX + job_id, expires=True)
+    if not state:
+        frappe.throw(f"Query job {job_id} not found or expired", frappe.DoesNotExistError)
+    if state["user"] != frappe.session.user and frappe.session.user != "Administrator":
+        raise frappe.PermissionError
+    return frappe._dict(state)
+
+
+def get_job_results(job_id: str) -> dict:
+    state = get_job_state(job_id)
+    if state.status != "finished":
+        frappe.throw(f"Query job {job_id} is {state.status}, results are not available")
+    return frappe.cache().get_value(RESULT_KEY_PREFIX + job_id, expires=True)
+
+
+def update_job_state(job_id: str, **updates) -> dict:
+    state = frappe.cache().get_value(JOB_KEY_PREFIX + job_id, expires=True) or {}
+    if state.get("status") in FINAL_STATUSES:
+        return state
+    return set_job_state(job_id, {**state, **updates})
+
+
+def set_job_state(job_id: str, state: dict) -> dict:
+    frappe.cache().set_value(JOB_KEY_PREFIX + job_id, state, expires_in_sec=JOB_TTL)
+    frappe.publish_realtime(event="insights_query_job", message=state, user=state["user"])
+    return state
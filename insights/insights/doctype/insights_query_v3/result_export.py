@@ -0,0 +1,221 @@
+"""Background export of query results to a private File.
+
+Results are streamed from the backend as Arrow record batches and written to the
+file batch by batch, so an export of any size never holds more than a batch in
+memory. MySQL and MariaDB results are read over an unbuffered cursor for that,
+see `read_remote_batches`. The file is written under the site's private files,
+and the user is notified once it is ready to download. It is not attached to the
+query: results can be filtered by the permissions of the user who exported them,
+so the file is only readable by its owner. The app listens for
+`insights_export_ready` and `insights_export_failed` to download the file or stop
+waiting for it.
+"""
+
+import hashlib
+import os
+from contextlib import suppress
+
+import frappe
+import ibis.expr.datatypes as dt
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from frappe.desk.doctype.notification_log.notification_log import make_notification_logs
+from frappe.utils import add_days, now
+
+from insights import create_toast
+from insights.insights.doctype.insights_data_source_v3.data_warehouse import read_remote_batches
+from insights.insights.doctype.insights_data_source_v3.insights_data_source_v3 import db_connections
+
+EXPORT_FORMATS = {
+    "csv": "csv",
+    "parquet": "parquet",
+    "excel": "xlsx",
+}
+BATCH_SIZE = 50_000
+# a sheet holds 1,048,576 rows, one is the header
+MAX_EXCEL_ROWS = 1_048_575
+EXPORT_TIMEOUT = 2 * 60 * 60
+EXPORT_RETENTION_DAYS = 7
+EXPORT_FILE_PREFIX = "insights-export-"
+
+
+def enqueue_export(doc, format="csv", active_operation_idx=None, adhoc_filters=None) -> str:
+    """Enqueue the export and return its id, which the realtime events about it carry."""
+    if format not in EXPORT_FORMATS:
+        frappe.throw(f"Unsupported export format: {format}")
+
+    export_id = frappe.generate_hash(length=12)
+    frappe.enqueue(
+        export_results,
+        queue="long",
+        timeout=EXPORT_TIMEOUT,
+        query=doc.name,
+        format=format,
+        active_operation_idx=active_operation_idx,
+        adhoc_filters=adhoc_filters,
+        export_id=export_id,
+    )
+    return export_id
+
+
+def export_results(
+    query: str, format="csv", active_operation_idx=None, adhoc_filters=None, export_id: str | None = None
+):
+    from insights.insights.doctype.insights_query_v3.insights_query_v3 import set_adhoc_filters
+
+    doc = frappe.get_doc("Insights Query v3", query)
+    title = doc.title or doc.name
+    file_name = f"{EXPORT_FILE_PREFIX}{frappe.scrub(title)}-{frappe.generate_hash(length=6)}"
+    file_name = f"{file_name}.{EXPORT_FORMATS[format]}"
+    path = frappe.get_site_path("private", "files", file_name)
+
+    try:
+        with db_connections():
+            with set_adhoc_filters(adhoc_filters):
+                ibis_query = cast_decimals(doc.build(active_operation_idx))
+            reader = read_remote_batches(ibis_query, chunk_size=BATCH_SIZE)
+            rows = write_export(reader, path, format)
+
+        file = save_export(path, file_name)
+    except Exception as e:
+        with suppress(FileNotFoundError):
+            os.remove(path)
+        frappe.log_error(title=f"Failed to export results of {title}")
+        create_toast(
+            title="Export Failed",
+            message=f"Could not export the results of {title}: {e!s}",
+            type="error",
+        )
+        frappe.publish_realtime(
+            event="insights_export_failed",
+            user=frappe.session.user,
+            message={"export_id": export_id, "query": doc.name, "error": str(e)},
+        )
+        raise
+
+    notify_export_ready(doc, file, rows, export_id)
+    return file.file_url
+
+
+def cast_decimals(ibis_query):
+    # decimals have no native type in csv and excel, and mixed precision breaks parquet readers
+    decimal_casts = {
+        col: ibis_query[col].cast("float64")
+        for col in ibis_query.columns
+        if isinstance(ibis_query[col].type(), dt.Decimal)
+    }
+    if decimal_casts:
+        ibis_query = ibis_query.mutate(**decimal_casts)
+    return ibis_query
+
+
+def write_export(reader: pa.RecordBatchReader, path: str, format: str) -> int:
+    """Write every batch of the reader to the file at `path`, returning the rows written."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if format == "excel":
+        return write_excel(reader, path)
+
+    rows = 0
+    writer_class = pq.ParquetWriter if format == "parquet" else pa_csv.CSVWriter
+    kwargs = {"compression": "zstd"} if format == "parquet" else {}
+    with writer_class(path, reader.schema, **kwargs) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def write_excel(reader: pa.RecordBatchReader, path: str) -> int:
+    from openpyxl import Workbook
+
+    # write-only workbooks flush rows to disk as they are appended
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(reader.schema.names)
+
+    rows = 0
+    for batch in reader:
+        rows += batch.num_rows
+        if rows > MAX_EXCEL_ROWS:
+            frappe.throw(
+                f"Results have more than {MAX_EXCEL_ROWS:,} rows, which do not fit in an Excel sheet. "
+                "Please export them as CSV or Parquet instead."
+            )
+        columns = [column.to_pylist() for column in batch.columns]
+        for row in zip(*columns, strict=True):
+            sheet.append(row)
+
+    workbook.save(path)
+    return rows
+
+
+def save_export(path: str, file_name: str):
+    # a private file attached to nothing is only readable by its owner
+    file = frappe.get_doc(
+        {
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": f"/private/files/{file_name}",
+            "is_private": 1,
+            "file_size": os.path.getsize(path),
+            # set here, File would otherwise read the whole file into memory to hash it
+            "content_hash": get_file_hash(path),
+        }
+    )
+    file.insert(ignore_permissions=True)
+    return file
+
+
+def get_file_hash(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def notify_export_ready(doc, file, rows: int, export_id: str | None = None):
+    title = doc.title or doc.name
+    make_notification_logs(
+        {
+            "subject": f"Export of {title} ({rows:,} rows) is ready to download",
+            "type": "Alert",
+            "document_type": file.doctype,
+            "document_name": file.name,
+            "from_user": frappe.session.user,
+        },
+        [frappe.session.user],
+    )
+    create_toast(
+        title="Export Ready",
+        message=f"Export of {title} ({rows:,} rows) is ready to download",
+        type="success",
+    )
+    frappe.publish_realtime(
+        event="insights_export_ready",
+        user=frappe.session.user,
+        message={
+            "export_id": export_id,
+            "query": doc.name,
+            "file_url": file.file_url,
+            "file_name": file.file_name,
+            "rows": rows,
+        },
+    )
+
+
+def delete_old_exports():
+    # called daily via hooks
+    files = frappe.get_all(
+        "File",
+        filters={
+            "is_private": 1,
+            "file_name": ["like", f"{EXPORT_FILE_PREFIX}%"],
+            "creation": ["<", add_days(now(), -EXPORT_RETENTION_DAYS)],
+        },
+        pluck="name",
+    )
+    for name in files:
+        frappe.delete_doc("File", name, ignore_permissions=True)
@@ -1,9 +1,153 @@
 # Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
+import ibis
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from insights.insights.doctype.insights_data_source_v3.ibis_utils import paginate_query
+from insights.insights.doctype.insights_query_v3 import insights_query_v3, materialized_query
+from insights.insights.doctype.insights_query_v3.insights_query_v3 import InsightsQueryv3
+from insights.insights.doctype.insights_query_v3.materialized_query import (
+    get_definition_signature,
+    get_materialized_query_table,
+    is_refresh_due,
+)
+
+
+def execute_ibis_query(query, page=1, page_size=100, paginate=True, **kwargs):
+    if paginate:
+        query = paginate_query(query, page, page_size)
+    return query.to_pandas(), 0.1
 
 
 class TestInsightsQueryv3(FrappeTestCase):
-    pass
+    def setUp(self):
+        self.db = ibis.duckdb.connect()
+        self.table = self.db.create_table(
+            "orders",
+            {"id": list(range(1, 8)), "status": ["a", "b", "a", None, "b", "a", "c"]},
+        )
+        self.doc = frappe.get_doc({"doctype": "Insights Query v3", "title": "Orders", "operations": "[]"})
+
+        patches = [
+            patch.object(insights_query_v3, "execute_ibis_query", side_effect=execute_ibis_query),
+            patch.object(InsightsQueryv3, "build", side_effect=lambda *args: self.query),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def test_ordered_results_are_paged_by_cursor(self):
+        self.query = self.table.order_by(self.table.status)
+
+        pages = [self.doc.execute(page_size=3)]
+        while pages[-1]["next_cursor"]:
+            # the frontend sends the cursor back as JSON
+            cursor = frappe.as_json(pages[-1]["next_cursor"])
+            pages.append(self.doc.execute(page_size=3, cursor=cursor))
+
+        rows = [row for page in pages for row in page["rows"]]
+        self.assertEqual(sorted(row["id"] for row in rows), list(range(1, 8)))
+        self.assertEqual([row["status"] for row in rows], ["a", "a", "a", "b", "b", "c", None])
+        self.assertEqual([len(page["rows"]) for page in pages], [3, 3, 1])
+        self.assertEqual(pages[0]["next_cursor"], {"values": ["a"], "skip": 3})
+
+    def test_unordered_results_have_no_cursor(self):
+        self.query = self.table.filter(self.table.id > 2)
+
+        response = self.doc.execute(page_size=3, cursor={"values": ["a"], "skip": 1})
+
+        self.assertNotIn("next_cursor", response)
+        self.assertEqual([row["id"] for row in response["rows"]], [3, 4, 5])
+
+    def test_cursor_for_other_keys_is_ignored(self):
+        self.query = self.table.order_by(self.table.id)
+
+        # sent before the query was sorted by another column
+        response = self.doc.execute(page_size=3, cursor={"values": ["a", 1], "skip": 1})
+
+        self.assertEqual([row["id"] for row in response["rows"]], [1, 2, 3])
+        self.assertEqual(response["next_cursor"], {"values": [3], "skip": 1})
+
+    def test_approximate_count_is_estimated_and_counted_in_background(self):
+        self.query = self.table
+
+        with (
+            patch.object(insights_query_v3, "get_cached_query_results", return_value=None),
+            patch.object(insights_query_v3, "estimate_row_count", return_value=10),
+            patch.object(frappe, "enqueue") as enqueue,
+        ):
+            self.assertEqual(self.doc.get_count(approximate=True), {"count": 10, "approximate": True})
+            enqueue.assert_called_once()
+
+    def test_approximate_count_falls_back_to_exact_count(self):
+        self.query = self.table
+
+        with (
+            patch.object(insights_query_v3, "get_cached_query_results", return_value=None),
+            patch.object(insights_query_v3, "estimate_row_count", return_value=None),
+            patch.object(frappe, "enqueue") as enqueue,
+        ):
+            self.assertEqual(self.doc.get_count(approximate=True), {"count": 7, "approximate": False})
+            self.assertEqual(self.doc.get_count(), 7)
+            enqueue.assert_not_called()
+
+
+class TestMaterializedQueryUpdates(FrappeTestCase):
+    def setUp(self):
+        query = {
+            "doctype": "Insights Query v3",
+            "name": "orders-query",
+            "title": "Orders",
+            "operations": '[{"type": "source"}]',
+            "is_materialized": 1,
+            "materialized_at": now_datetime(),
+        }
+        query["materialized_signature"] = get_definition_signature(frappe._dict(query))
+        self.doc = frappe.get_doc(query)
+        self.doc._doc_before_save = frappe.get_doc(query)
+
+        patches = [
+            patch.object(insights_query_v3, "enqueue_materialization"),
+            patch.object(InsightsQueryv3, "db_set"),
+            patch.object(materialized_query, "permissions_applied", return_value=False),
+            patch.object(materialized_query, "read_materialization", return_value="results"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.enqueue = insights_query_v3.enqueue_materialization
+        self.db_set = InsightsQueryv3.db_set
+
+    def test_cosmetic_save_keeps_the_results(self):
+        self.doc.title = "All Orders"
+
+        self.doc.update_materialization()
+
+        self.enqueue.assert_not_called()
+        self.assertEqual(get_materialized_query_table(self.doc), "results")
+        self.assertFalse(is_refresh_due(self.doc))
+
+    def test_changed_operations_refresh_the_results(self):
+        self.doc.operations = '[{"type": "source"}, {"type": "limit"}]'
+
+        self.doc.update_materialization()
+
+        self.enqueue.assert_called_once_with(self.doc.name)
+        self.assertIsNone(get_materialized_query_table(self.doc))
+        self.assertTrue(is_refresh_due(self.doc))
+
+    def test_changed_variables_unmark_the_results(self):
+        self.doc.variables = [frappe._dict(variable_name="limit", variable_value="10")]
+
+        self.doc.update_materialization()
+
+        self.db_set.assert_called_once_with("materialized_signature", None, update_modified=False)
+        self.enqueue.assert_called_once_with(self.doc.name)
@@ -0,0 +1,73 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+import ibis
+from frappe.tests.utils import FrappeTestCase
+
+from insights.insights.doctype.insights_data_source_v3.ibis_utils import report_fetch_progress
+from insights.insights.doctype.insights_query_v3 import query_jobs
+from insights.insights.doctype.insights_query_v3.insights_query_v3 import InsightsQueryv3
+from insights.insights.doctype.insights_query_v3.query_jobs import (
+    QUERY_JOB_QUEUE,
+    get_job_results,
+    get_job_state,
+    report_progress,
+    run_query_job,
+    set_job_state,
+    submit_execution,
+)
+
+
+def execute(doc, **kwargs):
+    return {"rows": [{"operations": doc.operations}], "time_taken": 0.1}
+
+
+class TestQueryJobs(FrappeTestCase):
+    def setUp(self):
+        self.db = ibis.duckdb.connect()
+        self.table = self.db.create_table("orders", {"id": [1, 2]})
+
+        patches = [
+            patch.object(frappe, "enqueue", side_effect=lambda method, **kwargs: self.run_job(**kwargs)),
+            patch.object(query_jobs, "get_cancel_handle", return_value={}),
+            patch.object(InsightsQueryv3, "build", side_effect=lambda *args: self.table),
+            patch.object(InsightsQueryv3, "execute", execute),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.db.disconnect()
+
+    def run_job(self, queue, timeout, **kwargs):
+        self.queue = queue
+        run_query_job(**kwargs)
+
+    def test_job_executes_the_operations_sent(self):
+        # edited in the builder, not saved yet
+        doc = frappe.get_doc(
+            {"doctype": "Insights Query v3", "name": "orders-query", "operations": '[{"type": "limit"}]'}
+        )
+
+        job = submit_execution(doc, page=1, page_size=100)
+
+        self.assertEqual(get_job_state(job["job_id"]).status, "finished")
+        self.assertEqual(get_job_results(job["job_id"])["rows"], [{"operations": '[{"type": "limit"}]'}])
+        self.assertEqual(self.queue, QUERY_JOB_QUEUE)
+
+    def test_rows_fetched_are_reported_while_fetching(self):
+        job_id = frappe.generate_hash(length=16)
+        set_job_state(job_id, {"job_id": job_id, "user": frappe.session.user, "status": "running"})
+
+        with report_progress(job_id):
+            report_fetch_progress(50_000)
+            # within the interval of the last report
+            report_fetch_progress(100_000)
+
+        self.assertEqual(get_job_state(job_id).rows_fetched, 50_000)
+        report_fetch_progress(150_000)
+        self.assertEqual(get_job_state(job_id).rows_fetched, 50_000)
@@ -27,6 +27,7 @@ class InsightsSettings(Document):
         max_execution_time: DF.Int
         max_memory_usage: DF.Int
         max_records_to_sync: DF.Int
+        max_result_size: DF.Int
         onboarding_complete: DF.Check
         query_result_expiry: DF.Int
         query_result_limit: DF.Int
@@ -26,14 +26,21 @@ class InsightsTablev3(Document):
         from frappe.types import DF
 
         before_import_script: DF.Code | None
+        cluster_key: DF.Data | None
+        column_stats: DF.JSON | None
         data_source: DF.Link
+        import_mode: DF.Literal["Batched", "Streaming"]
         label: DF.Data
+        last_delete_bookmark: DF.Data | None
         last_sync_bookmark: DF.Data | None
         last_synced_on: DF.Datetime | None
+        row_count: DF.Int
         row_limit: DF.Int
         stored: DF.Check
         sync_cursor_column: DF.Data | None
+        sync_deletes: DF.Check
         sync_from: DF.Datetime | None
+        sync_key_column: DF.Data | None
         sync_mode: DF.Literal["Full", "Incremental"]
         table: DF.Data
     # end: auto-generated types
@@ -61,6 +68,9 @@ class InsightsTablev3(Document):
             # Can't connect right now — skip validation rather than blocking save.
             return
 
+        if self.sync_key_column and self.sync_key_column not in remote.columns:
+            frappe.throw(f"Key Column <b>{self.sync_key_column}</b> does not exist in <b>{self.table}</b>.")
+
         if not self.sync_cursor_column:
             frappe.throw(
                 "Incremental sync requires a Cursor Column. "
@@ -88,7 +98,7 @@ class InsightsTablev3(Document):
             )
 
         col_type = remote[self.sync_cursor_column].type()
-        if not col_type.is_temporal():
+        if not (col_type.is_timestamp() or col_type.is_date()):
             frappe.throw(
                 f"Cursor Column <b>{self.sync_cursor_column}</b> must be a datetime/date column, "
                 f"but its type is <b>{col_type}</b>."
@@ -161,6 +171,9 @@ class InsightsTablev3(Document):
                 "stored": 0,
                 "last_synced_on": None,
                 "last_sync_bookmark": None,
+                "last_delete_bookmark": None,
+                "row_count": 0,
+                "column_stats": None,
             },
             commit=True,
         )
@@ -175,6 +188,22 @@ def get_table_name(data_source, table):
     return md5((data_source + table).encode()).hexdigest()[:10]
 
 
+def get_column_stats(data_source: str, table_name: str) -> dict:
+    """Return the stats computed at the last import of a warehouse table, or an empty dict.
+
+    {"row_count": int, "columns": {column: {null_count, null_fraction, distinct_count, min?, max?, values?}}}
+    """
+    table_doc = frappe.db.get_value(
+        "Insights Table v3",
+        get_table_name(data_source, table_name),
+        ["stored", "column_stats"],
+        as_dict=True,
+    )
+    if not table_doc or not table_doc.stored:
+        return {}
+    return frappe.parse_json(table_doc.column_stats) or {}
+
+
 def get_table_stats(data_source: str, table_name: str) -> dict:
     """Derive usage and sync stats for a warehouse table from existing data.
 
@@ -182,6 +211,8 @@ def get_table_stats(data_source: str, table_name: str) -> dict:
         - last_synced_on: last successful import timestamp
         - last_import_rows: row count from the most recent import
         - last_import_duration: duration (seconds) of the most recent import
+        - row_count: rows in the warehouse table
+        - columns: per-column stats computed at the last import
         - referencing_queries: list of query names/titles that currently reference this table
         - last_executed_on: when the most recent referencing query was last executed
         - execution_count: total executions across all referencing queries
@@ -191,19 +222,6 @@ def get_table_stats(data_source: str, table_name: str) -> dict:
     """
     ImportLog = frappe.qb.DocType("Insights Table Import Log")
 
-    last_import = (
-        frappe.qb.from_(ImportLog)
-        .select(ImportLog.rows_imported, ImportLog.time_taken)
-        .where(
-            (ImportLog.data_source == data_source)
-            & (ImportLog.table_name == table_name)
-            & (ImportLog.status == "Success")
-        )
-        .orderby(ImportLog.creation, order=frappe.qb.desc)
-        .limit(1)
-        .run(as_dict=True)
-    )
-
     import_agg = (
         frappe.qb.from_(ImportLog)
         .select(
@@ -215,18 +233,11 @@ def get_table_stats(data_source: str, table_name: str) -> dict:
         .run(as_dict=True)
     )
 
-    last_synced_on, last_import_rows, last_import_duration = None, 0, 0
-    table_doc = frappe.db.get_value(
-        "Insights Table v3",
-        get_table_name(data_source, table_name),
-        ["last_synced_on"],
-        as_dict=True,
+    last_synced_on = frappe.db.get_value(
+        "Insights Table v3", get_table_name(data_source, table_name), "last_synced_on"
     )
-    if table_doc:
-        last_synced_on = table_doc.last_synced_on
-    if last_import:
-        last_import_rows = last_import[0].get("rows_imported") or 0
-        last_import_duration = last_import[0].get("time_taken") or 0
+    column_stats = get_column_stats(data_source, table_name)
+    last_import = column_stats.get("last_import") or {}
 
     referencing_queries = _get_referencing_queries(data_source, table_name)
     query_names = [q["name"] for q in referencing_queries]
@@ -251,8 +262,10 @@ def get_table_stats(data_source: str, table_name: str) -> dict:
     agg = import_agg[0] if import_agg else {}
     return {
         "last_synced_on": last_synced_on,
-        "last_import_rows": last_import_rows,
-        "last_import_duration": last_import_duration,
+        "last_import_rows": last_import.get("rows") or 0,
+        "last_import_duration": last_import.get("duration") or 0,
+        "row_count": column_stats.get("row_count") or 0,
+        "columns": column_stats.get("columns") or {},
         "total_syncs": agg.get("total_syncs") or 0,
         "total_sync_time": agg.get("total_sync_time") or 0,
         "failed_syncs": agg.get("failed_syncs") or 0,
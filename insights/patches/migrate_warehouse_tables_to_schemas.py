@@ -14,14 +14,17 @@ def execute():
     from duckdb import CatalogException
     from ibis.common.exceptions import TableNotFound
 
+    from insights.insights.doctype.insights_data_source_v3.connectors.duckdb import (
+        get_local_duckdb_connection,
+    )
     from insights.insights.doctype.insights_data_source_v3.data_warehouse import (
         Warehouse,
         get_warehouse_schema_name,
     )
 
-    w = Warehouse()
+    legacy_db_path = Warehouse().get_legacy_db_path()
 
-    if not os.path.exists(w.get_db_path()):
+    if not os.path.exists(legacy_db_path):
         return
 
     stored_tables = frappe.get_all(
@@ -35,7 +38,8 @@ def execute():
 
     logger = frappe.logger()
 
-    with w.get_write_connection() as db:
+    db = get_local_duckdb_connection(legacy_db_path, read_only=False)
+    try:
         for row in stored_tables:
             schema = get_warehouse_schema_name(row.data_source)
             table = frappe.scrub(row.table)
@@ -58,3 +62,5 @@ def execute():
                     f"Insights warehouse: failed to migrate '{legacy_name}' → '{schema}'.'{table}'. "
                     "Manual remediation may be required."
                 )
+    finally:
+        db.disconnect()
@@ -0,0 +1,81 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+# Moves every table of the single-file warehouse (insights.duckdb), and of the
+# per-schema files an earlier layout kept under insights_data_warehouse/schemas/,
+# into a DuckDB file of its own under schemas/<schema>/. The old files are kept
+# with a .migrated suffix once all their tables are copied, and can be deleted manually.
+
+import os
+
+import frappe
+
+
+def execute():
+    from insights.insights.doctype.insights_data_source_v3.data_warehouse import Warehouse
+
+    w = Warehouse()
+
+    legacy_db_path = w.get_legacy_db_path()
+    if os.path.exists(legacy_db_path):
+        split_file(w, legacy_db_path, schema=None)
+
+    for entry in os.scandir(w.get_schemas_path()):
+        if entry.is_file() and entry.name.endswith(".duckdb"):
+            split_file(w, entry.path, schema=entry.name.removesuffix(".duckdb"))
+
+
+def split_file(w, path: str, schema: str | None):
+    """Copy the tables of `schema` in the file, or of every schema if None, to their own files."""
+    from insights.insights.doctype.insights_data_source_v3.connectors.duckdb import (
+        get_local_duckdb_connection,
+    )
+    from insights.insights.doctype.insights_data_source_v3.data_warehouse import escape_sql_path
+
+    # per-schema files keep their tables in main
+    condition = (
+        "table_schema = 'main'"
+        if schema
+        else "table_schema NOT IN ('main', 'information_schema', 'pg_catalog')"
+    )
+    db = get_local_duckdb_connection(path, read_only=True)
+    try:
+        rows = db.raw_sql(
+            f"""
+            SELECT table_schema, table_name
+            FROM information_schema.tables
+            WHERE table_catalog = current_database()
+                AND table_type = 'BASE TABLE'
+                AND {condition}
+            """
+        ).fetchall()
+    finally:
+        db.disconnect()
+
+    logger = frappe.logger()
+    failed = False
+
+    for source_schema, table in rows:
+        target_schema = schema or source_schema
+        try:
+            with w.get_write_connection(target_schema, table, timeout=5 * 60, copy_live_file=False) as db:
+                db.raw_sql(f"ATTACH '{escape_sql_path(path)}' AS old_warehouse (READ_ONLY)")
+                db.raw_sql(
+                    f'CREATE OR REPLACE TABLE main."{table}" AS '
+                    f'SELECT * FROM old_warehouse."{source_schema}"."{table}"'
+                )
+                db.raw_sql("DETACH old_warehouse")
+        except Exception:
+            failed = True
+            logger.exception(
+                f"Insights warehouse: failed to move '{target_schema}.{table}' to its own file. "
+                "Manual remediation may be required."
+            )
+
+    logger.info(f"Insights warehouse: moved {len(rows)} table(s) of {path} to their own files")
+    if failed:
+        return
+
+    os.replace(path, f"{path}.migrated")
+    if os.path.exists(f"{path}.wal"):
+        os.replace(f"{path}.wal", f"{path}.migrated.wal")